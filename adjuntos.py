@@ -0,0 +1,153 @@
+# adjuntos.py
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class CacheAdjuntos:
+    """
+    attachment_id de las imágenes de productos, para mandarlas por ID en
+    lugar de que Facebook vuelva a descargar la URL en cada envío.
+
+    La clave es el ID del producto y se guarda junto con la URL: si el
+    producto cambia de `imagen_url` la entrada deja de servir y se sube la
+    imagen nueva. Las subidas (`subir(url) -> attachment_id`) corren en un
+    hilo aparte, una vez por imagen; mientras tanto se sigue mandando la
+    URL. Con `ruta` los IDs se guardan en SQLite y sobreviven reinicios
+    (y los comparten los workers).
+    """
+
+    def __init__(self, subir, ruta=None, max_cola=1000):
+        self._subir = subir
+        self.ruta = ruta
+        self._ids = {}               # pid -> (url, attachment_id)
+        self._pendientes = set()     # (pid, url) en cola o subiéndose
+        self._cola = queue.Queue(max_cola)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = None
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.subidos = 0
+        self.errores = 0
+
+        if ruta:
+            con = self._con()
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS adjuntos ("
+                " producto TEXT PRIMARY KEY, url TEXT NOT NULL,"
+                " attachment_id TEXT NOT NULL, creado REAL NOT NULL)"
+            )
+            self._ids = {
+                pid: (url, adjunto)
+                for pid, url, adjunto in con.execute("SELECT producto, url, attachment_id FROM adjuntos")
+            }
+
+    def _con(self):
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    # --------------------------------------------------------
+    # CONSULTA
+    # --------------------------------------------------------
+    def obtener(self, pid, url):
+        """attachment_id de la imagen del producto, o None (y se pide subirla)."""
+        guardado = self._ids.get(pid)
+        if guardado is not None and guardado[0] == url:
+            self.aciertos += 1
+            return guardado[1]
+        if self.ruta and guardado is None:
+            # Otro worker pudo haberla subido ya
+            fila = self._con().execute(
+                "SELECT url, attachment_id FROM adjuntos WHERE producto = ?", (pid,)
+            ).fetchone()
+            if fila is not None and fila[0] == url:
+                self._ids[pid] = fila
+                self.aciertos += 1
+                return fila[1]
+        self.fallos += 1
+        self._solicitar(pid, url)
+        return None
+
+    def _solicitar(self, pid, url):
+        with self._lock:
+            if (pid, url) in self._pendientes:
+                return
+            self._iniciar()
+            try:
+                self._cola.put_nowait((pid, url))
+            except queue.Full:
+                return  # se intentará la próxima vez que se muestre
+            self._pendientes.add((pid, url))
+
+    def _iniciar(self):
+        # El hilo se crea en el proceso que sube (no sobrevive al fork)
+        if self._pid == os.getpid():
+            return
+        self._cola = queue.Queue(self._cola.maxsize)
+        self._pendientes.clear()
+        threading.Thread(target=self._trabajar, name="adjuntos", daemon=True).start()
+        self._pid = os.getpid()
+
+    # --------------------------------------------------------
+    # SUBIDA
+    # --------------------------------------------------------
+    def _trabajar(self):
+        cola = self._cola
+        while True:
+            pid, url = cola.get()
+            try:
+                adjunto = self._subir(url)
+            except Exception as e:
+                print("🔥 Error al subir imagen del producto", pid, e)
+                adjunto = None
+            if adjunto:
+                self._guardar(pid, url, adjunto)
+            else:
+                self.errores += 1
+            with self._lock:
+                self._pendientes.discard((pid, url))
+
+    def _guardar(self, pid, url, adjunto):
+        self._ids[pid] = (url, adjunto)
+        self.subidos += 1
+        if not self.ruta:
+            return
+        try:
+            self._con().execute(
+                "INSERT OR REPLACE INTO adjuntos (producto, url, attachment_id, creado)"
+                " VALUES (?, ?, ?, ?)",
+                (pid, url, adjunto, time.time()),
+            )
+        except sqlite3.Error as e:
+            print("🔥 Error al guardar attachment_id:", e)
+
+    def estadisticas(self):
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "subidos": self.subidos,
+            "errores": self.errores,
+            "entradas": len(self._ids),
+        }
+
+
+def crear_adjuntos(subir, url=None):
+    """
+    Crea la caché de adjuntos según ADJUNTOS_URL: "memoria" o
+    "sqlite:///ruta.db" (por defecto sqlite:///adjuntos.db).
+    """
+    url = url or os.getenv("ADJUNTOS_URL", "sqlite:///adjuntos.db")
+    if url == "memoria":
+        return CacheAdjuntos(subir)
+    if url.startswith("sqlite:///"):
+        return CacheAdjuntos(subir, url[len("sqlite:///"):])
+    raise ValueError(f"❌ ADJUNTOS_URL no soportada: {url}")
@@ -1,19 +1,35 @@
+import time
 
-from flask import Flask, request
-import requests
+# Referencia para medir importación -> primera respuesta (arranque en frío)
+ARRANQUE = time.perf_counter()
+
+from flask import Flask, Response, jsonify, request
 import logging
 import os
-import unicodedata
-import string
+import threading
 from datetime import datetime
 
-# Firebase
-from conexion_firebase import obtener_productos
-import firebase_admin
-from firebase_admin import firestore
-
-# Cliente Firestore
-db = firestore.client()
+import metricas
+from cache_ttl import CacheTTL
+from consultas_firebase import buscar_productos, categorias, producto, productos_de, version_catalogo
+from adjuntos import crear_adjuntos
+from despachador import crear_despachador
+from ejecutor import ColaLlena, crear_ejecutor
+from escritura_diferida import crear_escritura
+from idempotencia import crear_registro
+from intenciones import Clasificador
+from busqueda import palabras
+from normalizacion import normalizar, palabras_originales
+from perfiles import perfiles
+from plantillas import Plantillas
+from sesiones import EstadoUsuarios, crear_almacen
+
+# Firestore (o su sustituto en memoria, según FIRESTORE_BACKEND)
+from conexion_firebase import busqueda, catalogo, db
+from conexion_firebase import calentar as calentar_firestore
+
+# Escrituras de pedidos y usuarios en batches, fuera del camino de la respuesta
+escrituras = crear_escritura(db)
 
 # ------------------------------------------------------------
 # CONFIG SERVIDOR
@@ -29,62 +45,85 @@ if not PAGE_ACCESS_TOKEN:
 else:
     print("✅ PAGE_ACCESS_TOKEN cargado correctamente.")
 
-# Estados de usuario en memoria
-user_state = {}
+# Envíos a la Send API en segundo plano (sesión HTTP compartida)
+despachador = crear_despachador(PAGE_ACCESS_TOKEN)
 
+# attachment_id de las imágenes ya subidas (ADJUNTOS_URL)
+adjuntos = crear_adjuntos(despachador.subir_adjunto)
 
-# ------------------------------------------------------------
-# NORMALIZACIÓN DE TEXTO
-# ------------------------------------------------------------
-def normalizar(t):
-    if not t:
-        return ""
-    t = t.lower().strip()
-    t = unicodedata.normalize("NFD", t)
-    t = "".join(c for c in t if not unicodedata.combining(c))
-    t = t.translate(str.maketrans("", "", string.punctuation))
-    t = " ".join(t.split())
-    return t
+# Eventos del webhook en hilos, en orden por usuario (EVENTOS_HILOS)
+ejecutor = crear_ejecutor()
+# EVENTOS_ASINCRONOS=1: se responde 200 a Facebook sin esperar a que se
+# atiendan los eventos (si el proceso muere, esos eventos se pierden)
+EVENTOS_ASINCRONOS = os.environ.get("EVENTOS_ASINCRONOS", "0") == "1"
+
+# Estados de usuario (memoria o archivo compartido, según SESIONES_URL)
+user_state = EstadoUsuarios(crear_almacen())
+
+# Pedidos consultados con "ver pedido" (incluye IDs que no existen)
+cache_pedidos = CacheTTL(
+    maximo=int(os.environ.get("PEDIDOS_CACHE_MAX", 5000)),
+    ttl=float(os.environ.get("PEDIDOS_CACHE_TTL", 30)),
+    ttl_negativo=float(os.environ.get("PEDIDOS_CACHE_TTL_NEGATIVO", 60)),
+)
+
+# Primera página de "mis pedidos" de cada cliente (por teléfono)
+cache_historial = CacheTTL(
+    maximo=int(os.environ.get("MIS_PEDIDOS_CACHE_MAX", 5000)),
+    ttl=float(os.environ.get("MIS_PEDIDOS_CACHE_TTL", 60)),
+)
+PEDIDOS_PAGINA = int(os.environ.get("MIS_PEDIDOS_PAGINA", 5))
+
+# Mensajes ya procesados (Facebook reenvía el webhook si tardamos)
+mensajes_vistos = crear_registro()
+
+# Menús y tarjetas del catálogo ya armados, por versión del catálogo
+plantillas = Plantillas(version_catalogo, producto)
+
+# Recorrido del catálogo: "producto" (un producto por turno con imagen y
+# texto) o "carrusel" (páginas de tarjetas con botón Agregar; se activa
+# con MODO_CATALOGO=carrusel)
+MODO_CATALOGO = os.environ.get("MODO_CATALOGO", "producto")
+TAMANO_CARRUSEL = min(int(os.environ.get("CARRUSEL_TAMANO", 10)), 10)  # máximo de Messenger
+PASO_CATALOGO = TAMANO_CARRUSEL if MODO_CATALOGO == "carrusel" else 1
 
 
 # ------------------------------------------------------------
 # ENVÍO DE MENSAJES
 # ------------------------------------------------------------
 def enviar_mensaje(id_usuario, texto):
-    url = f"https://graph.facebook.com/v18.0/me/messages?access_token={PAGE_ACCESS_TOKEN}"
-    payload = {
-        "recipient": {"id": id_usuario},
-        "message": {"text": texto}
-    }
-    requests.post(url, json=payload)
-
-
-def enviar_imagen(id_usuario, url_img):
-    url = f"https://graph.facebook.com/v18.0/me/messages?access_token={PAGE_ACCESS_TOKEN}"
-    payload = {
-        "recipient": {"id": id_usuario},
-        "message": {
-            "attachment": {
-                "type": "image",
-                "payload": {"url": url_img, "is_reusable": True}
-            }
+    despachador.enviar(id_usuario, {"text": texto})
+
+
+def responder(id_usuario, resp):
+    """Envía lo que devuelve un manejador: texto o un mensaje completo (dict)."""
+    if isinstance(resp, dict):
+        despachador.enviar(id_usuario, resp)
+    else:
+        enviar_mensaje(id_usuario, resp)
+
+
+def enviar_imagen(id_usuario, url_img, pid=None):
+    # Con el attachment_id Facebook no vuelve a descargar la imagen; la
+    # primera vez va la URL y la imagen se sube aparte para la siguiente
+    adjunto = adjuntos.obtener(pid, url_img) if pid else None
+    if adjunto:
+        carga = {"attachment_id": adjunto}
+    else:
+        carga = {"url": url_img, "is_reusable": True}
+    despachador.enviar(id_usuario, {
+        "attachment": {
+            "type": "image",
+            "payload": carga
         }
-    }
-    requests.post(url, json=payload)
+    })
 
 
 # ------------------------------------------------------------
 # AUXILIARES (CATEGORÍAS, PRODUCTOS, CARRITO)
 # ------------------------------------------------------------
 def construir_categorias(sender_id):
-    productos = obtener_productos()
-    categorias = {}
-
-    for p in productos.values():
-        cat = p.get("categoria", "Sin categoria")
-        categorias[cat] = categorias.get(cat, 0) + 1
-
-    lista = list(categorias.keys())
+    lista = categorias()
 
     user_state.setdefault(sender_id, {})
     user_state[sender_id]["estado"] = "elige_categoria"
@@ -94,61 +133,86 @@ def construir_categorias(sender_id):
     if not lista:
         return "😕 No hay categorías con productos disponibles."
 
-    msg = "🛍 *Categorías disponibles:*\n\n"
-    for i, c in enumerate(lista, 1):
-        msg += f"{i}. {c}\n"
+    return plantillas.menu_categorias(lista)
 
-    msg += "\n👉 Escribe el número o el nombre de la categoría que quieres ver."
-    return msg
 
+def productos_en_curso(estado, cuantos=1):
+    """IDs desde la posición actual de la categoría y si quedan más después."""
+    cat = estado.get("categoria_actual")
+    if not cat:
+        return [], False
+    return productos_de(cat, estado.get("indice_producto", 0), cuantos)
 
-def preparar_categoria(sender_id, categoria):
-    productos = obtener_productos()
-    lista = []
 
-    for idp, datos in productos.items():
-        if datos.get("categoria", "").lower() == categoria.lower():
-            lista.append({"id": idp, "datos": datos})
+def preparar_categoria(sender_id, categoria):
+    # La sesión solo guarda la categoría y la posición; los productos se
+    # consultan en el catálogo (índice compartido o páginas en caché).
+    primeros, _ = productos_de(categoria, 0, 1)
 
     user_state[sender_id]["categoria_actual"] = categoria
-    user_state[sender_id]["productos_categoria"] = lista
     user_state[sender_id]["indice_producto"] = 0
 
-    return len(lista) > 0
+    return len(primeros) > 0
 
 
 def mostrar_producto(sender_id):
+    if MODO_CATALOGO == "carrusel":
+        return mostrar_pagina(sender_id)
+
     estado = user_state.get(sender_id, {})
-    productos = estado.get("productos_categoria", [])
-    idx = estado.get("indice_producto", 0)
+    actuales, _ = productos_en_curso(estado)
 
-    if idx >= len(productos):
+    if not actuales:
         return fin_categoria(sender_id)
 
-    prod = productos[idx]
-    pid = prod["id"]
-    datos = prod["datos"]
-
-    nombre = datos.get("nombre", "Sin nombre")
-    precio = datos.get("precio", "N/A")
+    pid = actuales[0]
+    datos = producto(pid) or {}
     img = datos.get("imagen_url", "")
 
     if img:
-        enviar_imagen(sender_id, img)
-
-    txt = (
-        f"🔹 *{nombre}*\n"
-        f"💰 ${precio} MXN\n"
-        f"🆔 ID: {pid}\n\n"
-        "Para agregarlo al pedido puedes escribir:\n"
-        f"• *si {pid}*\n"
-        f"• *sí {pid}*\n"
-        f"• *pedido {pid}*\n"
-        f"• o solo el ID: *{pid}*\n\n"
-        "Para pasar al siguiente: *no* o *siguiente*\n"
-        "Para terminar: *finalizar pedido*"
-    )
-    return txt
+        enviar_imagen(sender_id, img, pid)
+
+    return plantillas.texto_producto(pid, datos)
+
+
+def mostrar_pagina(sender_id):
+    """Página de la categoría como carrusel: una sola llamada a la Send API."""
+    estado = user_state.get(sender_id, {})
+    pagina, hay_mas = productos_en_curso(estado, TAMANO_CARRUSEL)
+
+    if not pagina:
+        return fin_categoria(sender_id)
+
+    elementos = [plantillas.tarjeta_producto(pid) for pid in pagina]
+    return carrusel(elementos, respuestas_carrusel(hay_mas))
+
+
+def carrusel(elementos, respuestas):
+    return {
+        "attachment": {
+            "type": "template",
+            "payload": {"template_type": "generic", "elements": elementos},
+        },
+        "quick_replies": respuestas,
+    }
+
+
+def respuestas_carrusel(hay_mas):
+    """Respuestas rápidas debajo del carrusel (ver más / finalizar)."""
+    mas = "Ver más" if hay_mas else "Otras categorías"
+    return [
+        {"content_type": "text", "title": mas, "payload": "MAS"},
+        {"content_type": "text", "title": "Finalizar pedido", "payload": "FINALIZAR"},
+    ]
+
+
+def respuestas_busqueda():
+    """Respuestas rápidas debajo de los resultados de una búsqueda."""
+    # CATALOGO no está en POSTBACKS: se atiende el título como texto
+    return [
+        {"content_type": "text", "title": "Catálogo", "payload": "CATALOGO"},
+        {"content_type": "text", "title": "Finalizar pedido", "payload": "FINALIZAR"},
+    ]
 
 
 def fin_categoria(sender_id):
@@ -162,12 +226,7 @@ def fin_categoria(sender_id):
 
     if pendientes:
         estado["estado"] = "elige_categoria"
-        msg = f"✔ Ya no hay más productos en *{cat_actual}*.\n\n"
-        msg += "Otras categorías disponibles:\n"
-        for i, c in enumerate(pendientes, 1):
-            msg += f"{i}. {c}\n"
-        msg += "\n👉 Escribe la siguiente categoría o *finalizar pedido*."
-        return msg
+        return f"✔ Ya no hay más productos en *{cat_actual}*.\n\n" + plantillas.otras_categorias(pendientes)
     else:
         if carrito:
             return finalizar_pedido(sender_id)
@@ -180,29 +239,38 @@ def fin_categoria(sender_id):
 
 
 def agregar_carrito(sender_id, pid):
-    productos = obtener_productos()
-    if pid not in productos:
+    datos = producto(pid)
+    if datos is None:
         return "❌ Ese ID de producto no existe."
 
-    datos = productos[pid]
     nombre = datos.get("nombre", "Sin nombre")
-    precio = datos.get("precio", 0)
-    categoria = datos.get("categoria", "Sin categoria")
 
+    # En la sesión solo va el ID; nombre y precio se toman al finalizar
     user_state[sender_id].setdefault("carrito", [])
-    user_state[sender_id]["carrito"].append({
-        "id": pid,
-        "nombre": nombre,
-        "precio": precio,
-        "categoria": categoria
-    })
+    user_state[sender_id]["carrito"].append(pid)
 
     return f"🛒 *{nombre}* agregado a tu pedido."
 
 
+def items_carrito(carrito):
+    """Convierte los IDs del carrito en las líneas que se guardan en el pedido."""
+    items = []
+    for pid in carrito:
+        datos = producto(pid)
+        if datos is None:
+            continue  # el producto se eliminó del catálogo
+        items.append({
+            "id": pid,
+            "nombre": datos.get("nombre", "Sin nombre"),
+            "precio": datos.get("precio", 0),
+            "categoria": datos.get("categoria", "Sin categoria")
+        })
+    return items
+
+
 def finalizar_pedido(sender_id):
     estado = user_state[sender_id]
-    carrito = estado.get("carrito", [])
+    carrito = items_carrito(estado.get("carrito", []))
 
     if not carrito:
         return "🛍 No tienes productos en tu pedido. Escribe *catalogo* para ver productos."
@@ -223,10 +291,12 @@ def finalizar_pedido(sender_id):
         "total": total
     }
 
-    # Forma segura: crear doc manualmente y hacer set
+    # El ID se genera en el cliente: se responde sin esperar el commit
     doc_ref = db.collection("pedidos").document()
-    doc_ref.set(pedido)
+    escrituras.set(doc_ref, pedido)
     pedido_id = doc_ref.id
+    cache_pedidos.poner(pedido_id, pedido)
+    agregar_a_historial(pedido.get("telefono"), pedido_id, pedido)
 
     # Guardar en estado para el paso de entrega
     user_state[sender_id]["estado"] = "elige_entrega"
@@ -245,13 +315,107 @@ def finalizar_pedido(sender_id):
 # ------------------------------------------------------------
 # CONSULTA DE PEDIDO POR ID
 # ------------------------------------------------------------
-def consultar_pedido_por_id(pid):
-    doc = db.collection("pedidos").document(pid).get()
+def leer_pedido(pid):
+    metricas.FIRESTORE_LECTURAS.inc(1, "pedidos")
+    with metricas.FIRESTORE_LECTURA_SEGUNDOS.medir("pedidos"):
+        doc = db.collection("pedidos").document(pid).get()
     if not doc.exists:
         return None
     return doc.to_dict()
 
 
+def consultar_pedido_por_id(pid):
+    return cache_pedidos.obtener(pid, leer_pedido)
+
+
+# ------------------------------------------------------------
+# HISTORIAL DE PEDIDOS ("MIS PEDIDOS")
+# ------------------------------------------------------------
+# Consulta por teléfono ordenada por fecha con el índice compuesto de
+# firestore.indexes.json y paginada con cursor: cada página lee solo sus
+# documentos, sin importar cuántos pedidos haya en la colección.
+CAMPOS_HISTORIAL = ["fecha", "estado", "total"]
+DESCENDENTE = "DESCENDING"  # firestore.Query.DESCENDING
+
+
+def leer_pedidos_de(telefono, despues_de=None):
+    """
+    Una página de pedidos del cliente, del más reciente al más antiguo.
+    `despues_de` es el cursor [fecha ISO, ID] del último pedido ya mostrado.
+    Devuelve ([(id, datos), ...], cursor o None si no hay más).
+    """
+    consulta = (
+        db.collection("pedidos")
+        .where("telefono", "==", telefono)
+        .order_by("fecha", direction=DESCENDENTE)
+        .order_by("__name__", direction=DESCENDENTE)
+        .select(CAMPOS_HISTORIAL)
+        .limit(PEDIDOS_PAGINA + 1)
+    )
+    if despues_de:
+        fecha, pid = despues_de
+        consulta = consulta.start_after({"fecha": datetime.fromisoformat(fecha), "__name__": pid})
+
+    with metricas.FIRESTORE_LECTURA_SEGUNDOS.medir("mis_pedidos"):
+        filas = [(doc.id, doc.to_dict()) for doc in consulta.stream()]
+    metricas.FIRESTORE_LECTURAS.inc(max(len(filas), 1), "mis_pedidos")
+
+    if len(filas) <= PEDIDOS_PAGINA:
+        return filas, None
+    filas = filas[:PEDIDOS_PAGINA]
+    return filas, _cursor_pedido(*filas[-1])
+
+
+def _cursor_pedido(pid, datos):
+    # En la sesión solo va JSON: la fecha viaja como texto ISO
+    return [datos["fecha"].isoformat(), pid]
+
+
+def pedidos_de(telefono, despues_de=None, reciente=None):
+    """
+    Página de pedidos del cliente; la primera sale de cache_historial.
+    `reciente` es el último pedido que hizo en esta sesión: si la consulta
+    todavía no lo ve (escritura diferida) se agrega a la página.
+    """
+    if despues_de:
+        return leer_pedidos_de(telefono, despues_de)
+
+    def cargar(telefono):
+        pagina = leer_pedidos_de(telefono)
+        pedido = cache_pedidos.consultar(reciente) if reciente else None
+        if pedido is not None and pedido.get("telefono") == telefono:
+            pagina = _con_pedido_nuevo(pagina, reciente, pedido)
+        return pagina
+
+    return cache_historial.obtener(telefono, cargar)
+
+
+def agregar_a_historial(telefono, pid, pedido):
+    """
+    Pone un pedido recién creado al inicio de la primera página en caché
+    (la escritura es diferida: la consulta podría no verlo todavía). Si la
+    página no está en caché, pedidos_de lo agrega al cargarla.
+    """
+    if not telefono:
+        return
+    pagina = cache_historial.consultar(telefono)
+    if pagina is None:
+        return
+    cache_historial.poner(telefono, _con_pedido_nuevo(pagina, pid, pedido))
+
+
+def _con_pedido_nuevo(pagina, pid, pedido):
+    """La página con el pedido al inicio (es el más nuevo), si no estaba."""
+    filas, cursor = pagina
+    if any(otro == pid for otro, _ in filas):
+        return pagina
+    filas = [(pid, {campo: pedido.get(campo) for campo in CAMPOS_HISTORIAL})] + filas
+    if len(filas) > PEDIDOS_PAGINA:
+        filas = filas[:PEDIDOS_PAGINA]
+        cursor = _cursor_pedido(*filas[-1])
+    return filas, cursor
+
+
 # ------------------------------------------------------------
 # WEBHOOK (VERIFICACIÓN)
 # ------------------------------------------------------------
@@ -269,267 +433,672 @@ def verify_webhook():
 def receive_message():
     data = request.get_json()
 
-    for entry in data.get("entry", []):
-        for event in entry.get("messaging", []):
-            if "message" in event and not event["message"].get("is_echo"):
-                sender_id = event["sender"]["id"]
-                texto = event["message"].get("text", "")
-                msg_norm = normalizar(texto)
-
-                resp = manejar_mensaje(sender_id, msg_norm)
-                if resp:
-                    enviar_mensaje(sender_id, resp)
+    # Cada evento va a la cola de su usuario: los de un mismo usuario se
+    # atienden en orden (aunque lleguen en peticiones distintas) y los de
+    # usuarios distintos en paralelo
+    futuros = []
+    try:
+        for entry in data.get("entry", []):
+            for event in entry.get("messaging", []):
+                es_mensaje = "message" in event and not event["message"].get("is_echo")
+                if es_mensaje or "postback" in event:
+                    futuros.append(ejecutor.enviar(event["sender"]["id"], atender_medido, event))
+    except ColaLlena:
+        # Facebook reintenta el lote; lo ya encolado se descarta por mid
+        EVENTOS.inc(1, "rechazado")
+        return "Ocupado", 503
+
+    for futuro in futuros:
+        if EVENTOS_ASINCRONOS:
+            futuro.add_done_callback(_reportar_error)
+        else:
+            futuro.result()
 
+    if arranque["primera_respuesta_s"] is None:
+        arranque["primera_respuesta_s"] = time.perf_counter() - ARRANQUE
+        print(f"⏱ Primera respuesta a {arranque['primera_respuesta_s']:.2f}s del arranque")
     return "OK", 200
 
 
+def atender_medido(event):
+    with metricas.ETAPAS.medir("evento"):
+        atender_evento(event)
+
+
+def _reportar_error(futuro):
+    if futuro.exception() is not None:
+        print("🔥 Error al atender evento:", futuro.exception())
+
+
+def atender_evento(event):
+    # Botones (postback) y respuestas rápidas traen un payload; el texto
+    # escrito pasa por el clasificador
+    if "postback" in event:
+        mensaje = event["postback"]
+        tipo = "postback"
+        payload = mensaje.get("payload")
+        texto = mensaje.get("title", "")
+    else:
+        mensaje = event["message"]
+        tipo = "mensaje"
+        payload = (mensaje.get("quick_reply") or {}).get("payload")
+        texto = mensaje.get("text", "")
+
+    mid = mensaje.get("mid")
+    if mid and not mensajes_vistos.primera_vez(mid):
+        EVENTOS.inc(1, "duplicado")
+        return  # reenvío de un mensaje ya atendido
+    EVENTOS.inc(1, tipo)
+
+    sender_id = event["sender"]["id"]
+    with metricas.ETAPAS.medir("normalizar"):
+        msg_norm = normalizar(texto)
+
+    # La sesión del usuario queda bloqueada mientras se procesa
+    try:
+        with metricas.ETAPAS.medir("sesion_y_logica"):
+            with user_state.sesion(sender_id):
+                resp = None
+                if payload:
+                    resp = manejar_payload(sender_id, payload)
+                if resp is None:
+                    resp = manejar_mensaje(sender_id, msg_norm, texto)
+    except Exception:
+        # El mid se marcó al llegar (así dos entregas simultáneas no se
+        # atienden dos veces); si falló, se suelta para que el reintento pase
+        if mid:
+            mensajes_vistos.olvidar(mid)
+        raise
+    if resp:
+        with metricas.ETAPAS.medir("encolar_envio"):
+            responder(sender_id, resp)
+
+
+# ------------------------------------------------------------
+# ARRANQUE Y CALENTAMIENTO
+# ------------------------------------------------------------
+arranque = {
+    "listo": False,
+    "error": None,
+    "importacion_s": None,
+    "calentamiento_s": None,
+    "primera_respuesta_s": None,
+}
+_lock_calentar = threading.Lock()
+
+
+def calentar():
+    """
+    Deja el proceso listo para atender: cliente de Firestore, catálogo en
+    caché y conexión abierta con la Graph API. Lo llama post_fork de
+    gunicorn (gunicorn.conf.py) o /healthz; después de salir bien una vez
+    ya no hace nada.
+    """
+    with _lock_calentar:
+        if arranque["listo"]:
+            return arranque
+        inicio = time.perf_counter()
+        try:
+            calentar_firestore()
+            arranque["listo"] = True
+            arranque["error"] = None
+        except Exception as e:
+            arranque["error"] = str(e)
+            print("🔥 Error al calentar Firestore:", e)
+        despachador.calentar()
+        ejecutor.calentar()
+        escrituras.calentar()
+        arranque["calentamiento_s"] = time.perf_counter() - inicio
+        print(f"🔥 Calentamiento en {arranque['calentamiento_s']:.2f}s (pid {os.getpid()})")
+    return arranque
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    estado = calentar()
+    return jsonify(estado), 200 if estado["listo"] else 503
+
+
+# ------------------------------------------------------------
+# MÉTRICAS
+# ------------------------------------------------------------
+EVENTOS = metricas.contador(
+    "bot_eventos_total", "Mensajes y postbacks recibidos en el webhook", ("tipo",)
+)
+INTENCIONES = metricas.contador(
+    "bot_intenciones_total", "Mensajes atendidos por intención o estado", ("manejador",)
+)
+
+
+def _estadisticas_caches():
+    valores = {}
+    for nombre, cache in (
+        ("pedidos", cache_pedidos),
+        ("historial", cache_historial),
+        ("perfiles_telefono", perfiles.por_telefono),
+        ("perfiles_psid", perfiles.por_psid),
+        ("adjuntos", adjuntos),
+        ("plantillas", plantillas),
+    ):
+        for campo, valor in cache.estadisticas().items():
+            valores[(nombre, campo)] = valor
+    for campo in ("aciertos", "fallos", "recargas", "productos", "version"):
+        valores[("catalogo", campo)] = catalogo.estadisticas()[campo]
+    for campo in ("productos", "palabras"):
+        valores[("busqueda", campo)] = busqueda.estadisticas()[campo]
+    return valores
+
+
+metricas.gauge(
+    "bot_sesiones", "Sesiones vigentes por estado de la conversación",
+    user_state.almacen.contar_por_estado, ("estado",),
+)
+metricas.gauge(
+    "bot_envios_en_cola", "Mensajes esperando en las colas del despachador",
+    lambda: despachador.estadisticas()["en_cola"],
+)
+metricas.gauge(
+    "bot_eventos_en_cola", "Eventos del webhook esperando en las colas por usuario",
+    lambda: ejecutor.estadisticas()["en_cola"],
+)
+metricas.gauge(
+    "bot_escrituras_pendientes", "Escrituras diferidas aún sin commit",
+    escrituras.pendientes,
+)
+metricas.gauge(
+    "bot_arranque_segundos", "Tiempos del arranque en frío de este proceso",
+    lambda: {
+        fase: arranque[fase + "_s"]
+        for fase in ("importacion", "calentamiento", "primera_respuesta")
+        if arranque[fase + "_s"] is not None
+    },
+    ("fase",),
+)
+metricas.gauge(
+    "bot_cache", "Estadísticas de las cachés en memoria",
+    _estadisticas_caches, ("cache", "campo"),
+)
+
+
+@app.route("/metrics", methods=["GET"])
+def exportar_metricas():
+    if not metricas.ACTIVAS:
+        return "Métricas desactivadas", 404
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+
 # ------------------------------------------------------------
 # LÓGICA PRINCIPAL DEL BOT
 # ------------------------------------------------------------
-def manejar_mensaje(sender_id, msg):
+MENU = (
+    "Puedo ayudarte con:\n"
+    "🛍 Catalogo\n"
+    "🔎 Busco ... (ej. *busco vestido negro*)\n"
+    "🧾 Mis pedidos\n"
+    "📝 Registrar\n"
+    "🔐 Iniciar sesion\n"
+    "🕒 Horario\n"
+    "📞 Contacto"
+)
+
+
+def manejar_mensaje(sender_id, msg, texto=None):
     estado = user_state.get(sender_id, {}).get("estado", "inicio")
 
-    # ---------------- SALUDO ----------------
-    if any(x in msg for x in ["hola", "buenas", "hello"]):
-        return (
-            "👋 Hola, soy Frere’s Collection.\n\n"
-            "Puedo ayudarte con:\n"
-            "🛍 Catalogo\n"
-            "📝 Registrar\n"
-            "🔐 Iniciar sesion\n"
-            "🕒 Horario\n"
-            "📞 Contacto"
-        )
+    # 1) Intenciones de la tabla (una sola pasada sobre el mensaje)
+    with metricas.ETAPAS.medir("clasificar"):
+        intencion = clasificador.clasificar(msg, estado)
+    if intencion:
+        INTENCIONES.inc(1, intencion.nombre)
+        args = intencion.args
+        if texto and intencion.nombre in ARGS_ORIGINALES:
+            args = palabras_originales(texto, args)
+        return ACCIONES[intencion.nombre](sender_id, msg, args)
+
+    # 2) Texto libre según el estado de la conversación
+    manejador = POR_ESTADO.get(estado)
+    if manejador:
+        INTENCIONES.inc(1, estado)
+        return manejador(sender_id, msg)
 
-    # ---------------- CONTACTO ----------------
-    if "contacto" in msg or "whatsapp" in msg:
-        return "📱 WhatsApp: *+52 55 1234 5678*"
-
-    # ---------------- HORARIO ----------------
-    if "horario" in msg:
-        return "🕒 Lunes a sábado: 10 AM – 7 PM."
-
-    # ---------------- REGISTRO ----------------
-    if msg in ["registrar", "crear cuenta", "soy nuevo", "soy nueva"]:
-        user_state[sender_id] = {"estado": "registrando_nombre"}
-        return "📝 ¿Cuál es tu nombre completo?"
-
-    if estado == "registrando_nombre":
-        user_state[sender_id]["nombre"] = msg
-        user_state[sender_id]["estado"] = "registrando_telefono"
-        return "📱 Escribe tu número telefónico (10 dígitos)."
-
-    if estado == "registrando_telefono":
-        if not msg.isdigit() or len(msg) != 10:
-            return "❌ Escribe un número válido de 10 dígitos."
-        user_state[sender_id]["telefono"] = msg
-        user_state[sender_id]["estado"] = "registrando_direccion"
-        return "📍 Escribe tu dirección completa."
-
-    if estado == "registrando_direccion":
-        nombre = user_state[sender_id]["nombre"]
-        telefono = user_state[sender_id]["telefono"]
-
-        db.collection("usuarios").document(telefono).set({
-            "nombre": nombre,
-            "telefono": telefono,
-            "direccion": msg
-        })
+    # ---------------- FALLBACK ----------------
+    INTENCIONES.inc(1, "no_entendido")
+    return "🤔 No entendí.\n\n" + MENU
+
+
+def manejar_payload(sender_id, payload):
+    """
+    Payload de un botón o respuesta rápida ("ACCION" o "ACCION:arg").
+    Devuelve None si no es nuestro, y entonces se trata como texto.
+    """
+    accion, _, arg = payload.partition(":")
+    manejador = POSTBACKS.get(accion)
+    if manejador is None:
+        return None
+    INTENCIONES.inc(1, "postback_" + accion.lower())
+    user_state.setdefault(sender_id, {"estado": "inicio"})
+    return manejador(sender_id, arg)
 
-        user_state[sender_id]["estado"] = "logueado"
-        user_state[sender_id]["direccion"] = msg
-        user_state[sender_id]["nombre"] = nombre
 
-        return (
-            f"✨ Registro completado, {nombre}.\n\n" +
-            construir_categorias(sender_id)
-        )
+# ---------------- SALUDO / INFO ----------------
+def accion_saludo(sender_id, msg, args):
+    return "👋 Hola, soy Frere’s Collection.\n\n" + MENU
 
-    # ---------------- LOGIN ----------------
-    if msg.startswith("iniciar sesion") or msg == "entrar":
-        user_state[sender_id] = {"estado": "login"}
-        return "🔐 Escribe tu número telefónico registrado."
-
-    if estado == "login":
-        doc = db.collection("usuarios").document(msg).get()
-        if not doc.exists:
-            return "❌ Ese número no está registrado. Escribe *registrar* para crear cuenta."
-        data = doc.to_dict()
-
-        user_state[sender_id] = {
-            "estado": "logueado",
-            "nombre": data.get("nombre"),
-            "telefono": msg,
-            "direccion": data.get("direccion")
-        }
 
-        return (
-            f"✨ Bienvenido de nuevo, {data.get('nombre')}.\n\n" +
-            construir_categorias(sender_id)
-        )
+def accion_contacto(sender_id, msg, args):
+    return "📱 WhatsApp: *+52 55 1234 5678*"
 
-    # ---------------- CONSULTAR PEDIDO POR ID ----------------
-    if msg.startswith("ver pedido") or msg.startswith("consultar") or msg.startswith("estado pedido"):
-        tokens = msg.split()
-        if len(tokens) < 3:
-            return "Escribe: *ver pedido IDPEDIDO*"
-        pid = tokens[2]
-
-        ped = consultar_pedido_por_id(pid)
-        if not ped:
-            return "❌ No encontré ese pedido."
-
-        resp = f"🧾 *Pedido {pid}*\n"
-        resp += f"📌 Estado: {ped.get('estado')}\n"
-        resp += "📦 Productos:\n"
-        for p in ped.get("productos", []):
-            resp += f"• {p['nombre']} – ${p['precio']} (ID: {p['id']})\n"
-        resp += f"\n💵 Total: ${ped.get('total')}"
-        return resp
-
-    # ---------------- CATÁLOGO ----------------
-    if "catalogo" in msg:
-        if sender_id not in user_state:
-            user_state[sender_id] = {"estado": "inicio"}
-        return construir_categorias(sender_id)
-
-    # ---------------- ELEGIR CATEGORÍA ----------------
-    if estado == "elige_categoria":
-        estado_u = user_state[sender_id]
-
-        # FIX: Finalizar pedido también desde categorías
-        if (
-            "finalizar" in msg
-            or "finalizar pedido" in msg
-            or "cerrar pedido" in msg
-            or "terminar" in msg
-            or "fin" in msg
-            or "ya" in msg
-        ):
-            return finalizar_pedido(sender_id)
 
-        categorias = estado_u.get("categorias_pendientes", [])
-        cat = None
+def accion_horario(sender_id, msg, args):
+    return "🕒 Lunes a sábado: 10 AM – 7 PM."
 
-        if msg.isdigit():
-            idx = int(msg) - 1
-            if 0 <= idx < len(categorias):
-                cat = categorias[idx]
-        else:
-            for c in categorias:
-                if c.lower() in msg:
-                    cat = c
-                    break
-
-        if not cat:
-            return "❌ No reconocí esa categoría."
-
-        if not preparar_categoria(sender_id, cat):
-            return "😕 No hay productos en esa categoría."
-
-        user_state[sender_id]["estado"] = "mostrando_producto"
-        return mostrar_producto(sender_id)
-
-    # ---------------- MOSTRAR PRODUCTO / CARRITO ----------------
-    if estado == "mostrando_producto":
-
-        # FINALIZAR PEDIDO (TODAS LAS VARIANTES)
-        if (
-            msg in ["finalizar", "finalizar pedido", "cerrar pedido", "terminar", "ya", "fin"]
-            or "finalizar" in msg
-            or "cerrar pedido" in msg
-            or "cerrar" in msg
-            or "terminar" in msg
-            or "finaliza" in msg
-            or "finaliza pedido" in msg
-            or "completar" in msg
-            or "completar pedido" in msg
-            or "listo" in msg
-            or "ya esta" in msg
-            or "ya es todo" in msg
-        ):
-            return finalizar_pedido(sender_id)
 
-        # SIGUIENTE PRODUCTO
-        if msg in ["no", "siguiente", "next", "n", "skip"]:
-            user_state[sender_id]["indice_producto"] += 1
-            return mostrar_producto(sender_id)
-
-        # AGREGAR PRODUCTO
-        tokens = msg.split()
-        pid = None
-
-        # si 123, sí 123
-        if tokens and tokens[0] in ["si", "sí", "si,", "si.", "sí,", "sí."]:
-            if len(tokens) > 1 and tokens[1].isdigit():
-                pid = tokens[1]
-            else:
-                productos = user_state[sender_id]["productos_categoria"]
-                idx = user_state[sender_id]["indice_producto"]
-                if idx < len(productos):
-                    pid = productos[idx]["id"]
-
-        # pedido 123
-        elif tokens and tokens[0] == "pedido" and len(tokens) > 1:
-            pid = tokens[1]
-
-        # solo id
-        elif msg.isdigit():
-            pid = msg
-
-        if pid:
-            confirm = agregar_carrito(sender_id, pid)
-            user_state[sender_id]["indice_producto"] += 1
-            return confirm + "\n\n" + mostrar_producto(sender_id)
+# ---------------- REGISTRO ----------------
+def accion_registrar(sender_id, msg, args):
+    user_state[sender_id] = {"estado": "registrando_nombre"}
+    return "📝 ¿Cuál es tu nombre completo?"
 
-        return (
+
+def estado_registrando_nombre(sender_id, msg):
+    user_state[sender_id]["nombre"] = msg
+    user_state[sender_id]["estado"] = "registrando_telefono"
+    return "📱 Escribe tu número telefónico (10 dígitos)."
+
+
+def estado_registrando_telefono(sender_id, msg):
+    if not msg.isdigit() or len(msg) != 10:
+        return "❌ Escribe un número válido de 10 dígitos."
+    user_state[sender_id]["telefono"] = msg
+    user_state[sender_id]["estado"] = "registrando_direccion"
+    return "📍 Escribe tu dirección completa."
+
+
+def estado_registrando_direccion(sender_id, msg):
+    nombre = user_state[sender_id]["nombre"]
+    telefono = user_state[sender_id]["telefono"]
+
+    datos = {
+        "nombre": nombre,
+        "telefono": telefono,
+        "direccion": msg
+    }
+    escrituras.set(db.collection("usuarios").document(telefono), datos)
+    perfiles.guardar(telefono, datos)
+    perfiles.recordar_psid(sender_id, telefono)
+
+    user_state[sender_id]["estado"] = "logueado"
+    user_state[sender_id]["direccion"] = msg
+    user_state[sender_id]["nombre"] = nombre
+
+    return (
+        f"✨ Registro completado, {nombre}.\n\n" +
+        construir_categorias(sender_id)
+    )
+
+
+# ---------------- LOGIN ----------------
+def accion_iniciar_sesion(sender_id, msg, args):
+    # Siempre se pide el teléfono (así se puede entrar con otro número);
+    # si este PSID ya entró antes, su número va como respuesta rápida y
+    # el perfil sale de la caché
+    user_state[sender_id] = {"estado": "login"}
+    texto = "🔐 Escribe tu número telefónico registrado."
+    telefono = perfiles.ultimo_telefono(sender_id)
+    if not telefono:
+        return texto
+    # LOGIN no está en POSTBACKS: el título (el número) se atiende como texto
+    return {
+        "text": texto + "\nO toca tu número si es el mismo de la última vez.",
+        "quick_replies": [{"content_type": "text", "title": telefono, "payload": "LOGIN"}],
+    }
+
+
+def estado_login(sender_id, msg):
+    data = perfiles.obtener(msg)
+    if data is None:
+        return "❌ Ese número no está registrado. Escribe *registrar* para crear cuenta."
+    perfiles.recordar_psid(sender_id, msg)
+    return iniciar_sesion(sender_id, msg, data)
+
+
+def iniciar_sesion(sender_id, telefono, data):
+    user_state[sender_id] = {
+        "estado": "logueado",
+        "nombre": data.get("nombre"),
+        "telefono": telefono,
+        "direccion": data.get("direccion")
+    }
+
+    return (
+        f"✨ Bienvenido de nuevo, {data.get('nombre')}.\n\n" +
+        construir_categorias(sender_id)
+    )
+
+
+# ---------------- CONSULTAR PEDIDO POR ID ----------------
+def accion_consultar_pedido(sender_id, msg, args):
+    if not args:
+        return "Escribe: *ver pedido IDPEDIDO*"
+    pid = args[0]
+
+    ped = consultar_pedido_por_id(pid)
+    if not ped:
+        return "❌ No encontré ese pedido."
+
+    resp = f"🧾 *Pedido {pid}*\n"
+    resp += f"📌 Estado: {ped.get('estado')}\n"
+    resp += "📦 Productos:\n"
+    for p in ped.get("productos", []):
+        resp += f"• {p['nombre']} – ${p['precio']} (ID: {p['id']})\n"
+    resp += f"\n💵 Total: ${ped.get('total')}"
+    return resp
+
+
+# ---------------- MIS PEDIDOS ----------------
+def accion_mis_pedidos(sender_id, msg, args):
+    return mostrar_pedidos(sender_id)
+
+
+def accion_mas_pedidos(sender_id, msg, args):
+    return mostrar_pedidos(sender_id, siguiente=True)
+
+
+def postback_pedidos(sender_id, arg):
+    return mostrar_pedidos(sender_id, siguiente=(arg == "MAS"))
+
+
+def postback_pedido(sender_id, pid):
+    return accion_consultar_pedido(sender_id, "", [pid])
+
+
+def mostrar_pedidos(sender_id, siguiente=False):
+    estado = user_state.setdefault(sender_id, {"estado": "inicio"})
+    telefono = estado.get("telefono")
+    if not telefono:
+        conocido = perfiles.de_psid(sender_id)
+        telefono = conocido[0] if conocido else None
+    if not telefono:
+        return "🔐 Para ver tus pedidos escribe *iniciar sesion* o *registrar*."
+
+    despues_de = estado.get("pedidos_cursor") if siguiente else None
+    if siguiente and not despues_de:
+        return "📭 Ya no hay más pedidos. Escribe *mis pedidos* para verlos desde el inicio."
+
+    pedidos, cursor = pedidos_de(telefono, despues_de, estado.get("ultimo_pedido_id"))
+    estado["pedidos_cursor"] = cursor
+    if not pedidos:
+        return "📭 Aún no tienes pedidos. Escribe *catalogo* para ver productos."
+
+    resp = "🧾 *Tus pedidos:*\n" if not despues_de else "🧾 *Más pedidos:*\n"
+    for pid, ped in pedidos:
+        fecha = ped.get("fecha")
+        fecha = fecha.strftime("%d/%m/%Y") if fecha else "-"
+        resp += f"\n• *{pid}*\n  📅 {fecha} · 📌 {ped.get('estado')} · 💵 ${ped.get('total')}\n"
+    resp += "\n👉 Para ver el detalle toca el pedido o escribe *ver pedido ID*."
+    # El payload lleva el ID exacto (distingue mayúsculas); Messenger
+    # admite 13 respuestas rápidas con títulos de hasta 20 caracteres
+    respuestas = [
+        {"content_type": "text", "title": _titulo_pedido(pid), "payload": f"PEDIDO:{pid}"}
+        for pid, _ in pedidos[:12]
+    ]
+    if cursor:
+        respuestas.append({"content_type": "text", "title": "Más pedidos", "payload": "PEDIDOS:MAS"})
+    return {"text": resp, "quick_replies": respuestas}
+
+
+def _titulo_pedido(pid):
+    titulo = f"Ver {pid}"
+    return titulo if len(titulo) <= 20 else titulo[:19] + "…"
+
+
+# ---------------- CATÁLOGO ----------------
+def accion_catalogo(sender_id, msg, args):
+    if sender_id not in user_state:
+        user_state[sender_id] = {"estado": "inicio"}
+    return construir_categorias(sender_id)
+
+
+def accion_finalizar(sender_id, msg, args):
+    return finalizar_pedido(sender_id)
+
+
+# ---------------- ELEGIR CATEGORÍA ----------------
+def estado_elige_categoria(sender_id, msg):
+    categorias = user_state[sender_id].get("categorias_pendientes", [])
+    cat = None
+
+    if msg.isdigit():
+        idx = int(msg) - 1
+        if 0 <= idx < len(categorias):
+            cat = categorias[idx]
+    else:
+        for c in categorias:
+            if c.lower() in msg:
+                cat = c
+                break
+
+    if not cat:
+        return "❌ No reconocí esa categoría."
+
+    if not preparar_categoria(sender_id, cat):
+        return "😕 No hay productos en esa categoría."
+
+    user_state[sender_id]["estado"] = "mostrando_producto"
+    return mostrar_producto(sender_id)
+
+
+# ---------------- MOSTRAR PRODUCTO / CARRITO ----------------
+def accion_siguiente(sender_id, msg, args):
+    user_state[sender_id]["indice_producto"] += PASO_CATALOGO
+    return mostrar_producto(sender_id)
+
+
+def accion_agregar(sender_id, msg, args):
+    # si 123 / pedido 123 / si (el producto que se está mostrando)
+    pid = None
+    if args and args[0].isdigit():
+        pid = args[0]
+    elif (
+        msg.startswith("si") and MODO_CATALOGO != "carrusel"
+        and user_state[sender_id].get("estado") == "mostrando_producto"
+    ):
+        actuales, _ = productos_en_curso(user_state[sender_id])
+        if actuales:
+            pid = actuales[0]
+    elif args:
+        pid = args[0]
+    return agregar_y_continuar(sender_id, pid)
+
+
+def estado_mostrando_producto(sender_id, msg):
+    # solo el ID
+    if msg.isdigit():
+        return agregar_y_continuar(sender_id, msg)
+    return agregar_y_continuar(sender_id, None)
+
+
+def agregar_y_continuar(sender_id, pid):
+    if MODO_CATALOGO == "carrusel" or user_state[sender_id].get("estado") == "resultados_busqueda":
+        return agregar_desde_carrusel(sender_id, pid)
+
+    if pid:
+        confirm = agregar_carrito(sender_id, pid)
+        user_state[sender_id]["indice_producto"] += 1
+        return confirm + "\n\n" + mostrar_producto(sender_id)
+
+    return (
+        "🤔 No entendí.\n"
+        "Escribe *si*, *sí*, *pedido ID*, el *ID*, o *no* para avanzar."
+    )
+
+
+def agregar_desde_carrusel(sender_id, pid):
+    # El carrusel sigue a la vista: se confirma sin cambiar de página
+    estado = user_state[sender_id]
+    if not pid and estado.get("estado") == "resultados_busqueda":
+        if MODO_CATALOGO == "carrusel":
+            texto = "🤔 No entendí.\nToca *Agregar* en un producto o escribe su *ID*."
+        else:
+            # En modo producto los resultados van como lista, sin botones
+            texto = "🤔 No entendí.\nEscribe *si ID* o solo el *ID* del producto."
+    elif not pid:
+        texto = (
             "🤔 No entendí.\n"
-            "Escribe *si*, *sí*, *pedido ID*, el *ID*, o *no* para avanzar."
+            "Toca *Agregar* en un producto o escribe *si ID*.\n"
+            "Para ver más: *no* o *siguiente*."
+        )
+    else:
+        texto = agregar_carrito(sender_id, pid)
+    if estado.get("estado") == "resultados_busqueda":
+        return {"text": texto, "quick_replies": respuestas_busqueda()}
+    if estado.get("estado") != "mostrando_producto":
+        return texto
+    _, hay_mas = productos_en_curso(estado, TAMANO_CARRUSEL)
+    return {"text": texto, "quick_replies": respuestas_carrusel(hay_mas)}
+
+
+# ---------------- BÚSQUEDA POR NOMBRE ----------------
+def accion_buscar(sender_id, msg, args):
+    user_state.setdefault(sender_id, {"estado": "inicio"})
+    texto = " ".join(args)
+    if not palabras(texto):
+        return "🔎 ¿Qué producto buscas? Escribe por ejemplo: *busco vestido negro*."
+    return mostrar_resultados(sender_id, texto)
+
+
+def estado_resultados_busqueda(sender_id, msg):
+    # solo el ID agrega; cualquier otro texto es una búsqueda nueva
+    if msg.isdigit():
+        return agregar_y_continuar(sender_id, msg)
+    return mostrar_resultados(sender_id, msg)
+
+
+def mostrar_resultados(sender_id, texto):
+    resultados = buscar_productos(texto, TAMANO_CARRUSEL)
+    if not resultados:
+        return (
+            f"😕 No encontré productos para *{texto}*.\n"
+            "Prueba con otra palabra o escribe *catalogo* para ver las categorías."
         )
 
-    # ---------------- ELECCIÓN MÉTODO DE ENTREGA ----------------
-    if estado == "elige_entrega":
-        pid = user_state[sender_id].get("ultimo_pedido_id")
+    estado = user_state[sender_id]
+    estado["estado"] = "resultados_busqueda"
+    estado.setdefault("carrito", [])
+
+    if MODO_CATALOGO == "carrusel":
+        elementos = [plantillas.tarjeta_producto(pid, datos) for pid, datos in resultados]
+        return carrusel(elementos, respuestas_busqueda())
+
+    msg = f"🔎 Resultados para *{texto}*:\n\n"
+    for i, (pid, datos) in enumerate(resultados, 1):
+        msg += f"{i}. {datos.get('nombre', 'Sin nombre')} – ${datos.get('precio', 'N/A')} (ID: {pid})\n"
+    msg += (
+        "\n👉 Para agregar escribe *pedido ID* o solo el *ID*.\n"
+        "Para buscar otra cosa escribe lo que buscas; para terminar: *finalizar pedido*."
+    )
+    return msg
 
-        if any(x in msg for x in ["domicilio", "casa", "enviar"]):
-            db.collection("pedidos").document(pid).update({
-                "entrega": "domicilio",
-                "direccion": user_state[sender_id].get("direccion", "No registrada")
-            })
-            user_state[sender_id]["estado"] = "logueado"
-            return (
-                f"🚚 Tu pedido será enviado a tu domicilio.\n"
-                f"🧾 ID del pedido: {pid}"
-            )
 
-        if any(x in msg for x in ["recoger", "tienda", "pick"]):
-            db.collection("pedidos").document(pid).update({
-                "entrega": "tienda"
-            })
-            user_state[sender_id]["estado"] = "logueado"
-            return (
-                f"🏬 Puedes recoger tu pedido en la tienda.\n"
-                f"🧾 ID del pedido: {pid}"
-            )
+# ---------------- BOTONES (POSTBACK) ----------------
+def postback_agregar(sender_id, pid):
+    return agregar_desde_carrusel(sender_id, pid)
 
-        return "❌ Escribe *domicilio* o *recoger en tienda*."
 
-    # ---------------- FALLBACK ----------------
+def postback_mas(sender_id, arg):
+    if user_state[sender_id].get("estado") != "mostrando_producto":
+        return None  # carrusel viejo: se atiende el título como texto
+    return accion_siguiente(sender_id, "", [])
+
+
+def postback_finalizar(sender_id, arg):
+    return finalizar_pedido(sender_id)
+
+
+# ---------------- ELECCIÓN MÉTODO DE ENTREGA ----------------
+def accion_entrega_domicilio(sender_id, msg, args):
+    pid = user_state[sender_id].get("ultimo_pedido_id")
+    cambios = {
+        "entrega": "domicilio",
+        "direccion": user_state[sender_id].get("direccion", "No registrada")
+    }
+    escrituras.update(db.collection("pedidos").document(pid), cambios)
+    cache_pedidos.actualizar(pid, cambios)
+    user_state[sender_id]["estado"] = "logueado"
     return (
-        "🤔 No entendí.\n\n"
-        "Puedo ayudarte con:\n"
-        "🛍 Catalogo\n"
-        "📝 Registrar\n"
-        "🔐 Iniciar sesion\n"
-        "🕒 Horario\n"
-        "📞 Contacto"
+        f"🚚 Tu pedido será enviado a tu domicilio.\n"
+        f"🧾 ID del pedido: {pid}"
     )
 
 
+def accion_entrega_tienda(sender_id, msg, args):
+    pid = user_state[sender_id].get("ultimo_pedido_id")
+    cambios = {"entrega": "tienda"}
+    escrituras.update(db.collection("pedidos").document(pid), cambios)
+    cache_pedidos.actualizar(pid, cambios)
+    user_state[sender_id]["estado"] = "logueado"
+    return (
+        f"🏬 Puedes recoger tu pedido en la tienda.\n"
+        f"🧾 ID del pedido: {pid}"
+    )
+
+
+def estado_elige_entrega(sender_id, msg):
+    return "❌ Escribe *domicilio* o *recoger en tienda*."
+
+
+# ---------------- TABLAS DE DESPACHO ----------------
+clasificador = Clasificador()
+
+ACCIONES = {
+    "saludo": accion_saludo,
+    "contacto": accion_contacto,
+    "horario": accion_horario,
+    "registrar": accion_registrar,
+    "iniciar_sesion": accion_iniciar_sesion,
+    "consultar_pedido": accion_consultar_pedido,
+    "mis_pedidos": accion_mis_pedidos,
+    "mas_pedidos": accion_mas_pedidos,
+    "buscar": accion_buscar,
+    "catalogo": accion_catalogo,
+    "finalizar": accion_finalizar,
+    "siguiente": accion_siguiente,
+    "agregar": accion_agregar,
+    "entrega_domicilio": accion_entrega_domicilio,
+    "entrega_tienda": accion_entrega_tienda,
+}
+
+POSTBACKS = {
+    "AGREGAR": postback_agregar,
+    "MAS": postback_mas,
+    "FINALIZAR": postback_finalizar,
+    "PEDIDOS": postback_pedidos,
+    "PEDIDO": postback_pedido,
+}
+
+# Intenciones cuyos argumentos son IDs de Firestore, que distinguen
+# mayúsculas: se toman del texto original y no del normalizado
+ARGS_ORIGINALES = {"consultar_pedido"}
+
+POR_ESTADO = {
+    "registrando_nombre": estado_registrando_nombre,
+    "registrando_telefono": estado_registrando_telefono,
+    "registrando_direccion": estado_registrando_direccion,
+    "login": estado_login,
+    "elige_categoria": estado_elige_categoria,
+    "mostrando_producto": estado_mostrando_producto,
+    "resultados_busqueda": estado_resultados_busqueda,
+    "elige_entrega": estado_elige_entrega,
+}
+
+
+arranque["importacion_s"] = time.perf_counter() - ARRANQUE
+
+
 # ------------------------------------------------------------
 # EJECUCIÓN DEL SERVIDOR
 # ------------------------------------------------------------
 if __name__ == "__main__":
+    calentar()
     port = int(os.environ.get("PORT", 10000))
     print(f"🔥 Servidor ejecutándose en {port}")
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,130 @@
+# benchmarks/arranque.py
+"""
+Mide el arranque en frío: importar app.py, calentar (opcional) y atender el
+primer mensaje. Cada medición corre en un intérprete nuevo.
+
+    python benchmarks/arranque.py --repeticiones 5
+    python benchmarks/arranque.py --backend firebase   # con FIREBASE_CREDENTIALS
+
+Modos:
+  frio       el primer mensaje paga la conexión a Firestore y la carga del catálogo
+  calentado  se llama app.calentar() antes (lo que hace post_fork en gunicorn)
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+
+
+def hijo(calentar):
+    inicio = time.perf_counter()
+    sys.path.insert(0, RAIZ)
+    import app as bot
+    importacion = time.perf_counter() - inicio
+
+    calentamiento = 0.0
+    if calentar:
+        t = time.perf_counter()
+        bot.calentar()
+        calentamiento = time.perf_counter() - t
+
+    cliente = bot.app.test_client()
+    tiempos = []
+    for n, texto in enumerate(["catalogo", "1"]):
+        t = time.perf_counter()
+        cliente.post("/webhook", json={"entry": [{"messaging": [{
+            "sender": {"id": "arranque"},
+            "message": {"mid": f"arranque.{n}", "text": texto},
+        }]}]})
+        tiempos.append(time.perf_counter() - t)
+    bot.despachador.esperar()
+
+    print(json.dumps({
+        "importacion_s": importacion,
+        "calentamiento_s": calentamiento,
+        "primer_mensaje_s": tiempos[0],
+        "segundo_mensaje_s": tiempos[1],
+        "hasta_primera_respuesta_s": time.perf_counter() - inicio - tiempos[1],
+    }))
+
+
+def medir(calentar, entorno):
+    args = [sys.executable, os.path.abspath(__file__), "--hijo"]
+    if calentar:
+        args.append("--calentar")
+    salida = subprocess.run(args, env=entorno, capture_output=True, text=True, check=True).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--backend", default="memoria", choices=["memoria", "firebase"])
+    parser.add_argument("--productos", type=int, default=300)
+    parser.add_argument("--latencia-firestore-ms", type=float, default=0.0)
+    parser.add_argument("--salida", help="archivo JSON con los resultados")
+    parser.add_argument("--hijo", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--calentar", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        hijo(args.calentar)
+        return
+
+    sys.path.insert(0, AQUI)
+    from replay_webhook import generar_semilla, levantar_graph_falso
+
+    graph, graph_url = levantar_graph_falso(0.0)
+    entorno = dict(
+        os.environ,
+        FIRESTORE_BACKEND=args.backend,
+        GRAPH_API_URL=graph_url,
+        PAGE_ACCESS_TOKEN=os.environ.get("PAGE_ACCESS_TOKEN", "benchmark"),
+        ESCRITURAS_PENDIENTES=os.devnull,
+        ESCRITURAS_DESCARTADAS=os.devnull,
+        ENVIO_TASA_PAGINA="0",
+        ENVIO_TASA_USUARIO="0",
+    )
+    if args.backend == "memoria":
+        semilla = generar_semilla(args.productos, 10, random.Random(7))
+        archivo = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+        with archivo:
+            json.dump(semilla, archivo)
+        entorno["FIRESTORE_SEMILLA"] = archivo.name
+        entorno["FIRESTORE_LATENCIA_MS"] = str(args.latencia_firestore_ms)
+
+    resultados = {"config": vars(args)}
+    try:
+        for modo, calentar in (("frio", False), ("calentado", True)):
+            corridas = [medir(calentar, entorno) for _ in range(args.repeticiones)]
+            resultados[modo] = {
+                campo: statistics.median(c[campo] for c in corridas) for campo in corridas[0]
+            }
+    finally:
+        if args.backend == "memoria":
+            os.remove(archivo.name)
+        graph.shutdown()
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+    print(f"mediana de {args.repeticiones} arranques ({args.backend}), en ms:")
+    print(f"  {'modo':<10} {'importar':>9} {'calentar':>9} {'1er msg':>9} {'2o msg':>9} {'total':>9}")
+    for modo in ("frio", "calentado"):
+        r = resultados[modo]
+        print(f"  {modo:<10} {r['importacion_s'] * 1000:9.1f} {r['calentamiento_s'] * 1000:9.1f} "
+              f"{r['primer_mensaje_s'] * 1000:9.1f} {r['segundo_mensaje_s'] * 1000:9.1f} "
+              f"{r['hasta_primera_respuesta_s'] * 1000:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# benchmarks/bench_normalizacion.py
+"""
+Compara normalizacion.normalizar con la función original de app.py sobre
+un corpus parecido al tráfico real del bot y reporta mensajes por segundo.
+
+    python benchmarks/bench_normalizacion.py [--mensajes 200000] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalizacion import normalizar  # noqa: E402
+
+
+def normalizar_original(t):
+    if not t:
+        return ""
+    t = t.lower().strip()
+    t = unicodedata.normalize("NFD", t)
+    t = "".join(c for c in t if not unicodedata.combining(c))
+    t = t.translate(str.maketrans("", "", string.punctuation))
+    t = " ".join(t.split())
+    return t
+
+
+# (mensaje, peso): muchos comandos cortos y repetidos, pocos textos largos
+PLANTILLAS = [
+    ("si", 20), ("Sí", 15), ("no", 20), ("siguiente", 10), ("Hola", 5),
+    ("catálogo", 5), ("finalizar pedido", 4), ("ya", 4), ("Domicilio", 3),
+    ("Recoger en tienda", 2), ("iniciar sesión", 2), ("registrar", 1),
+    ("si {id}", 10), ("pedido {id}", 4), ("{id}", 6), ("ver pedido {pedido}", 2),
+    ("{tel}", 2), ("Vestidos", 3), ("2", 3),
+    ("¡Hola! ¿Tienen envíos a Querétaro? 😊", 1),
+    ("Mi dirección es Av. Insurgentes Sur 1234, Col. Del Valle, CDMX", 1),
+    ("María José Núñez Peña", 1),
+    ("Quiero ese vestido negro 👗❤️ ¿todavía hay en talla M?", 1),
+]
+
+
+def generar_corpus(n, semilla=7):
+    rnd = random.Random(semilla)
+    plantillas = [p for p, _ in PLANTILLAS]
+    pesos = [w for _, w in PLANTILLAS]
+    corpus = []
+    for plantilla in rnd.choices(plantillas, weights=pesos, k=n):
+        corpus.append(plantilla.format(
+            id=rnd.randint(100, 999),
+            pedido="".join(rnd.choices(string.ascii_letters + string.digits, k=20)),
+            tel="55" + "".join(rnd.choices(string.digits, k=8)),
+        ))
+    return corpus
+
+
+def medir(funcion, corpus, repeticiones=3):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for msg in corpus:
+            funcion(msg)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return len(corpus) / mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mensajes", type=int, default=200000)
+    parser.add_argument("--json", action="store_true", help="salida legible por máquina")
+    args = parser.parse_args()
+
+    corpus = generar_corpus(args.mensajes)
+    for msg in corpus[:5000]:
+        assert normalizar(msg) == normalizar_original(msg), msg
+
+    resultados = {
+        "mensajes": len(corpus),
+        "original_msg_s": medir(normalizar_original, corpus),
+        "nueva_msg_s": medir(normalizar, corpus),
+    }
+    resultados["aceleracion"] = resultados["nueva_msg_s"] / resultados["original_msg_s"]
+
+    if args.json:
+        print(json.dumps(resultados))
+    else:
+        print(f"Corpus: {resultados['mensajes']} mensajes")
+        print(f"  original: {resultados['original_msg_s']:>12,.0f} msg/s")
+        print(f"  nueva:    {resultados['nueva_msg_s']:>12,.0f} msg/s")
+        print(f"  x{resultados['aceleracion']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
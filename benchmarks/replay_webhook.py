@@ -0,0 +1,284 @@
+# benchmarks/replay_webhook.py
+"""
+Reproduce conversaciones completas de Messenger contra el endpoint /webhook
+con Firestore en memoria y una Send API falsa, y reporta throughput,
+latencias p50/p95/p99 por estado de la conversación y lecturas/escrituras
+de Firestore por mensaje.
+
+    python benchmarks/replay_webhook.py --usuarios 2000 --salida resultados.json
+
+Flujo por usuario: saludo -> iniciar sesión -> teléfono -> categoría ->
+si -> no -> si ID -> finalizar -> entrega -> ver pedido ID (el pedido que
+acaba de hacer, así se mide la consulta de pedidos). Es el recorrido de
+un producto por turno, así que se fija MODO_CATALOGO=producto.
+
+Las lecturas/escrituras por estado solo se miden con --hilos 1; aun así,
+las escrituras diferidas se cuentan en el mensaje que esté en curso cuando
+se hace el commit, así que el total por mensaje es el dato confiable.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CATEGORIAS = ["Vestidos", "Blusas", "Pantalones", "Bolsas", "Joyeria", "Zapatos"]
+
+
+# ------------------------------------------------------------
+# SEND API FALSA
+# ------------------------------------------------------------
+class _GraphFalso(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # si no, cada respuesta espera el ACK retardado (~40 ms)
+    latencia = 0.0
+    recibidos = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.latencia:
+            time.sleep(self.latencia)
+        type(self).recibidos += 1
+        if self.path.startswith("/me/message_attachments"):
+            cuerpo = b'{"attachment_id":"adjunto-falso"}'
+        else:
+            cuerpo = b'{"recipient_id":"1","message_id":"m"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def levantar_graph_falso(latencia):
+    _GraphFalso.latencia = latencia
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _GraphFalso)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+# ------------------------------------------------------------
+# DATOS Y CONVERSACIONES
+# ------------------------------------------------------------
+def generar_semilla(productos, usuarios, rnd):
+    catalogo = {}
+    for i in range(productos):
+        pid = str(1000 + i)
+        cat = CATEGORIAS[i % len(CATEGORIAS)]
+        catalogo[pid] = {
+            "nombre": f"{cat[:-1]} modelo {i}",
+            "precio": rnd.choice([199, 249, 299, 349, 499, 799]),
+            "categoria": cat,
+            "imagen_url": f"https://storage.example.com/productos/{pid}.jpg",
+            "stock": {"Piezas": rnd.randint(0, 20)},
+            "descripcion": "Tela ligera, corte recto. " * 5,
+        }
+    usuarios_db = {
+        telefono(i): {"nombre": f"cliente {i}", "telefono": telefono(i), "direccion": f"calle {i}"}
+        for i in range(usuarios)
+    }
+    return {"productos": catalogo, "usuarios": usuarios_db}
+
+
+def telefono(i):
+    return f"55{i:08d}"
+
+
+def conversacion(i, catalogo, rnd):
+    cat_idx = rnd.randrange(len(CATEGORIAS))
+    ids = [pid for pid, p in catalogo.items() if p["categoria"] == CATEGORIAS[cat_idx]]
+    return [
+        "Hola",
+        "iniciar sesión",
+        telefono(i),
+        str(cat_idx + 1),
+        "sí",
+        "no",
+        f"si {rnd.choice(ids)}",
+        "finalizar pedido",
+        rnd.choice(["domicilio", "recoger en tienda"]),
+        "ver pedido {pedido}",  # el ID se conoce hasta que se finaliza
+    ]
+
+
+def payload(sender, texto, mid):
+    return {
+        "object": "page",
+        "entry": [{
+            "id": "pagina",
+            "time": int(time.time() * 1000),
+            "messaging": [{
+                "sender": {"id": sender},
+                "recipient": {"id": "pagina"},
+                "timestamp": int(time.time() * 1000),
+                "message": {"mid": mid, "text": texto},
+            }],
+        }],
+    }
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    k = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[k]
+
+
+def resumen(latencias):
+    return {
+        "mensajes": len(latencias),
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "max_ms": max(latencias) * 1000 if latencias else 0.0,
+    }
+
+
+# ------------------------------------------------------------
+# EJECUCIÓN
+# ------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--productos", type=int, default=300)
+    parser.add_argument("--hilos", type=int, default=1, help="peticiones concurrentes al webhook")
+    parser.add_argument("--latencia-firestore-ms", type=float, default=0.0)
+    parser.add_argument("--latencia-graph-ms", type=float, default=0.0)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--salida", help="archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.semilla)
+    semilla = generar_semilla(args.productos, args.usuarios, rnd)
+    graph, graph_url = levantar_graph_falso(args.latencia_graph_ms / 1000)
+
+    # La app lee su configuración al importarse
+    os.environ["FIRESTORE_BACKEND"] = "memoria"
+    os.environ["FIRESTORE_LATENCIA_MS"] = str(args.latencia_firestore_ms)
+    os.environ["GRAPH_API_URL"] = graph_url
+    os.environ.setdefault("PAGE_ACCESS_TOKEN", "benchmark")
+    os.environ.setdefault("ESCRITURAS_PENDIENTES", os.devnull)
+    os.environ.setdefault("ESCRITURAS_DESCARTADAS", os.devnull)
+    # "si" / "no" / "si ID" son turnos del modo producto
+    os.environ["MODO_CATALOGO"] = "producto"
+    # Se mide el bot, no el control de tasa de salida
+    os.environ.setdefault("ENVIO_TASA_PAGINA", "0")
+    os.environ.setdefault("ENVIO_TASA_USUARIO", "0")
+
+    import conexion_firebase
+    db = conexion_firebase.db
+    for coleccion, docs in semilla.items():
+        db._datos[coleccion] = docs
+    import app as bot
+
+    cliente = bot.app.test_client()
+    conversaciones = [conversacion(i, semilla["productos"], rnd) for i in range(args.usuarios)]
+
+    # Los usuarios avanzan por turnos, intercalados como en tráfico real
+    mensajes = []
+    for paso in range(len(conversaciones[0])):
+        for i, conv in enumerate(conversaciones):
+            mensajes.append((f"psid-{i}", conv[paso]))
+
+    por_estado = defaultdict(list)
+    lecturas_estado = defaultdict(int)
+    escrituras_estado = defaultdict(int)
+    lock = threading.Lock()
+    secuencial = args.hilos <= 1
+
+    def enviar(n, sender, texto):
+        sesion = bot.user_state.get(sender, {})
+        estado = sesion.get("estado", "inicio")
+        texto = texto.format(pedido=sesion.get("ultimo_pedido_id", ""))
+        antes = db.contadores() if secuencial else None
+        inicio = time.perf_counter()
+        resp = cliente.post("/webhook", json=payload(sender, texto, f"mid.{n}"))
+        latencia = time.perf_counter() - inicio
+        assert resp.status_code == 200, resp.status_code
+        with lock:
+            por_estado[estado].append(latencia)
+            if secuencial:
+                despues = db.contadores()
+                lecturas_estado[estado] += despues["lecturas"] - antes["lecturas"]
+                escrituras_estado[estado] += despues["escrituras"] - antes["escrituras"]
+
+    db.reiniciar_contadores()
+    inicio = time.perf_counter()
+    if secuencial:
+        for n, (sender, texto) in enumerate(mensajes):
+            enviar(n, sender, texto)
+    else:
+        with ThreadPoolExecutor(args.hilos) as pool:
+            # un turno completo termina antes de empezar el siguiente
+            por_paso = len(conversaciones)
+            for base in range(0, len(mensajes), por_paso):
+                list(pool.map(lambda x: enviar(*x), [
+                    (base + j, s, t) for j, (s, t) in enumerate(mensajes[base:base + por_paso])
+                ]))
+    duracion = time.perf_counter() - inicio
+
+    bot.despachador.esperar()
+    bot.escrituras.vaciar()
+    contadores = db.contadores()
+    todas = [lat for lats in por_estado.values() for lat in lats]
+
+    resultados = {
+        "config": vars(args),
+        "mensajes": len(mensajes),
+        "duracion_s": duracion,
+        "mensajes_por_s": len(mensajes) / duracion,
+        "latencia": resumen(todas),
+        "por_estado": {
+            estado: dict(
+                resumen(lats),
+                **({
+                    "lecturas_por_msg": lecturas_estado[estado] / len(lats),
+                    "escrituras_por_msg": escrituras_estado[estado] / len(lats),
+                } if secuencial else {}),
+            )
+            for estado, lats in sorted(por_estado.items())
+        },
+        "firestore": dict(
+            contadores,
+            lecturas_por_msg=contadores["lecturas"] / len(mensajes),
+            escrituras_por_msg=contadores["escrituras"] / len(mensajes),
+        ),
+        "envios": dict(bot.despachador.estadisticas(), recibidos_graph=_GraphFalso.recibidos),
+        "pedidos": len(db._datos.get("pedidos", {})),
+    }
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+    print(f"{resultados['mensajes']} mensajes en {duracion:.2f}s "
+          f"-> {resultados['mensajes_por_s']:.0f} msg/s")
+    lat = resultados["latencia"]
+    print(f"latencia total: p50 {lat['p50_ms']:.2f} ms  p95 {lat['p95_ms']:.2f} ms  p99 {lat['p99_ms']:.2f} ms")
+    for estado, r in resultados["por_estado"].items():
+        extra = ""
+        if secuencial:
+            extra = f"  lect/msg {r['lecturas_por_msg']:.2f}  escr/msg {r['escrituras_por_msg']:.2f}"
+        print(f"  {estado:<20} n={r['mensajes']:<6} p50 {r['p50_ms']:.2f}  p95 {r['p95_ms']:.2f}  "
+              f"p99 {r['p99_ms']:.2f} ms{extra}")
+    fs = resultados["firestore"]
+    print(f"firestore: {fs['lecturas_por_msg']:.3f} lecturas/msg, {fs['escrituras_por_msg']:.3f} escrituras/msg, "
+          f"{fs['bytes_leidos'] / 1024:.1f} KiB leídos")
+    graph.shutdown()
+
+
+if __name__ == "__main__":
+    main()
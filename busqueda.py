@@ -0,0 +1,265 @@
+# busqueda.py
+import heapq
+import threading
+from bisect import bisect_left, insort
+from itertools import chain, islice
+
+from normalizacion import normalizar
+
+# Palabras que no ayudan a distinguir productos
+PALABRAS_VACIAS = frozenset(
+    "de del la el los las un una unos unas en con para por y o a al que me mi".split()
+)
+
+MIN_PREFIJO = 2      # "ve" ya busca prefijos; "v" no
+MIN_PARECIDA = 4     # errores de dedo solo en palabras de 4+ letras
+MAX_PREFIJOS = 64    # palabras del vocabulario que se revisan por prefijo
+MAX_CANDIDATOS = 2000  # productos que se puntúan si ninguno tiene todas las palabras
+
+
+def palabras(texto):
+    """Palabras normalizadas de un texto, sin palabras vacías."""
+    return [p for p in normalizar(texto or "").split() if p not in PALABRAS_VACIAS]
+
+
+def _sin_una_letra(palabra):
+    return {palabra[:i] + palabra[i + 1:] for i in range(len(palabra))}
+
+
+def _a_un_cambio(a, b):
+    """True si a y b difieren en a lo más una letra (cambio, falta, sobra o dos letras cruzadas)."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    i = 0
+    while i < min(la, lb) and a[i] == b[i]:
+        i += 1
+    if la == lb:
+        if a[i + 1:] == b[i + 1:]:
+            return True
+        return a[i] == b[i + 1:i + 2] and a[i + 1:i + 2] == b[i] and a[i + 2:] == b[i + 2:]
+    if la > lb:
+        return a[i + 1:] == b[i:]
+    return a[i:] == b[i + 1:]
+
+
+class IndiceBusqueda:
+    """
+    Índice invertido de nombres y categorías del catálogo:
+      - postings:  palabra -> {ids}
+      - vocab:     palabras ordenadas, para buscar por prefijo con bisect
+      - borrados:  palabra con una letra menos -> {palabras}, para aceptar
+                   un error de dedo sin recorrer todo el vocabulario
+
+    `sincronizar(productos)` solo reindexa los productos que cambiaron
+    respecto al último catálogo (los que no cambian conservan el mismo
+    diccionario gracias a la copia por versión de CacheCatalogo).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._vocab = []
+        self._borrados = {}
+        self._palabras_de = {}
+        self._rango = {}       # id -> (largo del nombre, id): desempate entre resultados
+        self._orden = {}       # palabra -> ids ordenados por _rango (caché)
+        self._productos = {}
+        self.version = None
+
+    # --------------------------------------------------------
+    # CONSTRUCCIÓN
+    # --------------------------------------------------------
+    def sincronizar(self, productos, version=None):
+        if productos is self._productos:
+            return
+        with self._lock:
+            if productos is self._productos:
+                return
+            anterior = self._productos
+            for pid in anterior.keys() - productos.keys():
+                self._quitar(pid)
+            for pid, datos in productos.items():
+                previo = anterior.get(pid)
+                if previo is datos or (previo is not None and previo == datos):
+                    continue
+                self._quitar(pid)
+                self._agregar(pid, datos)
+            self._productos = productos
+            self.version = version
+
+    def _agregar(self, pid, datos):
+        tokens = set(palabras(datos.get("nombre")) + palabras(datos.get("categoria")))
+        self._palabras_de[pid] = tokens
+        self._rango[pid] = (len(datos.get("nombre") or ""), pid)
+        for palabra in tokens:
+            ids = self._postings.get(palabra)
+            if ids is None:
+                ids = self._postings[palabra] = set()
+                insort(self._vocab, palabra)
+                if len(palabra) >= MIN_PARECIDA:
+                    for variante in _sin_una_letra(palabra):
+                        self._borrados.setdefault(variante, set()).add(palabra)
+            ids.add(pid)
+            self._orden.pop(palabra, None)
+
+    def _quitar(self, pid):
+        self._rango.pop(pid, None)
+        for palabra in self._palabras_de.pop(pid, ()):
+            ids = self._postings[palabra]
+            ids.discard(pid)
+            self._orden.pop(palabra, None)
+            if ids:
+                continue
+            del self._postings[palabra]
+            del self._vocab[bisect_left(self._vocab, palabra)]
+            if len(palabra) >= MIN_PARECIDA:
+                for variante in _sin_una_letra(palabra):
+                    grupo = self._borrados[variante]
+                    grupo.discard(palabra)
+                    if not grupo:
+                        del self._borrados[variante]
+
+    # --------------------------------------------------------
+    # BÚSQUEDA
+    # --------------------------------------------------------
+    def _niveles(self, palabra):
+        """
+        Palabras del vocabulario que coinciden con una de la búsqueda, en tres
+        niveles: exacta, por prefijo y con un error de dedo.
+        """
+        exactas = [palabra] if palabra in self._postings else []
+        prefijos = []
+        if len(palabra) >= MIN_PREFIJO:
+            i = bisect_left(self._vocab, palabra)
+            fin = min(i + MAX_PREFIJOS, len(self._vocab))
+            while i < fin and self._vocab[i].startswith(palabra):
+                if self._vocab[i] != palabra:
+                    prefijos.append(self._vocab[i])
+                i += 1
+
+        parecidas = []
+        if len(palabra) >= MIN_PARECIDA:
+            candidatas = set(self._borrados.get(palabra, ()))
+            for variante in _sin_una_letra(palabra):
+                if variante in self._postings:
+                    candidatas.add(variante)
+                candidatas.update(self._borrados.get(variante, ()))
+            parecidas = [
+                otra for otra in candidatas
+                if otra != palabra and not otra.startswith(palabra) and _a_un_cambio(palabra, otra)
+            ]
+        return exactas, prefijos, parecidas
+
+    def _ordenados(self, palabra):
+        """Ids de una palabra ordenados por _rango (se calcula al primer uso)."""
+        lista = self._orden.get(palabra)
+        if lista is None:
+            lista = self._orden[palabra] = sorted(self._postings[palabra], key=self._rango.__getitem__)
+        return lista
+
+    def buscar(self, texto, limite=10):
+        """
+        [(id, datos)] ordenados por relevancia: primero los que tienen todas
+        las palabras exactas, luego exactas o como prefijo, luego con un
+        error de dedo; si ninguno tiene todas, los que tienen más de ellas.
+        Dentro de cada grupo van primero los nombres más cortos.
+        """
+        consulta = list(dict.fromkeys(palabras(texto)))
+        if not consulta:
+            return []
+
+        # Bajo el lock solo lo que lee el índice vivo; si ninguno tiene
+        # todas las palabras, se puntúa fuera sobre lo copiado
+        with self._lock:
+            niveles = [self._niveles(p) for p in consulta]
+            elegidos = self._con_todas(niveles, limite)
+            if elegidos or len(niveles) < 2:
+                return elegidos
+            candidatos = self._candidatos(niveles, limite)
+        return _mas_cubiertos(niveles, candidatos, limite)
+
+    def _con_todas(self, niveles, limite):
+        elegidos = []
+        vistos = set()
+
+        # Todas las palabras, del nivel más estricto al más flexible. Se
+        # recorre en orden de _rango la palabra con menos productos y se
+        # revisa que los demás términos también estén; así no se arman
+        # uniones ni intersecciones de miles de ids. Un nivel que no agrega
+        # palabras (sin prefijos o sin errores de dedo) no da nada nuevo.
+        anteriores = None
+        for nivel in range(3):
+            terminos = [sum(n[:nivel + 1], []) for n in niveles]
+            if not all(terminos) or terminos == anteriores:
+                continue
+            anteriores = terminos
+            tamanos = [sum(len(self._postings[t]) for t in ts) for ts in terminos]
+            guia = tamanos.index(min(tamanos))
+            otros = [
+                [self._postings[t] for t in ts]
+                for k, ts in enumerate(terminos) if k != guia
+            ]
+            recorrido = heapq.merge(
+                *(self._ordenados(t) for t in terminos[guia]), key=self._rango.__getitem__
+            )
+            for pid in recorrido:
+                if pid in vistos:
+                    continue
+                if all(any(pid in ids for ids in conjuntos) for conjuntos in otros):
+                    elegidos.append(pid)
+                    vistos.add(pid)
+                    if len(elegidos) >= limite:
+                        break
+            if len(elegidos) >= limite:
+                break
+
+        return [(pid, self._productos[pid]) for pid in elegidos]
+
+    def _candidatos(self, niveles, limite):
+        """
+        {id: (palabras, _rango, datos)} de hasta MAX_CANDIDATOS productos
+        con alguna de las palabras (nada de eso se modifica después). Entran
+        los primeros `limite` de cada palabra en orden de _rango (los mejores
+        si ninguno tiene más de una) y luego el resto, empezando por la
+        palabra con menos productos: uno al que le falta una sola palabra
+        sale en la primera o en la segunda lista.
+        """
+        terminos = sorted(
+            (sum(n, []) for n in niveles),
+            key=lambda ts: sum(len(self._postings[t]) for t in ts),
+        )
+        listas = [
+            heapq.merge(*(self._ordenados(t) for t in ts), key=self._rango.__getitem__)
+            for ts in terminos
+        ]
+        tope = MAX_CANDIDATOS + limite * len(listas)
+        candidatos = {}
+        for lista in [islice(lista, limite) for lista in listas] + listas:
+            for pid in lista:
+                if pid in candidatos:
+                    continue
+                if len(candidatos) >= tope:
+                    return candidatos
+                candidatos[pid] = (self._palabras_de[pid], self._rango[pid], self._productos[pid])
+        return candidatos
+
+    def estadisticas(self):
+        return {
+            "productos": len(self._palabras_de),
+            "palabras": len(self._postings),
+            "version": self.version,
+        }
+
+
+def _mas_cubiertos(niveles, candidatos, limite):
+    """Los `limite` candidatos con más palabras de la búsqueda; empate por _rango."""
+    buscadas = [set(chain.from_iterable(n)) for n in niveles]
+
+    def clave(pid):
+        tokens, rango, _ = candidatos[pid]
+        return -sum(not tokens.isdisjoint(b) for b in buscadas), rango
+
+    return [(pid, candidatos[pid][2]) for pid in heapq.nsmallest(limite, candidatos, key=clave)]
@@ -0,0 +1,226 @@
+# cache_catalogo.py
+import os
+import threading
+import time
+
+
+class CacheCatalogo:
+    """
+    Copia en memoria de la colección 'productos'.
+
+    Si hay listener (on_snapshot) la copia se mantiene al día con los cambios
+    que manda Firestore; si no, se recarga completa cuando vence el TTL.
+    Mientras el listener siga activo la copia se da por vigente, aunque el
+    catálogo pase horas sin cambios. Si el listener se cae (watch con
+    `is_active` en False) se sigue sirviendo la copia que hay, se vuelve a
+    suscribir y, hasta que llegue su primer snapshot, se vive del TTL.
+    Solo se espera al primer snapshot cuando todavía no hay catálogo.
+    Cada cambio genera un diccionario nuevo y sube `version`, así que quien
+    ya tiene una referencia nunca ve el catálogo a medias.
+
+    Con `campos`, los documentos que llegan por el listener se recortan a
+    esos campos antes de guardarse (`cargar` ya debe pedirlos con select).
+
+    `al_publicar(productos, version)`, si se asigna, se llama con cada
+    versión nueva (así CatalogoCompartido escribe su snapshot).
+    """
+
+    def __init__(self, cargar, escuchar=None, ttl=None, espera_listener=5.0, campos=None):
+        self._cargar = cargar          # () -> {id: datos}
+        self._escuchar = escuchar      # (callback) -> watch
+        self.campos = campos
+        if ttl is None:
+            ttl = float(os.getenv("CATALOGO_TTL", "300"))
+        self.ttl = ttl
+        self.espera_listener = espera_listener
+
+        self._lock = threading.Lock()
+        self._primer_snapshot = threading.Event()
+        self._productos = None
+        self._cargado_en = 0.0
+        self._watch = None
+        self._escuchando = False
+        self._espera_hasta = 0.0       # monotonic: hasta cuándo vale esperar el primer snapshot
+        self._generacion = 0           # snapshots de listeners ya cerrados se ignoran
+        self.al_publicar = None
+
+        self.version = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.recargas = 0
+        self.cambios_recibidos = 0
+
+    # --------------------------------------------------------
+    # LECTURA
+    # --------------------------------------------------------
+    def obtener(self):
+        """Devuelve el diccionario {id: datos}. No se debe modificar."""
+        productos = self._productos
+        if productos is not None and self._fresco():
+            self.aciertos += 1
+            return productos
+
+        with self._lock:
+            productos = self._productos
+            if productos is not None and self._fresco():
+                self.aciertos += 1
+                return productos
+
+            self.fallos += 1
+            if self._escuchando:
+                # El listener se cayó: se suscribe de nuevo y mientras llega
+                # su primer snapshot se sirve la copia actual (un TTL más)
+                print("⚠️ El listener de productos se cerró; se vuelve a suscribir")
+                self._cerrar_listener()
+                self._iniciar_listener()
+                self._cargado_en = time.monotonic()
+                return productos
+            if self._escuchar and not self._vivo():
+                self._cerrar_listener()
+                self._iniciar_listener()
+            # El primer snapshot trae el catálogo completo: si no hay copia
+            # se le espera, una sola vez por suscripción
+            esperar = 0.0
+            if productos is None and self._watch is not None and not self._primer_snapshot.is_set():
+                esperar = self._espera_hasta - time.monotonic()
+
+        if esperar > 0 and self._primer_snapshot.wait(esperar):
+            return self._productos
+
+        with self._lock:
+            if self._escuchando and self._productos is not None:
+                return self._productos
+            return self._recargar()
+
+    def _vivo(self):
+        watch = self._watch
+        return watch is not None and getattr(watch, "is_active", True)
+
+    def _fresco(self):
+        if self._escuchando:
+            return self._vivo()
+        return time.monotonic() - self._cargado_en < self.ttl
+
+    def _recargar(self):
+        productos = self._cargar()
+        self._publicar(productos)
+        self.recargas += 1
+        return productos
+
+    def _publicar(self, productos):
+        self._productos = productos
+        self._cargado_en = time.monotonic()
+        self.version += 1
+        if self.al_publicar is not None:
+            try:
+                self.al_publicar(productos, self.version)
+            except Exception as e:
+                print("🔥 Error al publicar el catálogo:", e)
+
+    def invalidar(self):
+        """Obliga a recargar en la siguiente lectura (si no hay listener)."""
+        self._cargado_en = 0.0
+
+    # --------------------------------------------------------
+    # LISTENER (on_snapshot)
+    # --------------------------------------------------------
+    def _iniciar_listener(self):
+        self._generacion += 1
+        generacion = self._generacion
+
+        def al_cambiar(docs, cambios, read_time):
+            if generacion == self._generacion:
+                self._on_snapshot(docs, cambios, read_time)
+
+        self._espera_hasta = time.monotonic() + self.espera_listener
+        try:
+            self._watch = self._escuchar(al_cambiar)
+        except Exception as e:
+            print("🔥 No se pudo iniciar el listener de productos:", e)
+            self._escuchar = None
+            self._watch = None
+
+    def _on_snapshot(self, docs, cambios, read_time):
+        with self._lock:
+            if not self._primer_snapshot.is_set() or self._productos is None:
+                productos = {doc.id: self._datos(doc) for doc in docs}
+                if productos == self._productos:
+                    productos = None  # listener nuevo, mismo catálogo: no hay versión nueva
+            else:
+                productos = dict(self._productos)
+                for cambio in cambios:
+                    doc = cambio.document
+                    if cambio.type.name == "REMOVED":
+                        productos.pop(doc.id, None)
+                    else:
+                        productos[doc.id] = self._datos(doc)
+            self.cambios_recibidos += len(cambios)
+            if productos is None:
+                self._cargado_en = time.monotonic()
+            else:
+                self._publicar(productos)
+            self._escuchando = True
+        self._primer_snapshot.set()
+
+    def _datos(self, doc):
+        datos = doc.to_dict()
+        if self.campos is None or datos is None:
+            return datos
+        return recortar(datos, self.campos)
+
+    def _cerrar_listener(self):
+        watch = self._watch
+        self._generacion += 1
+        self._escuchando = False
+        self._watch = None
+        self._primer_snapshot.clear()
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                print("🔥 Error al cerrar el listener de productos:", e)
+
+    def detener(self):
+        """Cierra el listener; a partir de aquí la caché vive del TTL."""
+        watch = self._watch
+        self._generacion += 1
+        self._escuchando = False
+        self._escuchar = None
+        self._watch = None
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                print("🔥 Error al cerrar el listener de productos:", e)
+
+    # --------------------------------------------------------
+    # MÉTRICAS
+    # --------------------------------------------------------
+    def estadisticas(self):
+        return {
+            "version": self.version,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "recargas": self.recargas,
+            "cambios_recibidos": self.cambios_recibidos,
+            "escuchando": self._escuchando,
+            "productos": len(self._productos or {}),
+        }
+
+
+def recortar(datos, campos):
+    """Copia de `datos` con solo los campos indicados ("stock.Piezas" = campo anidado)."""
+    resultado = {}
+    for ruta in campos:
+        partes = ruta.split(".")
+        valor = datos
+        for parte in partes:
+            if not isinstance(valor, dict) or parte not in valor:
+                break
+            valor = valor[parte]
+        else:
+            destino = resultado
+            for parte in partes[:-1]:
+                destino = destino.setdefault(parte, {})
+            destino[partes[-1]] = valor
+    return resultado
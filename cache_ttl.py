@@ -0,0 +1,99 @@
+# cache_ttl.py
+import threading
+import time
+from collections import OrderedDict
+
+_NO_EXISTE = object()
+
+
+class CacheTTL:
+    """
+    Caché LRU acotada con vencimiento por entrada.
+
+    `obtener(clave, cargar)` es de lectura directa: si no está (o venció)
+    llama a `cargar(clave)`. Un resultado None también se guarda, con
+    `ttl_negativo`, para que las claves inexistentes no cuesten una lectura
+    cada vez.
+    """
+
+    def __init__(self, maximo=10000, ttl=30.0, ttl_negativo=None):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.ttl_negativo = ttl if ttl_negativo is None else ttl_negativo
+        self._datos = OrderedDict()   # clave -> (valor, expira)
+        self._lock = threading.Lock()
+
+        self.aciertos = 0
+        self.aciertos_negativos = 0
+        self.fallos = 0
+
+    def _vigente(self, clave):
+        item = self._datos.get(clave)
+        if item is None:
+            return None
+        if item[1] < time.monotonic():
+            del self._datos[clave]
+            return None
+        self._datos.move_to_end(clave)
+        return item
+
+    def obtener(self, clave, cargar):
+        with self._lock:
+            item = self._vigente(clave)
+            if item is not None:
+                if item[0] is _NO_EXISTE:
+                    self.aciertos_negativos += 1
+                    return None
+                self.aciertos += 1
+                return item[0]
+            self.fallos += 1
+
+        valor = cargar(clave)
+        self.poner(clave, valor)
+        return valor
+
+    def consultar(self, clave):
+        """Valor en caché o None, sin cargar nada."""
+        with self._lock:
+            item = self._vigente(clave)
+            if item is None or item[0] is _NO_EXISTE:
+                return None
+            self.aciertos += 1
+            return item[0]
+
+    def poner(self, clave, valor):
+        """Guarda un valor (None = 'no existe')."""
+        if valor is None:
+            item = (_NO_EXISTE, time.monotonic() + self.ttl_negativo)
+        else:
+            item = (valor, time.monotonic() + self.ttl)
+        with self._lock:
+            self._datos[clave] = item
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def actualizar(self, clave, cambios):
+        """Aplica cambios a un valor en caché; si no está, solo invalida."""
+        with self._lock:
+            item = self._vigente(clave)
+            if item is None or item[0] is _NO_EXISTE:
+                self._datos.pop(clave, None)
+                return
+            valor = dict(item[0])
+            valor.update(cambios)
+            self._datos[clave] = (valor, item[1])
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def estadisticas(self):
+        consultas = self.aciertos + self.aciertos_negativos + self.fallos
+        return {
+            "entradas": len(self._datos),
+            "aciertos": self.aciertos,
+            "aciertos_negativos": self.aciertos_negativos,
+            "fallos": self.fallos,
+            "tasa_aciertos": (self.aciertos + self.aciertos_negativos) / consultas if consultas else 0.0,
+        }
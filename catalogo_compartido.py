@@ -0,0 +1,320 @@
+# catalogo_compartido.py
+"""
+Catálogo compartido por todos los workers de un nodo.
+
+Un solo proceso (el que toma el candado `<ruta>.lock`) mantiene la
+CacheCatalogo contra Firestore y, cada vez que publica una versión nueva,
+escribe un snapshot binario en `<ruta>`. Los demás workers lo abren con
+mmap de solo lectura: las páginas del archivo viven una vez en el page
+cache del sistema, no una vez por worker, y no hacen lecturas a Firestore.
+
+Formato del snapshot (little endian):
+    cabecera   MAGIA (8 bytes), versión (u64), productos (u32), reservado (u32)
+    tabla      por producto, en orden del catálogo:
+               inicio y largo del ID, inicio y largo de los datos (4 x u32)
+    orden      posiciones de la tabla ordenadas por ID (u32), para bisección
+    datos      IDs en UTF-8 y datos de cada producto en JSON
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+
+MAGIA = b"FRCAT\x00\x01\x00"
+CABECERA = struct.Struct("<8sQII")
+ENTRADA = struct.Struct("<IIII")
+POSICION = struct.Struct("<I")
+
+
+def _enteros(datos):
+    """Bloque de u32 little endian como array (copia pequeña por proceso)."""
+    numeros = array("I")
+    numeros.frombytes(datos)
+    if sys.byteorder == "big":
+        numeros.byteswap()
+    return numeros
+
+
+# ------------------------------------------------------------
+# ARCHIVO
+# ------------------------------------------------------------
+def escribir_snapshot(ruta, productos, version):
+    """
+    Escribe {id: datos} en `ruta`. Se escribe a un temporal y se reemplaza
+    con os.replace: quien ya tiene mapeado el archivo anterior lo sigue
+    viendo completo y quien lo abre después ve el nuevo.
+    """
+    ids = [pid.encode("utf-8") for pid in productos]
+    datos = [
+        json.dumps(d, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        for d in productos.values()
+    ]
+    n = len(ids)
+    inicio = CABECERA.size + n * (ENTRADA.size + POSICION.size)
+
+    tabla = []
+    posicion = inicio
+    for pid, dato in zip(ids, datos):
+        tabla.extend((posicion, len(pid), posicion + len(pid), len(dato)))
+        posicion += len(pid) + len(dato)
+    orden = sorted(range(n), key=ids.__getitem__)
+
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(CABECERA.pack(MAGIA, version, n, 0))
+        f.write(struct.pack(f"<{4 * n}I", *tabla))
+        f.write(struct.pack(f"<{n}I", *orden))
+        for pid, dato in zip(ids, datos):
+            f.write(pid)
+            f.write(dato)
+    os.replace(temporal, ruta)
+
+
+def version_snapshot(ruta):
+    """Versión del snapshot en `ruta`, o 0 si no existe o no es válido."""
+    try:
+        with open(ruta, "rb") as f:
+            magia, version, _, _ = CABECERA.unpack(f.read(CABECERA.size))
+    except (OSError, struct.error):
+        return 0
+    return version if magia == MAGIA else 0
+
+
+class SnapshotCatalogo(Mapping):
+    """
+    Vista {id: datos} de un snapshot mapeado en memoria. Los datos de un
+    producto se decodifican al pedirlos; el orden de iteración es el del
+    catálogo. Es inmutable: una versión nueva es otro SnapshotCatalogo.
+
+    Solo la tabla de posiciones se copia al proceso (16 + 4 bytes por
+    producto); IDs y datos se leen del mmap.
+    """
+
+    def __init__(self, ruta):
+        with open(ruta, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magia, self.version, self._n, _ = CABECERA.unpack_from(self._mm, 0)
+        if magia != MAGIA:
+            raise ValueError(f"❌ {ruta} no es un snapshot del catálogo")
+        fin_tabla = CABECERA.size + self._n * ENTRADA.size
+        self._tabla = _enteros(self._mm[CABECERA.size:fin_tabla])
+        self._orden = _enteros(self._mm[fin_tabla:fin_tabla + self._n * POSICION.size])
+        self.tamano = len(self._mm)
+
+    def _id(self, i):
+        ini = self._tabla[4 * i]
+        return self._mm[ini:ini + self._tabla[4 * i + 1]]
+
+    def _datos(self, i):
+        ini = self._tabla[4 * i + 2]
+        return json.loads(self._mm[ini:ini + self._tabla[4 * i + 3]])
+
+    def _buscar(self, pid):
+        clave = pid.encode("utf-8")
+        mm, tabla, orden = self._mm, self._tabla, self._orden
+        bajo, alto = 0, self._n
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            i = orden[medio]
+            ini = tabla[4 * i]
+            actual = mm[ini:ini + tabla[4 * i + 1]]
+            if actual == clave:
+                return i
+            if actual < clave:
+                bajo = medio + 1
+            else:
+                alto = medio
+        return None
+
+    def __getitem__(self, pid):
+        i = self._buscar(pid) if isinstance(pid, str) else None
+        if i is None:
+            raise KeyError(pid)
+        return self._datos(i)
+
+    def __contains__(self, pid):
+        return isinstance(pid, str) and self._buscar(pid) is not None
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self._id(i).decode("utf-8")
+
+    def items(self):
+        # Recorre la tabla directo, sin bisección por cada ID
+        mm, tabla, loads = self._mm, self._tabla, json.loads
+        for i in range(0, 4 * self._n, 4):
+            ini, largo, dini, dlargo = tabla[i:i + 4]
+            yield mm[ini:ini + largo].decode("utf-8"), loads(mm[dini:dini + dlargo])
+
+    def values(self):
+        for _, datos in self.items():
+            yield datos
+
+
+# ------------------------------------------------------------
+# CATÁLOGO COMPARTIDO (misma interfaz que CacheCatalogo)
+# ------------------------------------------------------------
+class CatalogoCompartido:
+    """
+    Envuelve una CacheCatalogo. El proceso que tiene el candado la mantiene
+    al día (listener o TTL) desde un hilo y escribe el snapshot en cada
+    versión; los demás solo revisan cada `revisar` segundos si el archivo
+    cambió y, si cambió, mapean el nuevo. Si el proceso refrescador muere el
+    sistema suelta el candado y lo toma el siguiente worker que revise.
+    """
+
+    def __init__(self, ruta, cache, revisar=1.0, espera=10.0):
+        self.ruta = ruta
+        self.cache = cache
+        self.revisar = revisar
+        self.espera = espera
+        cache.al_publicar = self._publicar
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._candado = None
+        self._snapshot = None
+        self._firma = None
+        self._revisado_en = 0.0
+        self._version_escrita = 0
+        self._escrito = None
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.cambios = 0
+        self.escritos = 0
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot is not None else self.cache.version
+
+    @property
+    def refrescador(self):
+        return self._candado is not None and self._pid == os.getpid()
+
+    # --------------------------------------------------------
+    # LECTURA
+    # --------------------------------------------------------
+    def obtener(self):
+        """Devuelve el catálogo {id: datos} (un SnapshotCatalogo). No se debe modificar."""
+        snapshot = self._snapshot
+        if (
+            snapshot is not None and self._pid == os.getpid()
+            and time.monotonic() - self._revisado_en < self.revisar
+        ):
+            self.aciertos += 1
+            return snapshot
+
+        with self._lock:
+            self.fallos += 1
+            if self._pid != os.getpid():
+                # Hijo recién creado por fork: nada de lo heredado es suyo
+                self._pid = os.getpid()
+                self._candado = None
+                self._snapshot = None
+                self._firma = None
+            if not self.refrescador:
+                self._tomar_candado()
+            if self._snapshot is None and self.refrescador:
+                self.cache.obtener()  # publica y escribe el snapshot de esta versión
+            self._revisado_en = time.monotonic()
+            self._abrir_si_cambio()
+
+            limite = time.monotonic() + self.espera
+            while self._snapshot is None and time.monotonic() < limite:
+                time.sleep(0.05)
+                self._abrir_si_cambio()
+            if self._snapshot is None:
+                # Nadie ha escrito el snapshot: este worker carga su propia copia
+                print("⚠️ No hay snapshot del catálogo en", self.ruta, "- se lee directo")
+                return self.cache.obtener()
+            return self._snapshot
+
+    def _abrir_si_cambio(self):
+        try:
+            st = os.stat(self.ruta)
+        except FileNotFoundError:
+            return
+        firma = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if firma == self._firma:
+            return
+        try:
+            snapshot = SnapshotCatalogo(self.ruta)
+        except (OSError, ValueError, struct.error) as e:
+            print("🔥 Error al abrir el snapshot del catálogo:", e)
+            return
+        # El mmap anterior se libera cuando nadie lo use (sin cerrarlo aquí)
+        self._snapshot = snapshot
+        self._firma = firma
+        self.cambios += 1
+
+    # --------------------------------------------------------
+    # REFRESCADOR
+    # --------------------------------------------------------
+    def _tomar_candado(self):
+        import fcntl
+
+        archivo = open(self.ruta + ".lock", "a")
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            archivo.close()
+            return False
+        self._candado = archivo
+        self._version_escrita = version_snapshot(self.ruta)
+        threading.Thread(target=self._refrescar, name="catalogo-compartido", daemon=True).start()
+        return True
+
+    def _refrescar(self):
+        # Con listener obtener() no hace nada tras el primer snapshot; con
+        # TTL recarga cuando vence. En ambos casos _publicar escribe el archivo.
+        while self.refrescador:
+            try:
+                self.cache.obtener()
+            except Exception as e:
+                print("🔥 Error al refrescar el catálogo compartido:", e)
+            time.sleep(self.revisar)
+
+    def _publicar(self, productos, version):
+        if not self.refrescador:
+            return
+        if productos == self._escrito:
+            return  # recarga por TTL sin cambios: los workers no vuelven a mapear
+        self._escrito = productos
+        self._version_escrita += 1
+        escribir_snapshot(self.ruta, productos, self._version_escrita)
+        self.escritos += 1
+
+    # --------------------------------------------------------
+    # CONTROL Y MÉTRICAS
+    # --------------------------------------------------------
+    def invalidar(self):
+        self.cache.invalidar()
+
+    def detener(self):
+        self.cache.detener()
+        candado, self._candado = self._candado, None
+        if candado is not None:
+            candado.close()
+
+    def estadisticas(self):
+        snapshot = self._snapshot
+        return {
+            "version": self.version,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "recargas": self.cache.recargas,
+            "cambios_snapshot": self.cambios,
+            "snapshots_escritos": self.escritos,
+            "refrescador": int(self.refrescador),
+            "productos": len(snapshot) if snapshot is not None else 0,
+            "bytes_snapshot": snapshot.tamano if snapshot is not None else 0,
+        }
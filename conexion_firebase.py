@@ -1,35 +1,216 @@
 import os
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
+import threading
+import time
 
-# Leer las credenciales desde la variable de entorno
-firebase_config = os.getenv("FIREBASE_CREDENTIALS")
+import metricas
+from busqueda import IndiceBusqueda
+from cache_catalogo import CacheCatalogo
+from catalogo_compartido import CatalogoCompartido
+from indice_catalogo import IndiceCatalogo
 
-if not firebase_config:
-    raise ValueError("❌ No se encontró la variable FIREBASE_CREDENTIALS en Render")
+# Backend de datos: "firebase" (por defecto) o "memoria" (sin red, para
+# pruebas y benchmarks con firestore_memoria.ClienteMemoria)
+BACKEND = os.getenv("FIRESTORE_BACKEND", "firebase")
 
-# Convertir el texto JSON en diccionario Python
-cred_dict = json.loads(firebase_config)
-cred = credentials.Certificate(cred_dict)
+# INICIO_DIFERIDO=1 (por defecto): el cliente se crea en el primer uso o en
+# calentar(), no al importar. Importar firebase_admin y abrir el canal gRPC
+# cuesta segundos y, con gunicorn --preload, no debe pasar antes del fork.
+INICIO_DIFERIDO = os.getenv("INICIO_DIFERIDO", "1") == "1"
 
-# Inicializar Firebase solo si no está activo
-if not firebase_admin._apps:
-    default_app = firebase_admin.initialize_app(cred)
+
+def _conectar_firebase():
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    # Leer las credenciales desde la variable de entorno
+    firebase_config = os.getenv("FIREBASE_CREDENTIALS")
+
+    if not firebase_config:
+        raise ValueError("❌ No se encontró la variable FIREBASE_CREDENTIALS en Render")
+
+    # Convertir el texto JSON en diccionario Python
+    cred_dict = json.loads(firebase_config)
+    cred = credentials.Certificate(cred_dict)
+
+    # Inicializar Firebase solo si no está activo
+    if not firebase_admin._apps:
+        default_app = firebase_admin.initialize_app(cred)
+    else:
+        default_app = firebase_admin.get_app()
+
+    # Inicializar Firestore con la app explícitamente
+    return firestore.client(app=default_app)
+
+
+def _conectar_memoria():
+    from firestore_memoria import ClienteMemoria
+
+    # FIRESTORE_SEMILLA: JSON {"coleccion": {"id": {...}}} para precargar datos
+    datos = None
+    semilla = os.getenv("FIRESTORE_SEMILLA")
+    if semilla:
+        with open(semilla, encoding="utf-8") as f:
+            datos = json.load(f)
+
+    latencia = float(os.getenv("FIRESTORE_LATENCIA_MS", "0")) / 1000
+    return ClienteMemoria(latencia=latencia, datos=datos)
+
+
+class _ClienteDiferido:
+    """Se comporta como el cliente de Firestore; lo crea al primer uso."""
+
+    def __init__(self, conectar):
+        self._conectar = conectar
+        self._cliente = None
+        self._lock = threading.Lock()
+
+    @property
+    def iniciado(self):
+        return self._cliente is not None
+
+    def cliente(self):
+        if self._cliente is None:
+            with self._lock:
+                if self._cliente is None:
+                    self._cliente = self._conectar()
+        return self._cliente
+
+    def __getattr__(self, nombre):
+        return getattr(self.cliente(), nombre)
+
+
+if BACKEND == "memoria":
+    _conectar = _conectar_memoria
+elif BACKEND == "firebase":
+    _conectar = _conectar_firebase
 else:
-    default_app = firebase_admin.get_app()
+    raise ValueError(f"❌ FIRESTORE_BACKEND no soportado: {BACKEND}")
 
-# Inicializar Firestore con la app explícitamente
-db = firestore.client(app=default_app)
+db = _ClienteDiferido(_conectar)
+if not INICIO_DIFERIDO:
+    db.cliente()
 
-# --- Función para obtener productos ---
-def obtener_productos():
-    """Devuelve todos los productos de la colección 'productos'."""
+# --- Transacciones ---
+def en_transaccion(funcion, *args, **kwargs):
+    """
+    Ejecuta funcion(transaction, *args, **kwargs) dentro de una transacción.
+    Si otra escritura toca los mismos documentos se reintenta completa, así
+    que la función no debe tener efectos fuera de la transacción.
+    """
+    if BACKEND == "memoria":
+        from firestore_memoria import transactional
+    else:
+        from google.cloud.firestore import transactional
+    return transactional(funcion)(db.transaction(), *args, **kwargs)
+
+
+# --- Catálogo en caché ---
+# Campos de 'productos' que usa el bot; descripciones y demás no se descargan
+CAMPOS_CATALOGO = ("nombre", "precio", "categoria", "imagen_url", "stock.Piezas")
+
+# CATALOGO_PAGINADO=1: el bot no guarda el catálogo completo; cada página de
+# una categoría se consulta al mostrarse (ver consultas_firebase)
+CATALOGO_PAGINADO = os.getenv("CATALOGO_PAGINADO", "0") == "1"
+
+
+def _leer_productos():
+    """Lee la colección 'productos' completa directamente de Firestore."""
     productos = {}
-    try:
-        docs = db.collection("productos").stream()
+    with metricas.FIRESTORE_LECTURA_SEGUNDOS.medir("catalogo"):
+        docs = db.collection("productos").select(CAMPOS_CATALOGO).stream()
         for doc in docs:
             productos[doc.id] = doc.to_dict()
+    metricas.FIRESTORE_LECTURAS.inc(len(productos), "catalogo")
+    return productos
+
+
+def _escuchar_productos(callback):
+    # Los listeners de Firestore no admiten select: llegan documentos
+    # completos y CacheCatalogo los recorta a CAMPOS_CATALOGO
+    def contar(docs, cambios, read_time):
+        # Firestore cobra una lectura por documento que cambia en el snapshot
+        metricas.FIRESTORE_LECTURAS.inc(len(cambios), "catalogo_listener")
+        return callback(docs, cambios, read_time)
+
+    return db.collection("productos").on_snapshot(contar)
+
+
+catalogo = CacheCatalogo(
+    _leer_productos,
+    _escuchar_productos if os.getenv("CATALOGO_LISTENER", "1") == "1" else None,
+    campos=CAMPOS_CATALOGO,
+)
+
+# CATALOGO_COMPARTIDO=/ruta/catalogo.snap: un solo worker del nodo lee
+# Firestore y escribe el snapshot; los demás lo mapean en memoria
+if os.getenv("CATALOGO_COMPARTIDO"):
+    catalogo = CatalogoCompartido(
+        os.getenv("CATALOGO_COMPARTIDO"), catalogo,
+        revisar=float(os.getenv("CATALOGO_COMPARTIDO_REVISAR", "1")),
+    )
+
+
+# --- Función para obtener productos ---
+def obtener_productos():
+    """
+    Devuelve todos los productos de la colección 'productos'.
+    Sale de la caché en memoria (o del snapshot compartido); no modificarlo.
+    """
+    try:
+        return catalogo.obtener()
     except Exception as e:
         print("🔥 Error en obtener_productos():", e)
-    return productos
+        return {}
+
+
+_indice = None
+
+
+def obtener_indice():
+    """
+    Devuelve el IndiceCatalogo de la versión actual del catálogo.
+    Se reconstruye solo cuando la caché publica un catálogo nuevo.
+    """
+    global _indice
+    with metricas.ETAPAS.medir("catalogo"):
+        productos = obtener_productos()
+    indice = _indice
+    if indice is None or indice.productos is not productos:
+        indice = IndiceCatalogo(productos, catalogo.version)
+        _indice = indice
+    return indice
+
+
+busqueda = IndiceBusqueda()
+
+
+def obtener_busqueda():
+    """
+    Devuelve el índice de búsqueda por nombre al día con el catálogo.
+    Solo se reindexan los productos que cambiaron desde la última versión.
+    Aun con CATALOGO_PAGINADO la búsqueda usa el catálogo en caché.
+    """
+    productos = obtener_productos()
+    busqueda.sincronizar(productos, catalogo.version)
+    return busqueda
+
+
+# --- Calentamiento ---
+def calentar():
+    """
+    Crea el cliente, abre el canal con Firestore y llena la caché del
+    catálogo (y su índice). Devuelve los segundos que tardó.
+    """
+    inicio = time.perf_counter()
+    db.cliente()
+    if CATALOGO_PAGINADO:
+        # Solo abre el canal: el catálogo se pide por páginas
+        db.collection("productos").select([]).limit(1).get()
+        return time.perf_counter() - inicio
+    catalogo.obtener()  # a diferencia de obtener_productos(), propaga errores
+    indice = obtener_indice()
+    busqueda.sincronizar(indice.productos, indice.version)
+    if not indice.productos:
+        print("⚠️ Calentamiento: el catálogo está vacío")
+    return time.perf_counter() - inicio
@@ -1,28 +1,174 @@
 # consultas_firebase.py
-from conexion_firebase import db
+"""
+Acceso al catálogo para el bot. Con el modo normal todo sale del índice en
+memoria (conexion_firebase.obtener_indice); con CATALOGO_PAGINADO=1 cada
+página de una categoría se pide a Firestore ya filtrada, ordenada y con
+solo CAMPOS_CATALOGO, y se guarda en caché un rato.
+"""
+import os
+import time
+
+import metricas
+from cache_ttl import CacheTTL
+from conexion_firebase import CAMPOS_CATALOGO, CATALOGO_PAGINADO, db, obtener_busqueda, obtener_indice
+from indice_catalogo import normalizar_categoria
+
+TAMANO_PAGINA = 10
+
+_ttl = float(os.getenv("CATALOGO_TTL", "300"))
+_categorias = CacheTTL(maximo=1, ttl=_ttl)        # "todas" -> {normalizada: [formas]}
+_paginas = CacheTTL(maximo=5000, ttl=_ttl)        # (normalizada, n) -> ([ids], hay_mas)
+_productos = CacheTTL(maximo=50000, ttl=_ttl)     # id -> datos (None = no existe)
+
 
 def obtener_categorias_con_productos():
     """
     Devuelve las categorías únicas de la colección 'productos'
     que tienen al menos un documento con campo 'categoria'.
+    Los conteos salen del índice del catálogo, no de una lectura nueva.
     """
-    productos_ref = db.collection("productos").stream()
+    indice = obtener_indice()
     categorias = {}
 
-    for doc in productos_ref:
-        data = doc.to_dict()
-        categoria = data.get("categoria", "").strip()
+    for cat, total in indice.conteos.items():
+        pids = indice.por_categoria[cat]
+        if "categoria" not in indice.productos[pids[0]]:
+            continue
+        categoria = cat.strip()
         if categoria:
-            categorias[categoria] = categorias.get(categoria, 0) + 1
+            categorias[categoria] = categorias.get(categoria, 0) + total
 
     return list(categorias.items())  # [(categoria, total), ...]
 
-def obtener_productos_por_categoria(nombre_categoria):
+def obtener_productos_por_categoria(nombre_categoria, campos=CAMPOS_CATALOGO):
     """
     Devuelve los productos que coincidan con una categoría.
+    Firestore filtra y ordena (por ID); solo viajan los campos indicados.
     """
     if not nombre_categoria:
         return []
-    productos_ref = db.collection("productos").where("categoria", "==", nombre_categoria).stream()
+    productos_ref = (
+        db.collection("productos")
+        .where("categoria", "==", nombre_categoria)
+        .order_by("__name__")
+        .select(campos)
+        .stream()
+    )
     productos = [doc.to_dict() for doc in productos_ref]
     return productos
+
+
+def pagina_categoria(formas, despues_de=None, limite=TAMANO_PAGINA):
+    """
+    Una página de productos cuya categoría es alguna de `formas`, ordenada
+    por ID de documento (no necesita índice compuesto).
+    Devuelve ([(id, datos), ...], hay_mas).
+    """
+    consulta = db.collection("productos")
+    if len(formas) == 1:
+        consulta = consulta.where("categoria", "==", formas[0])
+    else:
+        consulta = consulta.where("categoria", "in", list(formas)[:30])
+    consulta = consulta.order_by("__name__").select(CAMPOS_CATALOGO).limit(limite + 1)
+    if despues_de:
+        consulta = consulta.start_after({"__name__": despues_de})
+
+    with metricas.FIRESTORE_LECTURA_SEGUNDOS.medir("catalogo_pagina"):
+        filas = [(doc.id, doc.to_dict()) for doc in consulta.stream()]
+    metricas.FIRESTORE_LECTURAS.inc(max(len(filas), 1), "catalogo_pagina")
+    return filas[:limite], len(filas) > limite
+
+
+# ------------------------------------------------------------
+# CATÁLOGO PARA EL BOT (índice en memoria o páginas bajo demanda)
+# ------------------------------------------------------------
+def categorias():
+    """Nombres de las categorías con productos, en orden del catálogo."""
+    if not CATALOGO_PAGINADO:
+        return list(obtener_indice().categorias)
+    return [formas[0] for formas in _categorias.obtener("todas", _leer_categorias).values()]
+
+
+def productos_de(categoria, desde=0, cuantos=1):
+    """
+    IDs de la categoría a partir de la posición `desde` (máximo `cuantos`)
+    y si hay más después.
+    """
+    if not CATALOGO_PAGINADO:
+        ids = obtener_indice().productos_de(categoria)
+        return ids[desde:desde + cuantos], len(ids) > desde + cuantos
+
+    clave = normalizar_categoria(categoria)
+    n, saltar = divmod(desde, TAMANO_PAGINA)
+    ids = []
+    while True:
+        pagina, hay_mas = _paginas.obtener((clave, n), _cargar_pagina)
+        ids.extend(pagina[saltar:])
+        saltar = 0
+        if len(ids) >= cuantos or not hay_mas:
+            return ids[:cuantos], len(ids) > cuantos or hay_mas
+        n += 1
+
+
+def producto(pid):
+    """Datos de un producto (solo CAMPOS_CATALOGO) o None si no existe."""
+    if not CATALOGO_PAGINADO:
+        return obtener_indice().producto(pid)
+    return _productos.obtener(pid, _leer_producto)
+
+
+def version_catalogo():
+    """
+    Marca de la versión del catálogo: cambia cuando cambian los datos. Es el
+    índice vigente (se compara por identidad) o, con CATALOGO_PAGINADO, la
+    ventana de CATALOGO_TTL en la que vencen las páginas en caché.
+    """
+    if not CATALOGO_PAGINADO:
+        return obtener_indice()
+    return int(time.monotonic() // _ttl)
+
+
+def buscar_productos(texto, limite=TAMANO_PAGINA):
+    """[(id, datos)] de los productos cuyo nombre o categoría coinciden con el texto."""
+    with metricas.ETAPAS.medir("busqueda"):
+        return obtener_busqueda().buscar(texto, limite)
+
+
+def _leer_categorias(_clave):
+    # Solo viaja el campo 'categoria'; Firestore no tiene DISTINCT
+    formas = {}
+    docs = db.collection("productos").select(["categoria"]).stream()
+    total = 0
+    for doc in docs:
+        total += 1
+        cat = (doc.to_dict() or {}).get("categoria")
+        if cat:
+            lista = formas.setdefault(normalizar_categoria(cat), [])
+            if cat not in lista:
+                lista.append(cat)
+    metricas.FIRESTORE_LECTURAS.inc(max(total, 1), "catalogo_categorias")
+    return formas
+
+
+def _cargar_pagina(clave):
+    normalizada, n = clave
+    despues_de = None
+    if n > 0:
+        anterior, hay_mas = _paginas.obtener((normalizada, n - 1), _cargar_pagina)
+        if not hay_mas:
+            return [], False
+        despues_de = anterior[-1]
+
+    formas = _categorias.obtener("todas", _leer_categorias).get(normalizada) or [normalizada]
+    filas, hay_mas = pagina_categoria(formas, despues_de)
+    for pid, datos in filas:
+        _productos.poner(pid, datos)
+    return [pid for pid, _ in filas], hay_mas
+
+
+def _leer_producto(pid):
+    metricas.FIRESTORE_LECTURAS.inc(1, "catalogo_producto")
+    doc = db.collection("productos").document(pid).get(field_paths=CAMPOS_CATALOGO)
+    if not doc.exists:
+        return None
+    return doc.to_dict()
@@ -0,0 +1,519 @@
+# despachador.py
+import atexit
+import heapq
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metricas
+
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com/v18.0")
+
+# Códigos de error de la Graph API que significan "vas demasiado rápido"
+CODIGOS_LIMITE = {4, 17, 32, 613, 80006}
+# Fallas pasajeras del lado de Facebook: se reintentan sin frenar la página
+CODIGOS_PASAJEROS = {1, 2, 1200}
+
+
+class CuboTokens:
+    """
+    Token bucket: `tasa` permisos por segundo con ráfagas de hasta `rafaga`.
+    tasa <= 0 desactiva el límite.
+    """
+
+    def __init__(self, tasa, rafaga):
+        self.tasa = tasa
+        self.rafaga = max(rafaga, 1)
+        self._tokens = float(self.rafaga)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _llenar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def reservar(self):
+        """Toma un permiso y devuelve cuántos segundos hay que esperar para usarlo."""
+        if self.tasa <= 0:
+            return 0.0
+        with self._lock:
+            self._llenar()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.tasa
+
+    def tomar(self):
+        """
+        Toma un permiso si hay; si no, no toma nada y devuelve en cuántos
+        segundos habrá uno.
+        """
+        if self.tasa <= 0:
+            return 0.0
+        with self._lock:
+            self._llenar()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.tasa
+
+    def ajustar(self, tasa):
+        """Cambia la tasa (y la ráfaga en la misma proporción)."""
+        if self.tasa <= 0 or tasa <= 0:
+            return
+        with self._lock:
+            self._llenar()
+            self.rafaga = max(self.rafaga * tasa / self.tasa, 1)
+            self._tokens = min(self._tokens, self.rafaga)
+            self.tasa = tasa
+
+    def lleno(self):
+        if self.tasa <= 0:
+            return True
+        return self._tokens + (time.monotonic() - self._ultimo) * self.tasa >= self.rafaga
+
+
+class Despachador:
+    """
+    Envía mensajes a la Send API desde hilos en segundo plano.
+
+    Cada destinatario cae siempre en la misma cola (hash del ID), así sus
+    mensajes salen en el orden en que se encolaron aunque haya varios hilos.
+    Todas las peticiones comparten una sesión HTTP con keep-alive.
+    Con hilos=0 el envío es síncrono (útil para pruebas y scripts).
+
+    Un hilo nunca duerme por un solo destinatario: si su cubo está vacío o
+    le toca esperar un reintento, sus mensajes se apartan (en orden) con la
+    hora en que pueden salir y el hilo sigue con los demás de su cola.
+
+    Control de tasa:
+      - un token bucket para la página y otro por destinatario
+      - si Facebook nos limita (429 o CODIGOS_LIMITE) se frena toda la
+        página con espera exponencial con jitter (o lo que diga Retry-After)
+        y la tasa de la página baja a la mitad; mientras los envíos pasan
+        vuelve a subir de forma lineal (todo `tasa_pagina` en ~10 s), así se
+        queda cerca del máximo que Facebook acepta sin chocar seguido con
+        el límite
+      - los reintentos salen de un presupuesto: cada envío nuevo aporta
+        `proporcion_reintentos` y cada reintento gasta 1, así una caída de
+        la API no multiplica el tráfico
+      - lo que falla de forma definitiva va a `archivo_fallidos` (JSONL)
+    """
+
+    def __init__(self, token, base_url=None, hilos=None, timeout=None, max_cola=1000,
+                 tasa_pagina=None, tasa_usuario=None, max_intentos=None,
+                 proporcion_reintentos=0.2, archivo_fallidos=None):
+        self.token = token
+        self.base_url = (base_url or GRAPH_API_URL).rstrip("/")
+        if hilos is None:
+            hilos = int(os.getenv("ENVIO_HILOS", "4"))
+        if timeout is None:
+            timeout = float(os.getenv("ENVIO_TIMEOUT", "10"))
+        if tasa_pagina is None:
+            tasa_pagina = float(os.getenv("ENVIO_TASA_PAGINA", "200"))
+        if tasa_usuario is None:
+            tasa_usuario = float(os.getenv("ENVIO_TASA_USUARIO", "1"))
+        if max_intentos is None:
+            max_intentos = int(os.getenv("ENVIO_MAX_INTENTOS", "5"))
+        self.hilos = hilos
+        self.timeout = timeout
+        self.max_cola = max_cola
+        self.max_intentos = max_intentos
+        self.archivo_fallidos = archivo_fallidos or os.getenv(
+            "ENVIOS_FALLIDOS", "envios_fallidos.jsonl"
+        )
+
+        self.tasa_pagina = tasa_pagina
+        self.tasa_usuario = tasa_usuario
+        self._pagina = CuboTokens(tasa_pagina, max(tasa_pagina / 4, 1))
+        self._usuarios = OrderedDict()   # id -> CuboTokens (los más recientes al final)
+        self._pausa_hasta = 0.0          # monotonic: nadie envía antes (página limitada)
+        self._ultimo_limite = 0.0        # monotonic del último límite nuevo
+        self._ultimo_ajuste = 0.0        # monotonic de la última subida de tasa
+        self._espera_limite = 0.0
+        self.proporcion_reintentos = proporcion_reintentos
+        self._presupuesto = 10.0         # reintentos disponibles
+
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max(hilos, 1) + 1)  # +1: subida de adjuntos
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+
+        self._colas = []
+        self._diferidos = []             # por hilo: destinatario -> deque de envíos apartados
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.enviados = 0
+        self.fallidos = 0
+        self.reintentos = 0
+        self.limitados = 0
+        self.peticiones = 0
+        self.latencia_total = 0.0
+        self.latencia_max = 0.0
+
+    # --------------------------------------------------------
+    # ENCOLAR
+    # --------------------------------------------------------
+    def enviar(self, id_usuario, mensaje):
+        """Encola un mensaje ({"text": ...} o {"attachment": ...}) para un usuario."""
+        payload = {"recipient": {"id": id_usuario}, "message": mensaje}
+        with self._lock:
+            self._presupuesto = min(self._presupuesto + self.proporcion_reintentos, 100.0)
+        if self.hilos <= 0:
+            self._entregar(payload)
+            return
+        self._iniciar()
+        cola = self._colas[zlib.crc32(str(id_usuario).encode()) % len(self._colas)]
+        cola.put(payload)
+
+    def _iniciar(self):
+        # Los hilos no sobreviven al fork de gunicorn: se crean en el
+        # proceso que realmente envía.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._colas = [queue.Queue(self.max_cola) for _ in range(self.hilos)]
+            self._diferidos = []
+            for i, cola in enumerate(self._colas):
+                hilo = threading.Thread(
+                    target=self._trabajar, args=(cola,),
+                    name=f"despachador-{i}", daemon=True,
+                )
+                hilo.start()
+            self._pid = os.getpid()
+
+    # --------------------------------------------------------
+    # ENVÍO
+    # --------------------------------------------------------
+    def _trabajar(self, cola):
+        # Envíos que todavía no pueden salir, sin bloquear a los demás:
+        #   diferidos: destinatario -> deque([payload, intento]) en orden
+        #   turnos:    heap (listo_en, n, destinatario), uno por destinatario
+        # Cada payload se marca con task_done cuando termina (enviado o
+        # descartado), así esperar() cuenta también los apartados.
+        diferidos = {}
+        turnos = []
+        numeros = itertools.count()
+        apartados = 0
+        terminar = False
+        with self._lock:
+            self._diferidos.append(diferidos)
+
+        def procesar(destinatario, pendientes):
+            nonlocal apartados
+            while pendientes:
+                payload, intento = pendientes[0]
+                try:
+                    siguiente = self._intentar(payload, intento)
+                except Exception as e:
+                    # Un error inesperado no debe matar el hilo ni trabar su cola
+                    print("🔥 Error inesperado en el despachador:", e)
+                    siguiente = None
+                if siguiente is not None:
+                    espera, pendientes[0][1] = siguiente
+                    diferidos[destinatario] = pendientes
+                    heapq.heappush(turnos, (time.monotonic() + espera, next(numeros), destinatario))
+                    return
+                pendientes.popleft()
+                apartados -= 1
+                cola.task_done()
+
+        while not (terminar and not diferidos):
+            espera = max(turnos[0][0] - time.monotonic(), 0.0) if turnos else None
+            if apartados >= self.max_cola:
+                # Demasiados apartados: no se toma nada nuevo hasta que salgan
+                time.sleep(espera)
+                payload = None
+            else:
+                try:
+                    payload = cola.get(timeout=espera)
+                except queue.Empty:
+                    payload = None
+                else:
+                    if payload is None:
+                        terminar = True
+                        cola.task_done()
+
+            if payload is not None:
+                apartados += 1
+                destinatario = payload["recipient"]["id"]
+                if destinatario in diferidos:
+                    diferidos[destinatario].append([payload, 1])  # detrás de los suyos
+                else:
+                    procesar(destinatario, deque([[payload, 1]]))
+
+            while turnos and turnos[0][0] <= time.monotonic():
+                _, _, destinatario = heapq.heappop(turnos)
+                procesar(destinatario, diferidos.pop(destinatario))
+
+        with self._lock:
+            self._diferidos.remove(diferidos)
+
+    def _entregar(self, payload):
+        """Envío síncrono (hilos=0): el hilo es del que llama, aquí sí se duerme."""
+        intento = 1
+        while True:
+            siguiente = self._intentar(payload, intento)
+            if siguiente is None:
+                return
+            espera, intento = siguiente
+            time.sleep(espera)
+
+    def _intentar(self, payload, intento):
+        """
+        Un intento de envío. Devuelve None si el mensaje terminó (enviado o
+        descartado) o (segundos, intento) si hay que volver a intentarlo más
+        tarde: el cubo del destinatario está vacío o toca un reintento.
+        """
+        espera = self._cubo_usuario(payload["recipient"]["id"]).tomar()
+        if espera > 0:
+            return espera, intento
+
+        self._esperar_pagina()
+        enviado_en = time.monotonic()
+        resultado, detalle, espera = self._post(payload)
+        if resultado == "ok":
+            self._acelerar()
+            return None
+
+        if resultado == "limitado":
+            espera = self._frenar_pagina(espera, enviado_en)
+        if resultado == "definitivo" or intento >= self.max_intentos or not self._gastar_reintento():
+            self._descartar(payload, detalle, intento)
+            return None
+
+        metricas.ENVIOS.inc(1, "reintento")
+        if resultado == "limitado":
+            return 0.0, intento + 1  # la pausa de la página la respeta _esperar_pagina
+        return espera or _backoff(intento), intento + 1
+
+    def _esperar_pagina(self):
+        # El cubo y la pausa de la página son de todos los destinatarios:
+        # esperar aquí no deja atrás a nadie que pudiera salir antes
+        espera = self._pagina.reservar()
+        if espera > 0:
+            time.sleep(espera)
+        while True:
+            pausa = self._pausa_hasta - time.monotonic()
+            if pausa <= 0:
+                return
+            time.sleep(pausa)
+
+    def _cubo_usuario(self, destinatario):
+        with self._lock:
+            cubo = self._usuarios.pop(destinatario, None)
+            if cubo is None:
+                cubo = CuboTokens(self.tasa_usuario, 3)
+                # Los cubos llenos no guardan nada: se tiran los más viejos
+                while len(self._usuarios) >= 10000:
+                    viejo, otro = next(iter(self._usuarios.items()))
+                    if not otro.lleno():
+                        break
+                    del self._usuarios[viejo]
+            self._usuarios[destinatario] = cubo
+            return cubo
+
+    def _acelerar(self):
+        with self._lock:
+            self._espera_limite = 0.0
+            tasa = self._pagina.tasa
+            if not 0 < tasa < self.tasa_pagina:
+                return
+            ahora = time.monotonic()
+            subida = self.tasa_pagina / 10 * (ahora - max(self._ultimo_ajuste, self._pausa_hasta))
+            if subida > 0:
+                self._ultimo_ajuste = ahora
+                self._pagina.ajustar(min(self.tasa_pagina, tasa + subida))
+
+    def _frenar_pagina(self, espera, enviado_en):
+        # Espera exponencial compartida por todos los hilos: se duplica con
+        # cada límite seguido y vuelve a cero con el primer envío que pasa.
+        # Las respuestas de peticiones que salieron antes del último límite
+        # son el mismo episodio: no vuelven a duplicar ni a bajar la tasa.
+        metricas.ENVIOS.inc(1, "limitado")
+        with self._lock:
+            ahora = time.monotonic()
+            if enviado_en < self._ultimo_limite:
+                return max(self._pausa_hasta - ahora, 0.0)
+            self.limitados += 1
+            self._ultimo_limite = ahora
+            self._espera_limite = min(max(self._espera_limite * 2, 1.0), 60.0)
+            espera = espera or random.uniform(self._espera_limite / 2, self._espera_limite)
+            self._pausa_hasta = max(self._pausa_hasta, ahora + espera)
+        self._pagina.ajustar(max(self._pagina.tasa / 2, 1.0))
+        print(f"⚠️ Send API nos está limitando: pausa de {espera:.1f}s, "
+              f"tasa de la página {self._pagina.tasa:.0f}/s")
+        return espera
+
+    def _gastar_reintento(self):
+        with self._lock:
+            if self._presupuesto < 1:
+                return False
+            self._presupuesto -= 1
+            self.reintentos += 1
+            return True
+
+    def _descartar(self, payload, detalle, intentos):
+        metricas.ENVIOS.inc(1, "descartado")
+        with self._lock:
+            self.fallidos += 1
+            try:
+                with open(self.archivo_fallidos, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({
+                        "fecha": time.time(), "intentos": intentos,
+                        "error": detalle, "payload": payload,
+                    }, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print("🔥 No se pudo guardar el envío fallido:", e)
+
+    def _post(self, payload):
+        """
+        Una petición a la Send API. Devuelve (resultado, detalle, espera):
+        resultado es "ok", "limitado", "pasajero" o "definitivo" y espera,
+        los segundos de Retry-After si Facebook los manda.
+        """
+        inicio = time.perf_counter()
+        espera = None
+        try:
+            resp = self.session.post(
+                f"{self.base_url}/me/messages",
+                params={"access_token": self.token},
+                json=payload,
+                timeout=self.timeout,
+            )
+            resultado, detalle = _clasificar(resp)
+            if resultado in ("pasajero", "definitivo"):
+                print(f"🔥 Send API respondió {resp.status_code}: {resp.text[:300]}")
+            if resp.headers.get("Retry-After", "").isdigit():
+                espera = float(resp.headers["Retry-After"])
+        except requests.RequestException as e:
+            resultado, detalle = "pasajero", str(e)
+            print("🔥 Error al enviar mensaje:", e)
+
+        latencia = time.perf_counter() - inicio
+        metricas.ENVIO_SEGUNDOS.observar(latencia)
+        metricas.ENVIOS.inc(1, "ok" if resultado == "ok" else "error")
+        with self._lock:
+            self.peticiones += 1
+            self.latencia_total += latencia
+            self.latencia_max = max(self.latencia_max, latencia)
+            if resultado == "ok":
+                self.enviados += 1
+        return resultado, detalle, espera
+
+    # --------------------------------------------------------
+    # ADJUNTOS
+    # --------------------------------------------------------
+    def subir_adjunto(self, url, tipo="image"):
+        """
+        Sube un archivo por URL con la Attachment Upload API y devuelve su
+        attachment_id (o None). Cuenta contra la tasa de la página.
+        """
+        espera = max(self._pagina.reservar(), self._pausa_hasta - time.monotonic())
+        if espera > 0:
+            time.sleep(espera)
+        try:
+            resp = self.session.post(
+                f"{self.base_url}/me/message_attachments",
+                params={"access_token": self.token},
+                json={"message": {"attachment": {
+                    "type": tipo, "payload": {"url": url, "is_reusable": True},
+                }}},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            print("🔥 Error al subir adjunto:", e)
+            return None
+        if resp.status_code >= 400:
+            resultado, _ = _clasificar(resp)
+            if resultado == "limitado":
+                self._frenar_pagina(None, time.monotonic())
+            print(f"🔥 Attachment Upload API respondió {resp.status_code}: {resp.text[:300]}")
+            return None
+        return resp.json().get("attachment_id")
+
+    # --------------------------------------------------------
+    # CONTROL
+    # --------------------------------------------------------
+    def calentar(self):
+        """Arranca los hilos y deja abierta una conexión con la Graph API."""
+        if self.hilos > 0:
+            self._iniciar()
+        try:
+            # Cualquier respuesta sirve: solo importa el TLS + keep-alive
+            self.session.head(self.base_url, timeout=self.timeout)
+            return True
+        except requests.RequestException as e:
+            print("⚠️ No se pudo abrir la conexión con la Graph API:", e)
+            return False
+
+    def esperar(self):
+        """Bloquea hasta que todas las colas estén vacías."""
+        for cola in list(self._colas):
+            cola.join()
+
+    def detener(self):
+        """Termina los hilos después de enviar lo pendiente."""
+        if self._pid != os.getpid():
+            return
+        for cola in self._colas:
+            cola.put(None)
+        self.esperar()
+        self._colas = []
+        self._pid = None
+
+    def estadisticas(self):
+        return {
+            "en_cola": sum(c.qsize() for c in self._colas),
+            "diferidos": sum(len(p) for d in list(self._diferidos) for p in list(d.values())),
+            "enviados": self.enviados,
+            "fallidos": self.fallidos,
+            "reintentos": self.reintentos,
+            "limitados": self.limitados,
+            "tasa_pagina": self._pagina.tasa,
+            "presupuesto_reintentos": self._presupuesto,
+            "latencia_promedio": self.latencia_total / self.peticiones if self.peticiones else 0.0,
+            "latencia_max": self.latencia_max,
+        }
+
+
+def _backoff(intento, base=0.5, maximo=30.0):
+    """Espera exponencial con jitter completo."""
+    return random.uniform(0, min(maximo, base * 2 ** intento))
+
+
+def _clasificar(resp):
+    """("ok" | "limitado" | "pasajero" | "definitivo", detalle) de una respuesta."""
+    if resp.status_code < 400:
+        return "ok", None
+    try:
+        error = resp.json().get("error", {})
+    except ValueError:
+        error = {}
+    codigo = error.get("code")
+    detalle = {"status": resp.status_code, "code": codigo, "message": error.get("message")}
+    if resp.status_code == 429 or codigo in CODIGOS_LIMITE:
+        return "limitado", detalle
+    if resp.status_code >= 500 or codigo in CODIGOS_PASAJEROS or error.get("is_transient"):
+        return "pasajero", detalle
+    return "definitivo", detalle
+
+
+def crear_despachador(token):
+    """Crea el despachador del proceso y lo vacía al salir."""
+    despachador = Despachador(token)
+    atexit.register(despachador.detener)
+    return despachador
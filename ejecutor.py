@@ -0,0 +1,147 @@
+# ejecutor.py
+import atexit
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+import metricas
+
+
+class ColaLlena(Exception):
+    """La cola del usuario sigue llena después de esperar: hay que rechazar el evento."""
+
+
+class EjecutorPorUsuario:
+    """
+    Atiende eventos del webhook en un grupo fijo de hilos.
+
+    Cada usuario cae siempre en la misma cola (hash del ID, igual que en el
+    despachador), así sus eventos se procesan uno a la vez y en el orden en
+    que llegaron aunque vengan en peticiones distintas; usuarios de colas
+    distintas avanzan en paralelo. Las colas tienen tope: si una sigue
+    llena después de `espera` segundos, `enviar` lanza ColaLlena y el
+    webhook responde 503 para que Facebook reintente más tarde.
+    Con hilos=0 los eventos se atienden en el hilo que llama.
+    """
+
+    def __init__(self, hilos=None, max_cola=None, espera=None):
+        if hilos is None:
+            hilos = int(os.getenv("EVENTOS_HILOS", "8"))
+        if max_cola is None:
+            max_cola = int(os.getenv("EVENTOS_MAX_COLA", "100"))
+        if espera is None:
+            espera = float(os.getenv("EVENTOS_ESPERA_COLA", "5"))
+        self.hilos = hilos
+        self.max_cola = max_cola
+        self.espera = espera
+
+        self._colas = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.atendidos = 0
+        self.rechazados = 0
+        self.errores = 0
+
+    # --------------------------------------------------------
+    # ENCOLAR
+    # --------------------------------------------------------
+    def enviar(self, clave, funcion, *args):
+        """Encola funcion(*args) en la cola de `clave`; devuelve un Future."""
+        futuro = Future()
+        if self.hilos <= 0:
+            self._ejecutar(futuro, funcion, args, time.perf_counter())
+            return futuro
+        self._iniciar()
+        cola = self._colas[zlib.crc32(str(clave).encode()) % len(self._colas)]
+        try:
+            cola.put((futuro, funcion, args, time.perf_counter()), timeout=self.espera)
+        except queue.Full:
+            with self._lock:
+                self.rechazados += 1
+            raise ColaLlena(clave) from None
+        return futuro
+
+    def _iniciar(self):
+        # Como en el despachador: los hilos se crean en el proceso que atiende
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._colas = [queue.Queue(self.max_cola) for _ in range(self.hilos)]
+            for i, cola in enumerate(self._colas):
+                hilo = threading.Thread(
+                    target=self._trabajar, args=(cola,),
+                    name=f"eventos-{i}", daemon=True,
+                )
+                hilo.start()
+            self._pid = os.getpid()
+
+    # --------------------------------------------------------
+    # ATENDER
+    # --------------------------------------------------------
+    def _trabajar(self, cola):
+        while True:
+            item = cola.get()
+            try:
+                if item is None:
+                    return
+                self._ejecutar(*item)
+            finally:
+                cola.task_done()
+
+    def _ejecutar(self, futuro, funcion, args, encolado_en):
+        metricas.ETAPAS.observar(time.perf_counter() - encolado_en, "cola_eventos")
+        if not futuro.set_running_or_notify_cancel():
+            return
+        try:
+            resultado = funcion(*args)
+        except Exception as e:
+            with self._lock:
+                self.errores += 1
+            futuro.set_exception(e)
+            return
+        with self._lock:
+            self.atendidos += 1
+        futuro.set_result(resultado)
+
+    # --------------------------------------------------------
+    # CONTROL
+    # --------------------------------------------------------
+    def calentar(self):
+        if self.hilos > 0:
+            self._iniciar()
+
+    def esperar(self):
+        """Bloquea hasta que todas las colas estén vacías."""
+        for cola in list(self._colas):
+            cola.join()
+
+    def detener(self):
+        """Termina los hilos después de atender lo pendiente."""
+        if self._pid != os.getpid():
+            return
+        for cola in self._colas:
+            cola.put(None)
+        self.esperar()
+        self._colas = []
+        self._pid = None
+
+    def estadisticas(self):
+        return {
+            "en_cola": sum(c.qsize() for c in self._colas),
+            "atendidos": self.atendidos,
+            "rechazados": self.rechazados,
+            "errores": self.errores,
+        }
+
+
+def crear_ejecutor():
+    """Crea el ejecutor de eventos del proceso y lo vacía al salir."""
+    ejecutor = EjecutorPorUsuario()
+    atexit.register(ejecutor.detener)
+    return ejecutor
@@ -0,0 +1,299 @@
+# escritura_diferida.py
+import atexit
+import datetime
+import json
+import os
+import random
+import threading
+import time
+
+import metricas
+
+MAX_OPS_BATCH = 500  # límite de Firestore por batch
+
+# Errores que no se arreglan reintentando (google.api_core.exceptions y su
+# equivalente en firestore_memoria). Se reconocen por nombre para no
+# depender de que google-api-core esté instalado
+NO_REINTENTABLES = {"NotFound", "InvalidArgument", "FailedPrecondition", "NoEncontrado"}
+
+
+def _reintentable(error):
+    return not any(clase.__name__ in NO_REINTENTABLES for clase in type(error).__mro__)
+
+
+class _Operacion:
+    __slots__ = ("ref", "tipo", "datos")
+
+    def __init__(self, ref, tipo, datos):
+        self.ref = ref
+        self.tipo = tipo      # "set", "merge" o "update"
+        self.datos = datos
+
+    def combinar(self, nueva):
+        """Junta esta operación con una posterior sobre el mismo documento."""
+        if nueva.tipo == "set":
+            return nueva
+        datos = dict(self.datos)
+        datos.update(nueva.datos)
+        # set + update sigue siendo un set completo; update + update, un update
+        if self.tipo == "set":
+            tipo = "set"
+        elif "merge" in (self.tipo, nueva.tipo):
+            tipo = "merge"
+        else:
+            tipo = "update"
+        return _Operacion(self.ref, tipo, datos)
+
+
+class EscrituraDiferida:
+    """
+    Escrituras a Firestore fuera del camino de la respuesta.
+
+    Las operaciones se acumulan por documento (un set seguido de un update
+    al mismo pedido se manda como un solo set) y cada `intervalo` segundos
+    se escriben en batches de hasta 500.
+
+    Si un commit falla se reintenta con espera exponencial: el hilo de
+    fondo espera cada vez más entre rondas, hasta `espera_max`, y vuelve
+    al intervalo con el primer éxito. Si el error no es de los que se
+    arreglan reintentando (p. ej. update de un documento borrado), el
+    batch se parte hasta aislar la operación culpable, que va a
+    `archivo_descartadas`; las demás se escriben.
+
+    Al apagar el proceso se vacía la cola y lo que no se pudo escribir
+    queda en `archivo_pendientes` para la próxima vez.
+    """
+
+    def __init__(
+        self, db, intervalo=None, reintentos=5, archivo_pendientes=None, espera_max=None,
+        archivo_descartadas=None,
+    ):
+        self.db = db
+        if intervalo is None:
+            intervalo = float(os.getenv("ESCRITURA_INTERVALO", "0.2"))
+        self.intervalo = intervalo
+        if espera_max is None:
+            espera_max = float(os.getenv("ESCRITURA_ESPERA_MAX", "30"))
+        self.espera_max = espera_max
+        self.reintentos = reintentos
+        self.archivo_pendientes = archivo_pendientes or os.getenv(
+            "ESCRITURAS_PENDIENTES", "escrituras_pendientes.jsonl"
+        )
+        self.archivo_descartadas = archivo_descartadas or os.getenv(
+            "ESCRITURAS_DESCARTADAS", "escrituras_descartadas.jsonl"
+        )
+
+        self._pendientes = {}   # ruta del documento -> _Operacion
+        self._lock = threading.Lock()
+        self._hay_trabajo = threading.Event()
+        self._pid = None
+        self._hilo = None
+        self._detenido = False
+
+        self.commits = 0
+        self.operaciones = 0
+        self.fallos = 0
+        self.descartadas = 0
+
+    # --------------------------------------------------------
+    # API
+    # --------------------------------------------------------
+    def set(self, ref, datos, merge=False):
+        self._encolar(_Operacion(ref, "merge" if merge else "set", dict(datos)))
+
+    def update(self, ref, datos):
+        self._encolar(_Operacion(ref, "update", dict(datos)))
+
+    def _encolar(self, op):
+        self._iniciar()
+        with self._lock:
+            anterior = self._pendientes.get(op.ref.path)
+            self._pendientes[op.ref.path] = anterior.combinar(op) if anterior else op
+            lleno = len(self._pendientes) >= MAX_OPS_BATCH
+        if lleno:
+            self._hay_trabajo.set()
+
+    def vaciar(self):
+        """Escribe ya todo lo pendiente (bloquea). Devuelve True si no quedó nada."""
+        ops = self._tomar()
+        for i in range(0, len(ops), MAX_OPS_BATCH):
+            self._escribir(ops[i:i + MAX_OPS_BATCH], reintentos=self.reintentos)
+        return not self._pendientes
+
+    def pendientes(self):
+        return len(self._pendientes)
+
+    # --------------------------------------------------------
+    # HILO DE FONDO
+    # --------------------------------------------------------
+    def _iniciar(self):
+        # Como el despachador: el hilo (y lo que se recupera de disco, que
+        # toca Firestore) es del proceso que escribe, nunca del maestro
+        # de gunicorn antes del fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pendientes = {}
+            self._hilo = threading.Thread(target=self._trabajar, name="escritura-diferida", daemon=True)
+            self._hilo.start()
+        try:
+            n = self.recuperar()
+            if n:
+                print(f"♻️ {n} escrituras pendientes recuperadas")
+        except Exception as e:
+            print("🔥 Error al recuperar escrituras pendientes:", e)
+
+    def calentar(self):
+        """Arranca el hilo y recupera lo pendiente en disco (llamar después del fork)."""
+        self._iniciar()
+
+    def _trabajar(self):
+        espera = 0.0  # extra tras commits fallidos (exponencial, hasta espera_max)
+        while not self._detenido:
+            self._hay_trabajo.wait(self.intervalo)
+            self._hay_trabajo.clear()
+            if espera:
+                # Firestore está fallando: no se insiste antes de tiempo
+                # aunque la cola se llene; detener() sí despierta al hilo
+                hasta = time.monotonic() + random.uniform(espera / 2, espera)
+                while not self._detenido and time.monotonic() < hasta:
+                    self._hay_trabajo.wait(hasta - time.monotonic())
+                    self._hay_trabajo.clear()
+                if self._detenido:
+                    return
+            ops = self._tomar()
+            ok = True
+            for i in range(0, len(ops), MAX_OPS_BATCH):
+                ok = self._escribir(ops[i:i + MAX_OPS_BATCH], reintentos=1) and ok
+            espera = 0.0 if ok else min(max(espera * 2, self.intervalo), self.espera_max)
+
+    def _tomar(self):
+        with self._lock:
+            ops = list(self._pendientes.values())
+            self._pendientes = {}
+        return ops
+
+    def _escribir(self, ops, reintentos):
+        """Escribe `ops` en un batch. Devuelve False si alguna volvió a la cola."""
+        espera = 0.1
+        for intento in range(reintentos):
+            try:
+                batch = self.db.batch()
+                for op in ops:
+                    if op.tipo == "update":
+                        batch.update(op.ref, op.datos)
+                    else:
+                        batch.set(op.ref, op.datos, merge=op.tipo == "merge")
+                with metricas.FIRESTORE_COMMIT_SEGUNDOS.medir():
+                    batch.commit()
+                metricas.FIRESTORE_ESCRITURAS.inc(len(ops), "ok")
+                self.commits += 1
+                self.operaciones += len(ops)
+                return True
+            except Exception as e:
+                metricas.FIRESTORE_ESCRITURAS.inc(len(ops), "error")
+                self.fallos += 1
+                print(f"🔥 Error en commit de {len(ops)} escrituras (intento {intento + 1}):", e)
+                if not _reintentable(e):
+                    return self._separar(ops, e, reintentos)
+                if intento + 1 < reintentos:
+                    time.sleep(espera * (1 + random.random()))
+                    espera = min(espera * 2, 5.0)
+
+        # Se devuelven a la cola, antes de lo que haya llegado mientras tanto
+        with self._lock:
+            for op in ops:
+                nueva = self._pendientes.get(op.ref.path)
+                self._pendientes[op.ref.path] = op.combinar(nueva) if nueva else op
+        return False
+
+    def _separar(self, ops, error, reintentos):
+        # Un batch es atómico: una sola operación imposible tumba a todas.
+        # Se parte en mitades hasta quedarse con ella, sin devolverla a la
+        # cola (ni a disco al apagar), y el resto se escribe
+        if len(ops) == 1:
+            self._descartar(ops[0], error)
+            return True
+        mitad = len(ops) // 2
+        ok = self._escribir(ops[:mitad], reintentos)
+        return self._escribir(ops[mitad:], reintentos) and ok
+
+    def _descartar(self, op, error):
+        self.descartadas += 1
+        metricas.FIRESTORE_ESCRITURAS.inc(1, "descartada")
+        print(f"⚠️ Escritura a {op.ref.path} descartada, no se puede aplicar:", error)
+        try:
+            with open(self.archivo_descartadas, "a", encoding="utf-8") as f:
+                f.write(json.dumps({
+                    "ruta": op.ref.path, "tipo": op.tipo, "datos": op.datos,
+                    "error": f"{type(error).__name__}: {error}",
+                    "fecha": datetime.datetime.now(datetime.timezone.utc),
+                }, default=_a_json, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print("🔥 Error al guardar escritura descartada:", e)
+
+    # --------------------------------------------------------
+    # APAGADO Y RECUPERACIÓN
+    # --------------------------------------------------------
+    def detener(self):
+        """Vacía la cola al apagar; lo que no se pudo escribir va a disco."""
+        if self._pid != os.getpid():
+            return
+        self._detenido = True
+        self._hay_trabajo.set()
+        self._hilo.join(timeout=30)
+        if self.vaciar():
+            return
+        ops = self._tomar()
+        with open(self.archivo_pendientes, "a", encoding="utf-8") as f:
+            for op in ops:
+                f.write(json.dumps({
+                    "ruta": op.ref.path, "tipo": op.tipo, "datos": op.datos,
+                }, default=_a_json, ensure_ascii=False) + "\n")
+        print(f"⚠️ {len(ops)} escrituras guardadas en {self.archivo_pendientes}")
+
+    def recuperar(self):
+        """Re-encola las escrituras que quedaron en disco en un apagado anterior."""
+        # isfile: con ESCRITURAS_PENDIENTES=/dev/null no hay nada que recuperar
+        if not os.path.isfile(self.archivo_pendientes):
+            return 0
+        # Varios workers pueden intentarlo a la vez: se lo queda quien lo renombra
+        ruta_tmp = f"{self.archivo_pendientes}.{os.getpid()}.recuperando"
+        try:
+            os.replace(self.archivo_pendientes, ruta_tmp)
+        except FileNotFoundError:
+            return 0
+        total = 0
+        with open(ruta_tmp, encoding="utf-8") as f:
+            for linea in f:
+                item = json.loads(linea, object_hook=_de_json)
+                self._encolar(_Operacion(self.db.document(item["ruta"]), item["tipo"], item["datos"]))
+                total += 1
+        os.remove(ruta_tmp)
+        return total
+
+
+def _a_json(valor):
+    if isinstance(valor, datetime.datetime):
+        return {"__fecha__": valor.isoformat()}
+    raise TypeError(f"No se puede guardar {type(valor).__name__}")
+
+
+def _de_json(obj):
+    if set(obj) == {"__fecha__"}:
+        return datetime.datetime.fromisoformat(obj["__fecha__"])
+    return obj
+
+
+def crear_escritura(db):
+    """
+    Crea el escritor del proceso y lo vacía al salir. Las escrituras que
+    quedaron en disco se recuperan al arrancar su hilo (calentar() o la
+    primera escritura), no al importar.
+    """
+    escritura = EscrituraDiferida(db)
+    atexit.register(escritura.detener)
+    return escritura
@@ -0,0 +1,504 @@
+# firestore_memoria.py
+"""
+Sustituto en memoria del cliente de Firestore para probar y medir el bot
+sin red. Implementa solo lo que usa este proyecto: colecciones, documentos
+(get/set/update/delete), consultas con where/order_by/limit/start_after/
+select, get_all, batches, transacciones y listeners on_snapshot.
+
+Cada llamada que en Firestore sería un viaje de red espera `latencia`
+segundos y se cuenta en `lecturas` / `escrituras` / `rpcs`. `bytes_leidos`
+aproxima lo que viajaría por la red (JSON de los campos devueltos).
+"""
+import copy
+import datetime
+import functools
+import json
+import queue
+import random
+import string
+import threading
+import time
+from types import SimpleNamespace
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+CARACTERES_ID = string.ascii_letters + string.digits
+
+
+class NoEncontrado(Exception):
+    """Equivalente a google.api_core.exceptions.NotFound."""
+
+
+class Conflicto(Exception):
+    """Equivalente a google.api_core.exceptions.Aborted: otra escritura ganó."""
+
+
+def _id_automatico():
+    """ID de documento como los que genera Firestore: 20 letras y dígitos."""
+    return "".join(random.choices(CARACTERES_ID, k=20))
+
+
+# ------------------------------------------------------------
+# AUXILIARES DE CAMPOS
+# ------------------------------------------------------------
+def _leer_campo(datos, ruta):
+    valor = datos
+    for parte in ruta.split("."):
+        if not isinstance(valor, dict) or parte not in valor:
+            return None
+        valor = valor[parte]
+    return valor
+
+
+def _valor(fila, campo):
+    """Valor de un campo en una fila (id, datos); "__name__" es el ID del documento."""
+    if campo == "__name__":
+        return fila[0]
+    return _leer_campo(fila[1], campo)
+
+
+def _tamano(datos):
+    return len(json.dumps(datos, default=str, ensure_ascii=False).encode()) if datos else 0
+
+
+def _poner_campo(datos, ruta, valor):
+    partes = ruta.split(".")
+    for parte in partes[:-1]:
+        datos = datos.setdefault(parte, {})
+    datos[partes[-1]] = valor
+
+
+def _proyectar(datos, campos):
+    if campos is None:
+        return copy.deepcopy(datos)
+    resultado = {}
+    for ruta in campos:
+        valor = _leer_campo(datos, ruta)
+        if valor is not None:
+            _poner_campo(resultado, ruta, copy.deepcopy(valor))
+    return resultado
+
+
+def _mezclar(destino, origen):
+    for clave, valor in origen.items():
+        if isinstance(valor, dict) and isinstance(destino.get(clave), dict):
+            _mezclar(destino[clave], valor)
+        else:
+            destino[clave] = valor
+
+
+_OPERADORES = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a is not None and a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a is not None and a not in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+    "array_contains_any": lambda a, b: isinstance(a, list) and any(x in a for x in b),
+}
+
+
+# ------------------------------------------------------------
+# SNAPSHOTS
+# ------------------------------------------------------------
+class SnapshotMemoria:
+
+    def __init__(self, referencia, datos, campos=None):
+        self.reference = referencia
+        self.id = referencia.id
+        self.exists = datos is not None
+        self._datos = None if datos is None else _proyectar(datos, campos)
+        self.read_time = datetime.datetime.now(datetime.timezone.utc)
+
+    def to_dict(self):
+        return copy.deepcopy(self._datos) if self.exists else None
+
+    def get(self, campo):
+        return _leer_campo(self._datos or {}, campo)
+
+
+# ------------------------------------------------------------
+# DOCUMENTOS
+# ------------------------------------------------------------
+class DocumentoMemoria:
+
+    def __init__(self, cliente, coleccion, id_doc):
+        self._cliente = cliente
+        self._coleccion = coleccion
+        self.id = id_doc
+        self.path = f"{coleccion}/{id_doc}"
+
+    def get(self, field_paths=None, transaction=None):
+        self._cliente._rpc()
+        return self._cliente._leer(self, field_paths, transaction)
+
+    def set(self, datos, merge=False):
+        self._cliente._rpc()
+        self._cliente._aplicar([(self, "merge" if merge else "set", datos)])
+
+    def update(self, datos):
+        self._cliente._rpc()
+        self._cliente._aplicar([(self, "update", datos)])
+
+    def delete(self):
+        self._cliente._rpc()
+        self._cliente._aplicar([(self, "delete", None)])
+
+
+# ------------------------------------------------------------
+# CONSULTAS
+# ------------------------------------------------------------
+class ConsultaMemoria:
+
+    def __init__(self, cliente, coleccion, filtros=(), orden=(), limite=None,
+                 despues_de=None, campos=None):
+        self._cliente = cliente
+        self._coleccion = coleccion
+        self._filtros = tuple(filtros)
+        self._orden = tuple(orden)
+        self._limite = limite
+        self._despues_de = despues_de
+        self._campos = campos
+
+    def _copiar(self, **cambios):
+        args = dict(
+            filtros=self._filtros, orden=self._orden, limite=self._limite,
+            despues_de=self._despues_de, campos=self._campos,
+        )
+        args.update(cambios)
+        return ConsultaMemoria(self._cliente, self._coleccion, **args)
+
+    def where(self, campo=None, op=None, valor=None, filter=None):
+        if filter is not None:
+            campo, op, valor = filter.field_path, filter.op_string, filter.value
+        if op not in _OPERADORES:
+            raise ValueError(f"Operador no soportado: {op}")
+        return self._copiar(filtros=self._filtros + ((campo, op, valor),))
+
+    def order_by(self, campo, direction=ASCENDING):
+        return self._copiar(orden=self._orden + ((campo, direction),))
+
+    def limit(self, n):
+        return self._copiar(limite=n)
+
+    def start_after(self, documento):
+        return self._copiar(despues_de=documento)
+
+    def select(self, field_paths):
+        return self._copiar(campos=list(field_paths))
+
+    def _comparar(self, a, b, con_id=True):
+        """Compara filas (id, datos) según order_by; el ID desempata como en Firestore."""
+        direccion = ASCENDING
+        for campo, direccion in self._orden:
+            x, y = _valor(a, campo), _valor(b, campo)
+            if x != y:
+                menor = x < y
+                return (-1 if menor else 1) * (1 if direccion == ASCENDING else -1)
+        if not con_id or a[0] == b[0]:
+            return 0
+        return (-1 if a[0] < b[0] else 1) * (1 if direccion == ASCENDING else -1)
+
+    def _resultados(self):
+        docs = self._cliente._coleccion_datos(self._coleccion)
+        filas = []
+        for id_doc, datos in docs:
+            fila = (id_doc, datos)
+            if not all(_OPERADORES[op](_valor(fila, campo), valor)
+                       for campo, op, valor in self._filtros):
+                continue
+            if any(_valor(fila, c) is None for c, _ in self._orden):
+                continue  # Firestore omite documentos sin el campo de orden
+            filas.append(fila)
+
+        filas.sort(key=functools.cmp_to_key(self._comparar))
+
+        cursor = self._despues_de
+        if cursor is not None:
+            if isinstance(cursor, SnapshotMemoria):
+                fila_cursor, con_id = (cursor.id, cursor._datos or {}), True
+            else:
+                # {"campo": valor, ...}; "__name__" lleva el ID como texto
+                fila_cursor, con_id = (cursor.get("__name__"), cursor), False
+            filas = [f for f in filas if self._comparar(f, fila_cursor, con_id) > 0]
+
+        if self._limite is not None:
+            filas = filas[:self._limite]
+        return filas
+
+    def stream(self, transaction=None):
+        self._cliente._rpc()
+        filas = self._resultados()
+        self._cliente.lecturas += max(len(filas), 1)
+        for id_doc, datos in filas:
+            snapshot = SnapshotMemoria(DocumentoMemoria(self._cliente, self._coleccion, id_doc), datos, self._campos)
+            self._cliente.bytes_leidos += _tamano(snapshot._datos)
+            yield snapshot
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self._cliente._escuchar(self, callback)
+
+
+class ColeccionMemoria(ConsultaMemoria):
+
+    def __init__(self, cliente, nombre):
+        super().__init__(cliente, nombre)
+        self.id = nombre
+
+    def document(self, id_doc=None):
+        return DocumentoMemoria(self._cliente, self._coleccion, id_doc or _id_automatico())
+
+
+# ------------------------------------------------------------
+# BATCH
+# ------------------------------------------------------------
+class BatchMemoria:
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._ops = []
+
+    def set(self, referencia, datos, merge=False):
+        self._ops.append((referencia, "merge" if merge else "set", datos))
+
+    def update(self, referencia, datos):
+        self._ops.append((referencia, "update", datos))
+
+    def delete(self, referencia):
+        self._ops.append((referencia, "delete", None))
+
+    def commit(self):
+        if len(self._ops) > 500:
+            raise ValueError("Un batch admite máximo 500 operaciones")
+        self._cliente._rpc()
+        self._cliente._aplicar(self._ops)
+        self._ops = []
+
+
+# ------------------------------------------------------------
+# TRANSACCIONES
+# ------------------------------------------------------------
+class TransaccionMemoria(BatchMemoria):
+    """
+    Transacción optimista: recuerda la versión de cada documento leído y
+    al hacer commit falla con Conflicto si alguno cambió mientras tanto.
+    Como en Firestore, todas las lecturas van antes de las escrituras.
+    """
+
+    def __init__(self, cliente, max_attempts=5):
+        super().__init__(cliente)
+        self.max_attempts = max_attempts
+        self._leidos = {}
+
+    def get_all(self, referencias):
+        return self._cliente.get_all(referencias, transaction=self)
+
+    def _registrar_lectura(self, referencia, version):
+        if self._ops:
+            raise ValueError("En una transacción las lecturas van antes de las escrituras")
+        self._leidos.setdefault(referencia.path, version)
+
+    def _empezar(self):
+        self._ops = []
+        self._leidos = {}
+
+    def commit(self):
+        if len(self._ops) > 500:
+            raise ValueError("Una transacción admite máximo 500 operaciones")
+        self._cliente._rpc()
+        with self._cliente._lock:
+            for ruta, version in self._leidos.items():
+                if self._cliente._versiones.get(ruta, 0) != version:
+                    raise Conflicto(f"{ruta} cambió durante la transacción")
+            if self._ops:
+                self._cliente._aplicar(self._ops)
+        self._empezar()
+
+
+def transactional(funcion):
+    """Equivalente a google.cloud.firestore.transactional: reintenta en conflicto."""
+    @functools.wraps(funcion)
+    def envoltura(transaccion, *args, **kwargs):
+        for intento in range(transaccion.max_attempts):
+            transaccion._empezar()
+            resultado = funcion(transaccion, *args, **kwargs)
+            try:
+                transaccion.commit()
+                return resultado
+            except Conflicto:
+                if intento == transaccion.max_attempts - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.01 * 2 ** intento))  # como el SDK: espera con jitter
+    return envoltura
+
+
+# ------------------------------------------------------------
+# LISTENERS
+# ------------------------------------------------------------
+class _Watch:
+    """Entrega los cambios al callback desde su propio hilo, como el SDK real."""
+
+    def __init__(self, consulta, callback):
+        self.consulta = consulta
+        self.callback = callback
+        self._cola = queue.Queue()
+        self._vistos = {}
+        self.is_active = True
+        threading.Thread(target=self._trabajar, daemon=True, name="watch-memoria").start()
+
+    def _trabajar(self):
+        while True:
+            evento = self._cola.get()
+            if evento is None:
+                return
+            try:
+                self.callback(*evento)
+            except Exception as e:
+                print("🔥 Error en callback de on_snapshot:", e)
+
+    def notificar(self):
+        filas = self.consulta._resultados()
+        actuales = {id_doc: copy.deepcopy(datos) for id_doc, datos in filas}
+        cambios = []
+        for id_doc, datos in actuales.items():
+            anterior = self._vistos.get(id_doc)
+            if anterior is None:
+                tipo = "ADDED"
+            elif anterior != datos:
+                tipo = "MODIFIED"
+            else:
+                continue
+            cambios.append(self._cambio(tipo, id_doc, datos))
+        for id_doc, datos in self._vistos.items():
+            if id_doc not in actuales:
+                cambios.append(self._cambio("REMOVED", id_doc, datos))
+        if not cambios and self._vistos:
+            return
+        self._vistos = actuales
+        docs = [self._snapshot(i, d) for i, d in actuales.items()]
+        self._cola.put((docs, cambios, datetime.datetime.now(datetime.timezone.utc)))
+
+    def _snapshot(self, id_doc, datos):
+        c = self.consulta
+        return SnapshotMemoria(DocumentoMemoria(c._cliente, c._coleccion, id_doc), datos, c._campos)
+
+    def _cambio(self, tipo, id_doc, datos):
+        documento = self._snapshot(id_doc, datos)
+        if tipo != "REMOVED":
+            self.consulta._cliente.bytes_leidos += _tamano(documento._datos)
+        return SimpleNamespace(type=SimpleNamespace(name=tipo), document=documento)
+
+    def unsubscribe(self):
+        self.is_active = False
+        self.consulta._cliente._watches.discard(self)
+        self._cola.put(None)
+
+
+# ------------------------------------------------------------
+# CLIENTE
+# ------------------------------------------------------------
+class ClienteMemoria:
+
+    def __init__(self, latencia=0.0, datos=None):
+        self.latencia = latencia
+        self._datos = {}
+        self._lock = threading.RLock()
+        self._watches = set()
+        self._versiones = {}   # ruta -> número de escrituras (para transacciones)
+        self.lecturas = 0
+        self.escrituras = 0
+        self.rpcs = 0
+        self.bytes_leidos = 0
+        for coleccion, docs in (datos or {}).items():
+            self._datos[coleccion] = copy.deepcopy(docs)
+
+    def _rpc(self):
+        self.rpcs += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    # ---- API pública ----
+    def collection(self, nombre):
+        return ColeccionMemoria(self, nombre)
+
+    def document(self, *ruta):
+        coleccion, id_doc = "/".join(ruta).split("/")
+        return DocumentoMemoria(self, coleccion, id_doc)
+
+    def batch(self):
+        return BatchMemoria(self)
+
+    def transaction(self, max_attempts=5):
+        return TransaccionMemoria(self, max_attempts)
+
+    def get_all(self, referencias, field_paths=None, transaction=None):
+        self._rpc()
+        for referencia in referencias:
+            yield self._leer(referencia, field_paths, transaction)
+
+    def contadores(self):
+        return {
+            "lecturas": self.lecturas,
+            "escrituras": self.escrituras,
+            "rpcs": self.rpcs,
+            "bytes_leidos": self.bytes_leidos,
+        }
+
+    def reiniciar_contadores(self):
+        self.lecturas = self.escrituras = self.rpcs = self.bytes_leidos = 0
+
+    # ---- internos ----
+    def _coleccion_datos(self, coleccion):
+        with self._lock:
+            return list(self._datos.get(coleccion, {}).items())
+
+    def _leer(self, referencia, campos=None, transaccion=None):
+        self.lecturas += 1
+        with self._lock:
+            datos = self._datos.get(referencia._coleccion, {}).get(referencia.id)
+            snapshot = SnapshotMemoria(referencia, datos, campos)
+            if transaccion is not None:
+                transaccion._registrar_lectura(referencia, self._versiones.get(referencia.path, 0))
+        self.bytes_leidos += _tamano(snapshot._datos)
+        return snapshot
+
+    def _aplicar(self, ops):
+        with self._lock:
+            # Se valida todo antes de escribir: un batch es atómico
+            for referencia, tipo, _ in ops:
+                existe = referencia.id in self._datos.get(referencia._coleccion, {})
+                if tipo == "update" and not existe:
+                    raise NoEncontrado(f"No existe el documento {referencia.path}")
+            colecciones = set()
+            for referencia, tipo, datos in ops:
+                docs = self._datos.setdefault(referencia._coleccion, {})
+                if tipo == "delete":
+                    docs.pop(referencia.id, None)
+                elif tipo == "set":
+                    docs[referencia.id] = copy.deepcopy(datos)
+                elif tipo == "merge":
+                    _mezclar(docs.setdefault(referencia.id, {}), copy.deepcopy(datos))
+                else:
+                    actual = docs[referencia.id]
+                    for ruta, valor in datos.items():
+                        _poner_campo(actual, ruta, copy.deepcopy(valor))
+                colecciones.add(referencia._coleccion)
+                self._versiones[referencia.path] = self._versiones.get(referencia.path, 0) + 1
+            self.escrituras += len(ops)
+            watches = [w for w in self._watches if w.consulta._coleccion in colecciones]
+            for watch in watches:
+                watch.notificar()
+
+    def _escuchar(self, consulta, callback):
+        watch = _Watch(consulta, callback)
+        with self._lock:
+            self._watches.add(watch)
+            watch.notificar()
+        return watch
+
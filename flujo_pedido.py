@@ -1,39 +1,21 @@
 # archivo: flujo_pedido.py
 import datetime
-from conexion_firebase import db, obtener_productos
+from conexion_firebase import CAMPOS_CATALOGO, db, en_transaccion, obtener_indice
 
 # =============================
 # FUNCIONES DE PEDIDOS
 # =============================
 def crear_pedido(telefono_usuario, productos_solicitados, metodo_entrega="envio_domicilio"):
     """
-    Registra un pedido en la colección 'pedidos'.
-    productos_solicitados debe ser una lista de IDs como ['P001', 'P002']
+    Registra un pedido en la colección 'pedidos' y aparta el stock.
+    productos_solicitados puede ser una lista de IDs como ['P001', 'P002']
+    (un ID repetido suma piezas) o un diccionario {'P001': 2, 'P002': 1}.
+    Solo se leen los productos pedidos, y el descuento de stock.Piezas y el
+    pedido se escriben en la misma transacción: dos pedidos simultáneos no
+    pueden vender la misma pieza.
     """
-    productos_disponibles = obtener_productos()
-    items = []
-    monto_total = 0
-
-    for pid in productos_solicitados:
-        producto = productos_disponibles.get(pid)
-        if not producto:
-            continue  # producto no encontrado
-
-        stock_disponible = int(producto.get("stock", {}).get("Piezas", 0))
-        if stock_disponible <= 0:
-            continue  # sin stock
-
-        # Agregamos al pedido
-        items.append({
-            "producto_id": pid,
-            "nombre": producto.get("nombre"),
-            "precio": producto.get("precio"),
-            "imagen": producto.get("imagen_url"),
-            "cantidad": stock_disponible
-        })
-        monto_total += producto.get("precio", 0)
-
-    if not items:
+    cantidades = _cantidades(productos_solicitados)
+    if not cantidades:
         return "⚠️ No se pudo crear el pedido. Los productos están agotados o no existen."
 
     # Crear el documento del pedido
@@ -42,25 +24,99 @@ def crear_pedido(telefono_usuario, productos_solicitados, metodo_entrega="envio_
         "estado": "pendiente_pago",
         "comprobante_url": "pendiente",
         "preferencia_entrega": metodo_entrega,
-        "monto_total": monto_total,
         "creado_en": datetime.datetime.utcnow().isoformat() + "Z",
-        "items": items,
         "expira_en": ""
     }
 
     try:
         pedido_ref = db.collection("pedidos").document()
-        pedido_ref.set(nuevo_pedido)
-        return f"✅ Tu pedido fue registrado correctamente. Total a pagar: ${monto_total}. Pronto te contactaremos."
+        items, no_disponibles, monto_total = en_transaccion(
+            _reservar, cantidades, pedido_ref, nuevo_pedido
+        )
     except Exception as e:
         print("Error al guardar el pedido:", e)
         return "❌ Ocurrió un error al guardar tu pedido. Intenta más tarde."
 
+    if not items:
+        return "⚠️ No se pudo crear el pedido. Los productos están agotados o no existen."
+
+    msg = f"✅ Tu pedido fue registrado correctamente. Total a pagar: ${monto_total}. Pronto te contactaremos."
+    if no_disponibles:
+        msg += "\n⚠️ Sin stock suficiente (no se incluyeron): " + ", ".join(no_disponibles)
+    return msg
+
+
+def _cantidades(productos_solicitados):
+    """['P001', 'P001', 'P002'] o {'P001': 2, 'P002': 1} -> {'P001': 2, 'P002': 1}"""
+    if isinstance(productos_solicitados, dict):
+        pares = productos_solicitados.items()
+    else:
+        pares = ((pid, 1) for pid in productos_solicitados)
+
+    cantidades = {}
+    for pid, cantidad in pares:
+        try:
+            cantidad = int(cantidad)
+        except (TypeError, ValueError):
+            continue
+        if pid and cantidad > 0:
+            cantidades[pid] = cantidades.get(pid, 0) + cantidad
+    return cantidades
+
+
+def _reservar(transaction, cantidades, pedido_ref, nuevo_pedido):
+    """
+    Dentro de la transacción: lee de un solo golpe los productos pedidos,
+    descuenta las piezas de los que alcanzan y crea el pedido.
+    Firestore la repite completa si otro pedido tocó los mismos productos.
+    """
+    refs = [db.collection("productos").document(pid) for pid in cantidades]
+    snapshots = {
+        snap.id: snap
+        for snap in db.get_all(refs, field_paths=CAMPOS_CATALOGO, transaction=transaction)
+    }
+
+    items = []
+    no_disponibles = []
+    descuentos = []
+    monto_total = 0
+
+    for pid, cantidad in cantidades.items():
+        snap = snapshots.get(pid)
+        producto = snap.to_dict() if snap is not None and snap.exists else None
+        if not producto:
+            no_disponibles.append(pid)  # producto no encontrado
+            continue
+
+        stock_disponible = int((producto.get("stock") or {}).get("Piezas", 0) or 0)
+        if stock_disponible < cantidad:
+            no_disponibles.append(pid)  # sin stock suficiente
+            continue
+
+        precio = producto.get("precio", 0) or 0
+        items.append({
+            "producto_id": pid,
+            "nombre": producto.get("nombre"),
+            "precio": precio,
+            "imagen": producto.get("imagen_url"),
+            "cantidad": cantidad,
+            "subtotal": precio * cantidad
+        })
+        monto_total += precio * cantidad
+        descuentos.append((snap.reference, stock_disponible - cantidad))
+
+    if items:
+        for ref, restante in descuentos:
+            transaction.update(ref, {"stock.Piezas": restante})
+        transaction.set(pedido_ref, dict(nuevo_pedido, items=items, monto_total=monto_total))
+
+    return items, no_disponibles, monto_total
+
 # =============================
 # FUNCIONES OPCIONALES
 # =============================
 def formatear_productos_para_usuario():
-    productos = obtener_productos()
+    productos = obtener_indice().productos
     mensajes = []
 
     if not productos:
@@ -0,0 +1,22 @@
+# gunicorn.conf.py
+# gunicorn lo lee solo si se arranca desde esta carpeta (gunicorn app:app).
+import os
+
+# La app se importa una vez en el proceso maestro y los workers la heredan
+# ya cargada. Es seguro porque Firestore, el listener del catálogo y los
+# hilos de envío se crean después del fork (ver INICIO_DIFERIDO).
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+
+
+def post_fork(server, worker):
+    # El worker no acepta conexiones hasta terminar, así el primer cliente
+    # después de un deploy ya encuentra el catálogo y las conexiones listos.
+    if os.environ.get("CALENTAR_AL_INICIAR", "1") != "1":
+        return
+    import app
+
+    estado = app.calentar()
+    if not estado["listo"]:
+        server.log.warning("Calentamiento incompleto en pid %s: %s", worker.pid, estado["error"])
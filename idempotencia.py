@@ -0,0 +1,105 @@
+# idempotencia.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Facebook reintenta un webhook durante varios minutos; basta recordar ese rango
+VENTANA_MIDS = float(os.getenv("IDEMPOTENCIA_VENTANA", "3600"))
+MAX_MIDS = int(os.getenv("IDEMPOTENCIA_MAX", "100000"))
+
+
+class RegistroMemoria:
+    """IDs de mensaje (`mid`) ya procesados en este proceso, con ventana y tope."""
+
+    def __init__(self, ventana=None, maximo=None):
+        self.ventana = VENTANA_MIDS if ventana is None else ventana
+        self.maximo = MAX_MIDS if maximo is None else maximo
+        self._vistos = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicados = 0
+
+    def primera_vez(self, mid):
+        """True si el mid no se había visto; lo marca como visto en el mismo paso."""
+        ahora = time.time()
+        with self._lock:
+            self._purgar(ahora)
+            if mid in self._vistos:
+                self.duplicados += 1
+                return False
+            self._vistos[mid] = ahora
+            return True
+
+    def olvidar(self, mid):
+        """Quita el mid (su atención falló): el reenvío de Facebook se vuelve a atender."""
+        with self._lock:
+            self._vistos.pop(mid, None)
+
+    def _purgar(self, ahora):
+        limite = ahora - self.ventana
+        while self._vistos:
+            mid, visto = next(iter(self._vistos.items()))
+            if visto >= limite and len(self._vistos) < self.maximo:
+                break
+            del self._vistos[mid]
+
+
+class RegistroSQLite:
+    """Igual que RegistroMemoria pero compartido entre workers vía SQLite (WAL)."""
+
+    def __init__(self, ruta, ventana=None):
+        self.ruta = ruta
+        self.ventana = VENTANA_MIDS if ventana is None else ventana
+        self._local = threading.local()
+        self._escrituras = 0
+        self.duplicados = 0
+
+        con = self._con()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS mids_procesados ("
+            " mid TEXT PRIMARY KEY, visto REAL NOT NULL)"
+        )
+
+    def _con(self):
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    def primera_vez(self, mid):
+        ahora = time.time()
+        con = self._con()
+        cur = con.execute(
+            "INSERT INTO mids_procesados (mid, visto) VALUES (?, ?) "
+            "ON CONFLICT(mid) DO UPDATE SET visto = excluded.visto "
+            "WHERE mids_procesados.visto < ?",
+            (mid, ahora, ahora - self.ventana),
+        )
+        self._escrituras += 1
+        if self._escrituras % 1000 == 0:
+            con.execute("DELETE FROM mids_procesados WHERE visto < ?", (ahora - self.ventana,))
+        if cur.rowcount == 1:
+            return True
+        self.duplicados += 1
+        return False
+
+    def olvidar(self, mid):
+        self._con().execute("DELETE FROM mids_procesados WHERE mid = ?", (mid,))
+
+
+def crear_registro(url=None):
+    """
+    Crea el registro de mids según IDEMPOTENCIA_URL (por defecto SESIONES_URL):
+    "memoria" o "sqlite:///ruta.db".
+    """
+    url = url or os.getenv("IDEMPOTENCIA_URL") or os.getenv("SESIONES_URL", "memoria")
+    if url == "memoria":
+        return RegistroMemoria()
+    if url.startswith("sqlite:///"):
+        return RegistroSQLite(url[len("sqlite:///"):])
+    raise ValueError(f"❌ IDEMPOTENCIA_URL no soportada: {url}")
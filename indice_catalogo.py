@@ -0,0 +1,46 @@
+# indice_catalogo.py
+
+SIN_CATEGORIA = "Sin categoria"
+
+
+def normalizar_categoria(nombre):
+    """Forma de comparación de una categoría: sin espacios extra y en minúsculas."""
+    return " ".join((nombre or "").split()).lower()
+
+
+class IndiceCatalogo:
+    """
+    Índices del catálogo que se construyen una sola vez por versión:
+      - productos:      id -> datos
+      - categorias:     categorías en el orden en que aparecen
+      - por_categoria:  categoría -> [ids] en orden del catálogo
+      - conteos:        categoría -> número de productos
+      - nombres:        categoría normalizada -> nombre canónico
+    """
+
+    def __init__(self, productos, version=0):
+        self.version = version
+        self.productos = productos
+        self.por_categoria = {}
+        self.nombres = {}
+
+        for pid, datos in productos.items():
+            cat = datos.get("categoria", SIN_CATEGORIA)
+            # "Ropa" y "ropa " son la misma categoría: gana la primera forma vista
+            cat = self.nombres.setdefault(normalizar_categoria(cat), cat)
+            self.por_categoria.setdefault(cat, []).append(pid)
+
+        self.categorias = list(self.por_categoria)
+        self.conteos = {cat: len(ids) for cat, ids in self.por_categoria.items()}
+
+    def categoria_canonica(self, nombre):
+        """Devuelve el nombre de la categoría tal como está en el catálogo, o None."""
+        return self.nombres.get(normalizar_categoria(nombre))
+
+    def productos_de(self, categoria):
+        """IDs de los productos de una categoría (sin importar mayúsculas)."""
+        cat = self.categoria_canonica(categoria)
+        return self.por_categoria.get(cat, [])
+
+    def producto(self, pid):
+        return self.productos.get(pid)
@@ -0,0 +1,131 @@
+# intenciones.py
+from collections import namedtuple
+
+# Estados en los que el mensaje se toma como texto libre (nombre, teléfono...)
+REGISTRO = ("registrando_nombre", "registrando_telefono", "registrando_direccion")
+COMPRANDO = ("elige_categoria", "mostrando_producto", "resultados_busqueda")
+
+
+class Intencion(namedtuple(
+    "Intencion", "nombre contiene inicio exacto estados excepto",
+    defaults=((), (), (), None, ()),
+)):
+    """
+    Una intención y las frases que la activan (ya normalizadas):
+      - contiene: la frase aparece en cualquier parte del mensaje
+      - inicio:   el mensaje empieza con la frase (lo demás son argumentos)
+      - exacto:   el mensaje es exactamente la frase
+    `estados` limita la intención a esos estados; `excepto` la apaga en ellos.
+    """
+
+
+# El orden es la prioridad: si varias coinciden, gana la primera.
+INTENCIONES = [
+    Intencion("saludo", contiene=["hola", "buenas", "hello"]),
+    Intencion("contacto", contiene=["contacto", "contactos", "whatsapp"]),
+    Intencion("horario", contiene=["horario", "horarios"]),
+    Intencion("registrar", exacto=["registrar", "crear cuenta", "soy nuevo", "soy nueva"]),
+    Intencion("iniciar_sesion", inicio=["iniciar sesion"], exacto=["entrar"], excepto=REGISTRO),
+    Intencion(
+        "mis_pedidos",
+        contiene=["mis pedidos", "mis compras", "historial"],
+        excepto=REGISTRO + ("login",),
+    ),
+    Intencion(
+        "mas_pedidos",
+        exacto=["mas pedidos", "ver mas pedidos", "otros pedidos"],
+        excepto=REGISTRO + ("login",),
+    ),
+    Intencion(
+        "consultar_pedido",
+        inicio=["ver pedido", "consultar pedido", "consultar", "estado pedido"],
+        excepto=REGISTRO + ("login",),
+    ),
+    Intencion(
+        "buscar",
+        inicio=["busco", "buscar", "busca", "buscando", "estoy buscando", "quiero buscar"],
+        excepto=REGISTRO + ("login",),
+    ),
+    Intencion("catalogo", contiene=["catalogo", "catalogos"], excepto=REGISTRO + ("login",)),
+    Intencion(
+        "finalizar",
+        contiene=[
+            "finalizar", "finaliza", "cerrar", "terminar", "completar", "listo",
+            "ya esta", "ya es todo", "es todo",
+        ],
+        exacto=["ya", "fin"],
+        estados=COMPRANDO,
+    ),
+    Intencion("siguiente", exacto=["no", "siguiente", "next", "n", "skip"], estados=("mostrando_producto",)),
+    Intencion("agregar", inicio=["si", "pedido"], estados=("mostrando_producto", "resultados_busqueda")),
+    Intencion("entrega_domicilio", contiene=["domicilio", "casa", "enviar"], estados=("elige_entrega",)),
+    Intencion("entrega_tienda", contiene=["recoger", "tienda", "pick"], estados=("elige_entrega",)),
+]
+
+
+Coincidencia = namedtuple("Coincidencia", "nombre args")
+
+
+class _Nodo:
+    __slots__ = ("hijos", "finales")
+
+    def __init__(self):
+        self.hijos = {}
+        self.finales = []   # [(prioridad, modo)]
+
+
+class Clasificador:
+    """
+    Compila la tabla de intenciones en un trie de palabras y clasifica un
+    mensaje en una sola pasada: desde cada palabra se baja por el trie
+    mientras haya camino, así el costo depende del largo del mensaje y no
+    de cuántas frases haya en la tabla.
+    """
+
+    def __init__(self, intenciones=INTENCIONES):
+        self.intenciones = list(intenciones)
+        self._raiz = _Nodo()
+        for prioridad, intencion in enumerate(self.intenciones):
+            for modo in ("contiene", "inicio", "exacto"):
+                for frase in getattr(intencion, modo):
+                    nodo = self._raiz
+                    for palabra in frase.split():
+                        nodo = nodo.hijos.setdefault(palabra, _Nodo())
+                    nodo.finales.append((prioridad, modo))
+
+    def _permitida(self, prioridad, estado):
+        intencion = self.intenciones[prioridad]
+        if intencion.estados is not None and estado not in intencion.estados:
+            return False
+        return estado not in intencion.excepto
+
+    def clasificar(self, msg, estado="inicio"):
+        """Devuelve Coincidencia(nombre, args) o None si ninguna intención aplica."""
+        tokens = msg.split()
+        n = len(tokens)
+        mejor = None  # (prioridad, fin de la frase)
+
+        for i in range(n):
+            nodo = self._raiz
+            j = i
+            while j < n:
+                nodo = nodo.hijos.get(tokens[j])
+                if nodo is None:
+                    break
+                j += 1
+                for prioridad, modo in nodo.finales:
+                    # misma intención: la frase más larga deja los argumentos limpios
+                    if mejor is not None and (prioridad, -j) >= (mejor[0], -mejor[1]):
+                        continue
+                    if modo == "inicio" and i != 0:
+                        continue
+                    if modo == "exacto" and (i != 0 or j != n):
+                        continue
+                    if not self._permitida(prioridad, estado):
+                        continue
+                    mejor = (prioridad, j)
+
+        if mejor is None:
+            return None
+        prioridad, fin = mejor
+        return Coincidencia(self.intenciones[prioridad].nombre, tokens[fin:])
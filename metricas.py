@@ -0,0 +1,204 @@
+# metricas.py
+"""
+Contadores e histogramas en memoria con salida en formato de texto de
+Prometheus (para /metrics). Con METRICAS=0 todo queda en no-ops.
+"""
+import bisect
+import os
+import threading
+import time
+
+ACTIVAS = os.getenv("METRICAS", "1") == "1"
+
+# Segundos: de 0.1 ms a 10 s
+BUCKETS_LATENCIA = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    pares = ",".join(f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores))
+    return "{" + pares + "}"
+
+
+class Contador:
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n=1, *valores):
+        if not ACTIVAS:
+            return
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + n
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for valores, total in sorted(self._valores.items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {total}")
+        return lineas
+
+
+class Histograma:
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}   # valores -> [conteos por bucket..., suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores):
+        if not ACTIVAS:
+            return
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def medir(self, *valores):
+        """Context manager que observa la duración del bloque."""
+        if not ACTIVAS:
+            return _NULO
+        return _Cronometro(self, valores)
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        nombres = self.etiquetas + ("le",)
+        for valores, serie in sorted(self._series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, serie):
+                acumulado += conteo
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(nombres, valores + (limite,))} {acumulado}")
+            lineas.append(f"{self.nombre}_bucket{_etiquetas(nombres, valores + ('+Inf',))} {serie[-1]}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {serie[-2]}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {serie[-1]}")
+        return lineas
+
+
+class Gauge:
+    """Valor que se calcula al momento de exportar: funcion() -> {valores: numero}."""
+
+    def __init__(self, nombre, ayuda, funcion, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.etiquetas = tuple(etiquetas)
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge"]
+        try:
+            valores = self.funcion()
+        except Exception as e:
+            print(f"🔥 Error al calcular {self.nombre}:", e)
+            return lineas
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        for etiquetas, valor in sorted(valores.items()):
+            if not isinstance(etiquetas, tuple):
+                etiquetas = (etiquetas,)
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {float(valor)}")
+        return lineas
+
+
+class _Cronometro:
+    __slots__ = ("histograma", "valores", "inicio")
+
+    def __init__(self, histograma, valores):
+        self.histograma = histograma
+        self.valores = valores
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio, *self.valores)
+        return False
+
+
+class _Nulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULO = _Nulo()
+
+
+# ------------------------------------------------------------
+# REGISTRO GLOBAL
+# ------------------------------------------------------------
+_metricas = {}
+
+
+def _registrar(metrica):
+    return _metricas.setdefault(metrica.nombre, metrica)
+
+
+def contador(nombre, ayuda, etiquetas=()):
+    return _registrar(Contador(nombre, ayuda, etiquetas))
+
+
+def histograma(nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+    return _registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+
+def gauge(nombre, ayuda, funcion, etiquetas=()):
+    _metricas[nombre] = Gauge(nombre, ayuda, funcion, etiquetas)
+    return _metricas[nombre]
+
+
+def exportar():
+    """Todas las métricas en formato de texto de Prometheus."""
+    lineas = []
+    for nombre in sorted(_metricas):
+        lineas.extend(_metricas[nombre].exportar())
+    return "\n".join(lineas) + "\n"
+
+
+# ------------------------------------------------------------
+# MÉTRICAS COMPARTIDAS ENTRE MÓDULOS
+# ------------------------------------------------------------
+ETAPAS = histograma(
+    "bot_etapa_segundos", "Duración de cada etapa al atender un evento del webhook", ("etapa",)
+)
+FIRESTORE_LECTURAS = contador(
+    "bot_firestore_lecturas_total", "Lecturas de documentos de Firestore", ("origen",)
+)
+FIRESTORE_LECTURA_SEGUNDOS = histograma(
+    "bot_firestore_lectura_segundos", "Latencia de lecturas a Firestore", ("origen",)
+)
+FIRESTORE_ESCRITURAS = contador(
+    "bot_firestore_escrituras_total", "Escrituras de documentos enviadas a Firestore", ("resultado",)
+)
+FIRESTORE_COMMIT_SEGUNDOS = histograma(
+    "bot_firestore_commit_segundos", "Latencia de cada commit de batch a Firestore"
+)
+ENVIOS = contador(
+    "bot_envios_total", "Mensajes enviados a la Send API", ("resultado",)
+)
+ENVIO_SEGUNDOS = histograma(
+    "bot_envio_segundos", "Latencia de las peticiones a la Send API"
+)
@@ -0,0 +1,92 @@
+# normalizacion.py
+import string
+import unicodedata
+from functools import lru_cache
+
+# Mensajes de hasta este largo pasan por la caché ("si", "no", "siguiente"...)
+LARGO_CACHE = 32
+
+
+def _normalizar_lento(t):
+    """Versión de referencia: NFD, quitar marcas y puntuación, un solo espacio."""
+    t = unicodedata.normalize("NFD", t)
+    t = "".join(c for c in t if not unicodedata.combining(c))
+    t = t.translate(_SIN_PUNTUACION)
+    return " ".join(t.split())
+
+
+_SIN_PUNTUACION = str.maketrans("", "", string.punctuation)
+
+
+def _construir_tabla():
+    # Cada carácter latino con acento se resuelve una sola vez con la
+    # versión lenta; los que no cambian no entran en la tabla.
+    tabla = dict(_SIN_PUNTUACION)
+    for cp in range(0x80, 0x2000):
+        c = chr(cp)
+        plano = "".join(
+            x for x in unicodedata.normalize("NFD", c) if not unicodedata.combining(x)
+        ).translate(_SIN_PUNTUACION)
+        if plano != c:
+            tabla[cp] = plano
+    return tabla
+
+
+_TABLA = _construir_tabla()
+
+# Caracteres que la normalización deja tal cual (ASCII y los emojis u otros
+# símbolos que ya se hayan visto); se usa para no caer en la versión lenta.
+_ESTABLES = {chr(cp) for cp in range(0x80)}
+
+
+def _estable(c):
+    if unicodedata.combining(c) or unicodedata.normalize("NFD", c) != c:
+        return False
+    _ESTABLES.add(c)
+    return True
+
+
+def _normalizar(t):
+    t = t.lower().translate(_TABLA)
+    if not t.isascii():
+        # Fuera de la tabla solo hay emojis, CJK, etc.; si alguno cambia
+        # con NFD se usa la versión de referencia.
+        for c in set(t).difference(_ESTABLES):
+            if not _estable(c):
+                return _normalizar_lento(t)
+    return " ".join(t.split())
+
+
+_normalizar_corto = lru_cache(maxsize=4096)(_normalizar)
+
+
+def normalizar(t):
+    """
+    Minúsculas, sin acentos, sin puntuación y con un solo espacio entre
+    palabras: "¡Sí, quiero!" -> "si quiero".
+    """
+    if not t:
+        return ""
+    if len(t) <= LARGO_CACHE:
+        return _normalizar_corto(t)
+    return _normalizar(t)
+
+
+def palabras_originales(texto, palabras):
+    """
+    Las últimas palabras de `texto` tal como se escribieron (con sus
+    mayúsculas, sin puntuación) si normalizadas dan `palabras`; si no
+    cuadran, `palabras` tal cual. Para argumentos que distinguen
+    mayúsculas, como los IDs de Firestore.
+    """
+    if not palabras:
+        return palabras
+    originales = []
+    for palabra in (texto or "").split():
+        plana = normalizar(palabra)
+        if plana:
+            originales.append((plana, "".join(c for c in palabra if c.isalnum())))
+    ultimas = originales[-len(palabras):]
+    if [plana for plana, _ in ultimas] != list(palabras):
+        return palabras
+    return [original for _, original in ultimas]
@@ -0,0 +1,66 @@
+# perfiles.py
+import os
+
+import metricas
+from cache_ttl import CacheTTL
+from conexion_firebase import db
+
+
+class PerfilesUsuarios:
+    """
+    Perfiles de la colección 'usuarios' en caché, por teléfono y por PSID
+    de Messenger. Un cliente que ya inició sesión desde el mismo PSID se
+    reconoce sin leer Firestore; los registros nuevos actualizan la caché.
+    """
+
+    def __init__(self, db, maximo=None, ttl=None, ttl_negativo=None, ttl_psid=None):
+        self.db = db
+        maximo = maximo or int(os.getenv("PERFILES_CACHE_MAX", "20000"))
+        self.por_telefono = CacheTTL(
+            maximo=maximo,
+            ttl=ttl or float(os.getenv("PERFILES_CACHE_TTL", "3600")),
+            ttl_negativo=ttl_negativo or float(os.getenv("PERFILES_CACHE_TTL_NEGATIVO", "30")),
+        )
+        # PSID -> teléfono
+        self.por_psid = CacheTTL(
+            maximo=maximo,
+            ttl=ttl_psid or float(os.getenv("PERFILES_PSID_TTL", str(7 * 24 * 3600))),
+        )
+
+    def _leer(self, telefono):
+        metricas.FIRESTORE_LECTURAS.inc(1, "usuarios")
+        with metricas.FIRESTORE_LECTURA_SEGUNDOS.medir("usuarios"):
+            doc = self.db.collection("usuarios").document(telefono).get()
+        if not doc.exists:
+            return None
+        return doc.to_dict()
+
+    def obtener(self, telefono):
+        """Perfil por teléfono (None si no está registrado)."""
+        if not telefono:
+            return None
+        return self.por_telefono.obtener(telefono, self._leer)
+
+    def ultimo_telefono(self, psid):
+        """Último teléfono con el que entró este PSID (sin leer el perfil), o None."""
+        return self.por_psid.consultar(psid)
+
+    def de_psid(self, psid):
+        """Perfil del último teléfono con el que entró este PSID, o None."""
+        telefono = self.por_psid.consultar(psid)
+        if telefono is None:
+            return None
+        perfil = self.obtener(telefono)
+        if perfil is None:
+            return None
+        return telefono, perfil
+
+    def recordar_psid(self, psid, telefono):
+        self.por_psid.poner(psid, telefono)
+
+    def guardar(self, telefono, datos):
+        """Refleja en la caché un perfil que se acaba de escribir."""
+        self.por_telefono.poner(telefono, dict(datos))
+
+
+perfiles = PerfilesUsuarios(db)
@@ -0,0 +1,130 @@
+# plantillas.py
+import threading
+
+ENCABEZADO_CATEGORIAS = "🛍 *Categorías disponibles:*\n\n"
+PIE_CATEGORIAS = "\n👉 Escribe el número o el nombre de la categoría que quieres ver."
+ENCABEZADO_OTRAS = "Otras categorías disponibles:\n"
+PIE_OTRAS = "\n👉 Escribe la siguiente categoría o *finalizar pedido*."
+
+
+# ------------------------------------------------------------
+# TEXTOS (se arman una vez por versión del catálogo)
+# ------------------------------------------------------------
+def lista_numerada(elementos):
+    return "".join([f"{i}. {e}\n" for i, e in enumerate(elementos, 1)])
+
+
+def texto_producto(pid, datos):
+    nombre = datos.get("nombre", "Sin nombre")
+    precio = datos.get("precio", "N/A")
+    return (
+        f"🔹 *{nombre}*\n"
+        f"💰 ${precio} MXN\n"
+        f"🆔 ID: {pid}\n\n"
+        "Para agregarlo al pedido puedes escribir:\n"
+        f"• *si {pid}*\n"
+        f"• *sí {pid}*\n"
+        f"• *pedido {pid}*\n"
+        f"• o solo el ID: *{pid}*\n\n"
+        "Para pasar al siguiente: *no* o *siguiente*\n"
+        "Para terminar: *finalizar pedido*"
+    )
+
+
+def tarjeta_producto(pid, datos):
+    tarjeta = {
+        "title": str(datos.get("nombre", "Sin nombre"))[:80],
+        "subtitle": f"💰 ${datos.get('precio', 'N/A')} MXN · ID: {pid}"[:80],
+        "buttons": [{"type": "postback", "title": "Agregar", "payload": f"AGREGAR:{pid}"}],
+    }
+    if datos.get("imagen_url"):
+        tarjeta["image_url"] = datos["imagen_url"]
+    return tarjeta
+
+
+# ------------------------------------------------------------
+# CACHÉ POR VERSIÓN
+# ------------------------------------------------------------
+class Plantillas:
+    """
+    Menús de categorías, textos de producto y tarjetas del carrusel ya
+    armados. Solo cambian cuando cambia el catálogo, así que se guardan
+    hasta que `version()` devuelve otra cosa y entonces se tiran todos.
+    Al enviar solo se agrega lo de cada usuario (p. ej. la categoría que
+    acaba de terminar).
+
+    `producto(pid)` da los datos cuando una tarjeta no está armada. Lo que
+    devuelve esta clase se comparte entre usuarios: no se debe modificar.
+    """
+
+    def __init__(self, version, producto, maximo=50000):
+        self._version = version
+        self._producto = producto
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._datos = {}
+        self._en_version = None
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.versiones = 0
+
+    def _obtener(self, clave, armar):
+        version = self._version()
+        datos = self._datos
+        if version != self._en_version:
+            with self._lock:
+                if version != self._en_version:
+                    self._datos = {}
+                    self._en_version = version
+                    self.versiones += 1
+                datos = self._datos
+        valor = datos.get(clave)
+        if valor is not None:
+            self.aciertos += 1
+            return valor
+        self.fallos += 1
+        valor = armar()
+        if len(datos) < self.maximo:
+            datos[clave] = valor
+        return valor
+
+    def _datos_de(self, pid, datos):
+        if datos is None:
+            datos = self._producto(pid)
+        return datos or {}
+
+    # --------------------------------------------------------
+    # PLANTILLAS
+    # --------------------------------------------------------
+    def menu_categorias(self, categorias):
+        """Menú completo de categorías."""
+        return self._obtener(
+            ("menu", tuple(categorias)),
+            lambda: ENCABEZADO_CATEGORIAS + lista_numerada(categorias) + PIE_CATEGORIAS,
+        )
+
+    def otras_categorias(self, pendientes):
+        """Lista de las categorías que le faltan al usuario, con su pie."""
+        return self._obtener(
+            ("otras", tuple(pendientes)),
+            lambda: ENCABEZADO_OTRAS + lista_numerada(pendientes) + PIE_OTRAS,
+        )
+
+    def texto_producto(self, pid, datos=None):
+        return self._obtener(
+            ("texto", pid), lambda: texto_producto(pid, self._datos_de(pid, datos))
+        )
+
+    def tarjeta_producto(self, pid, datos=None):
+        return self._obtener(
+            ("tarjeta", pid), lambda: tarjeta_producto(pid, self._datos_de(pid, datos))
+        )
+
+    def estadisticas(self):
+        return {
+            "entradas": len(self._datos),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "versiones": self.versiones,
+        }
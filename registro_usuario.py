@@ -1,6 +1,7 @@
 # registro_usuario.py
 from datetime import datetime
 from conexion_firebase import db  # 🔥 Importa la conexión ya inicializada
+from perfiles import perfiles
 
 def registrar_usuario(telefono: str, nombre: str, direccion: str = "") -> str:
     """
@@ -10,7 +11,7 @@ def registrar_usuario(telefono: str, nombre: str, direccion: str = "") -> str:
     usuarios_ref = db.collection("usuarios")
     usuario_doc = usuarios_ref.document(telefono)
     
-    if usuario_doc.get().exists:
+    if perfiles.obtener(telefono) is not None:
         return f"Ya estás registrado, {nombre}."
 
     datos = {
@@ -23,6 +24,7 @@ def registrar_usuario(telefono: str, nombre: str, direccion: str = "") -> str:
 
     try:
         usuario_doc.set(datos)
+        perfiles.guardar(telefono, datos)
         return f"✅ ¡Registro exitoso, {nombre}! Ahora puedes realizar pedidos."
     except Exception as e:
         print("🔥 Error en registrar_usuario():", e)
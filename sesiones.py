@@ -0,0 +1,334 @@
+# sesiones.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+# Segundos de inactividad tras los que se descarta una sesión
+SESION_TTL = float(os.getenv("SESION_TTL", str(3 * 24 * 3600)))
+# Máximo de sesiones en memoria por proceso (se descartan las menos recientes)
+SESIONES_MAX = int(os.getenv("SESIONES_MAX", "10000"))
+
+
+# ------------------------------------------------------------
+# INTERFAZ
+# ------------------------------------------------------------
+class AlmacenSesiones:
+    """
+    Dónde viven los estados de conversación de cada usuario.
+
+    Un backend implementa obtener/guardar/eliminar y un bloqueo por usuario;
+    `transaccion()` los junta en un leer-modificar-escribir atómico.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = SESION_TTL if ttl is None else ttl
+
+    def obtener(self, clave):
+        raise NotImplementedError
+
+    def guardar(self, clave, datos):
+        raise NotImplementedError
+
+    def eliminar(self, clave):
+        raise NotImplementedError
+
+    def bloquear(self, clave):
+        """Context manager que excluye a otros escritores del mismo usuario."""
+        raise NotImplementedError
+
+    def contar_por_estado(self):
+        """{estado: número de sesiones vigentes} (para métricas)."""
+        raise NotImplementedError
+
+    @contextmanager
+    def transaccion(self, clave):
+        """
+        Entrega la sesión (o None si no existe) dentro de una lista de un
+        elemento; lo que quede en caja[0] al salir se guarda.
+        """
+        with self.bloquear(clave):
+            caja = [self.obtener(clave)]
+            yield caja
+            if caja[0] is None:
+                self.eliminar(clave)
+            else:
+                self.guardar(clave, caja[0])
+
+
+# ------------------------------------------------------------
+# BACKEND EN MEMORIA (un solo proceso)
+# ------------------------------------------------------------
+class AlmacenMemoria(AlmacenSesiones):
+    """
+    Sesiones en un OrderedDict ordenado por último uso: las inactivas se
+    quedan al frente, así purgarlas y respetar `maximo` cuesta solo lo que
+    se descarta.
+    """
+
+    def __init__(self, ttl=None, maximo=None):
+        super().__init__(ttl)
+        self.maximo = SESIONES_MAX if maximo is None else maximo
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self._bloqueos = {}
+        self.descartadas = 0
+
+    def obtener(self, clave):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            datos, expira = item
+            if expira < time.time():
+                del self._datos[clave]
+                self.descartadas += 1
+                return None
+            self._datos.move_to_end(clave)
+            return datos
+
+    def guardar(self, clave, datos):
+        ahora = time.time()
+        with self._lock:
+            self._datos[clave] = (datos, ahora + self.ttl)
+            self._datos.move_to_end(clave)
+            self._purgar(ahora)
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def _purgar(self, ahora):
+        while self._datos:
+            clave, (_, expira) = next(iter(self._datos.items()))
+            if expira >= ahora and len(self._datos) <= self.maximo:
+                break
+            del self._datos[clave]
+            self.descartadas += 1
+
+    def __len__(self):
+        return len(self._datos)
+
+    def contar_por_estado(self):
+        ahora = time.time()
+        with self._lock:
+            items = list(self._datos.values())
+        conteo = {}
+        for datos, expira in items:
+            if expira >= ahora:
+                estado = datos.get("estado", "inicio")
+                conteo[estado] = conteo.get(estado, 0) + 1
+        return conteo
+
+    @contextmanager
+    def bloquear(self, clave):
+        with self._lock:
+            lock, usos = self._bloqueos.get(clave, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._bloqueos[clave] = (lock, usos + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, usos = self._bloqueos[clave]
+                if usos == 1:
+                    del self._bloqueos[clave]
+                else:
+                    self._bloqueos[clave] = (lock, usos - 1)
+
+
+def _compacto(datos):
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":"))
+
+
+# ------------------------------------------------------------
+# BACKEND SQLITE (compartido entre workers del mismo nodo)
+# ------------------------------------------------------------
+class AlmacenSQLite(AlmacenSesiones):
+    """
+    Sesiones en un archivo SQLite en modo WAL. El bloqueo por usuario es un
+    arrendamiento en la tabla `bloqueos`, así sirve entre procesos; si un
+    worker muere con el bloqueo tomado, éste vence solo.
+    """
+
+    def __init__(self, ruta, ttl=None, duracion_bloqueo=30.0, espera_bloqueo=10.0):
+        super().__init__(ttl)
+        self.ruta = ruta
+        self.duracion_bloqueo = duracion_bloqueo
+        self.espera_bloqueo = espera_bloqueo
+        self._local = threading.local()
+        self._memoria = AlmacenMemoria(ttl)  # bloqueo entre hilos del proceso
+        self._escrituras = 0
+
+        con = self._con()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS sesiones ("
+            " clave TEXT PRIMARY KEY, datos TEXT NOT NULL, expira REAL NOT NULL)"
+        )
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS bloqueos ("
+            " clave TEXT PRIMARY KEY, dueno TEXT NOT NULL, hasta REAL NOT NULL)"
+        )
+
+    def _con(self):
+        # sqlite3 no comparte conexiones entre hilos ni a través de fork
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.ruta, timeout=self.espera_bloqueo, isolation_level=None)
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    def obtener(self, clave):
+        fila = self._con().execute(
+            "SELECT datos, expira FROM sesiones WHERE clave = ?", (clave,)
+        ).fetchone()
+        if fila is None:
+            return None
+        if fila[1] < time.time():
+            self.eliminar(clave)
+            return None
+        return json.loads(fila[0])
+
+    def guardar(self, clave, datos):
+        self._con().execute(
+            "INSERT INTO sesiones (clave, datos, expira) VALUES (?, ?, ?) "
+            "ON CONFLICT(clave) DO UPDATE SET datos = excluded.datos, expira = excluded.expira",
+            (clave, _compacto(datos), time.time() + self.ttl),
+        )
+        self._escrituras += 1
+        if self._escrituras % 1000 == 0:
+            self.purgar()
+
+    def eliminar(self, clave):
+        self._con().execute("DELETE FROM sesiones WHERE clave = ?", (clave,))
+
+    def contar_por_estado(self):
+        filas = self._con().execute(
+            "SELECT COALESCE(json_extract(datos, '$.estado'), 'inicio'), COUNT(*) "
+            "FROM sesiones WHERE expira >= ? GROUP BY 1",
+            (time.time(),),
+        ).fetchall()
+        return dict(filas)
+
+    def purgar(self):
+        """Borra las sesiones vencidas."""
+        self._con().execute("DELETE FROM sesiones WHERE expira < ?", (time.time(),))
+
+    @contextmanager
+    def bloquear(self, clave):
+        with self._memoria.bloquear(clave):
+            dueno = uuid.uuid4().hex
+            self._tomar(clave, dueno)
+            try:
+                yield
+            finally:
+                self._con().execute(
+                    "DELETE FROM bloqueos WHERE clave = ? AND dueno = ?", (clave, dueno)
+                )
+
+    def _tomar(self, clave, dueno):
+        limite = time.monotonic() + self.espera_bloqueo
+        pausa = 0.002
+        while True:
+            ahora = time.time()
+            cur = self._con().execute(
+                "INSERT INTO bloqueos (clave, dueno, hasta) VALUES (?, ?, ?) "
+                "ON CONFLICT(clave) DO UPDATE SET dueno = excluded.dueno, hasta = excluded.hasta "
+                "WHERE bloqueos.hasta < ?",
+                (clave, dueno, ahora + self.duracion_bloqueo, ahora),
+            )
+            if cur.rowcount == 1:
+                return
+            if time.monotonic() > limite:
+                raise TimeoutError(f"No se pudo bloquear la sesión {clave}")
+            time.sleep(pausa)
+            pausa = min(pausa * 2, 0.05)
+
+
+def crear_almacen(url=None):
+    """
+    Crea el almacén según SESIONES_URL:
+      - "memoria" (por defecto): un dict en el proceso.
+      - "sqlite:///ruta/sesiones.db": archivo compartido por los workers.
+    """
+    url = url or os.getenv("SESIONES_URL", "memoria")
+    if url == "memoria":
+        return AlmacenMemoria()
+    if url.startswith("sqlite:///"):
+        return AlmacenSQLite(url[len("sqlite:///"):])
+    raise ValueError(f"❌ SESIONES_URL no soportada: {url}")
+
+
+# ------------------------------------------------------------
+# VISTA TIPO DICT PARA app.py
+# ------------------------------------------------------------
+class EstadoUsuarios(MutableMapping):
+    """
+    Se usa como el antiguo dict `user_state[sender_id]`.
+
+    Dentro de `with estado.sesion(sender_id):` la sesión de ese usuario está
+    cargada y bloqueada en el hilo actual; al salir se guarda en el almacén.
+    Fuera de ese bloque las lecturas van directo al almacén.
+    """
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self._local = threading.local()
+
+    def _abiertas(self):
+        abiertas = getattr(self._local, "abiertas", None)
+        if abiertas is None:
+            abiertas = self._local.abiertas = {}
+        return abiertas
+
+    @contextmanager
+    def sesion(self, clave):
+        abiertas = self._abiertas()
+        with self.almacen.transaccion(clave) as caja:
+            abiertas[clave] = caja
+            try:
+                yield
+            finally:
+                del abiertas[clave]
+
+    def __getitem__(self, clave):
+        caja = self._abiertas().get(clave)
+        datos = caja[0] if caja is not None else self.almacen.obtener(clave)
+        if datos is None:
+            raise KeyError(clave)
+        return datos
+
+    def __setitem__(self, clave, datos):
+        caja = self._abiertas().get(clave)
+        if caja is not None:
+            caja[0] = datos
+        else:
+            with self.almacen.transaccion(clave) as caja:
+                caja[0] = datos
+
+    def __delitem__(self, clave):
+        self[clave]
+        self.__setitem__(clave, None)
+
+    def __contains__(self, clave):
+        try:
+            self[clave]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._abiertas())
+
+    def __len__(self):
+        return len(self._abiertas())